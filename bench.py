@@ -0,0 +1,416 @@
+"""Benchmark offline cho bot_v2.py: Google Sheets giả + Telegram Bot API giả.
+
+Chạy N người dùng ảo qua toàn bộ luồng đặt hàng:
+
+    /start → nút lang_vi → /menu → /add → /order → SĐT → địa chỉ → order_yes
+
+rồi in throughput và p50/p95/p99 latency theo từng handler. Không cần mạng:
+Sheets được thay bằng worksheet giả (có độ trễ cấu hình được, chạy blocking
+trong pool luồng như gspread thật), còn Bot API được thay bằng một
+`BaseRequest` giả ghi lại mọi lệnh gửi. Cùng `--seed` cho cùng kết quả (trừ
+nhiễu của máy), nên có thể so sánh giữa các commit:
+
+    python bench.py --users 200 --sheets-latency-ms 300 --json > before.json
+"""
+
+from telegram.ext import ApplicationBuilder
+from telegram.request import BaseRequest
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+FAKE_TOKEN = "123456:BENCHMARK"
+ADMIN_CHAT = -1000
+
+# Thứ tự các bước của một người dùng ảo: (tên handler, hàm dựng update)
+STEPS = [
+    "start",
+    "lang_button",
+    "menu_cmd",
+    "add_cmd",
+    "order_start",
+    "order_phone",
+    "order_address",
+    "order_confirm_button",
+]
+
+
+# ================== GOOGLE SHEETS GIẢ ==================
+
+
+class FakeCell:
+    def __init__(self, value):
+        self.value = value
+
+
+class FakeWorksheet:
+    """Worksheet giả, mỗi lệnh ngủ (blocking) một khoảng latency ± jitter."""
+
+    def __init__(self, title: str, rows: list, latency: float, jitter: float, seed: int):
+        self.title = title
+        self.rows = rows
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _io(self, name: str):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def get_all_records(self):
+        self._io("get_all_records")
+        header = self.rows[0]
+        return [dict(zip(header, row)) for row in self.rows[1:]]
+
+    def get_all_values(self):
+        self._io("get_all_values")
+        return [list(row) for row in self.rows]
+
+    # Số dòng trống cuối lưới, như sheet thật (row_count > số dòng có dữ liệu)
+    BLANK_ROWS = 100
+
+    @property
+    def row_count(self) -> int:
+        return len(self.rows) + self.BLANK_ROWS
+
+    @staticmethod
+    def _split_a1(label: str):
+        letters = label.rstrip("0123456789")
+        col = 0
+        for ch in letters:
+            col = col * 26 + ord(ch.upper()) - ord("A") + 1
+        return col, int(label[len(letters):]) if label[len(letters):] else None
+
+    def _cells(self, a1: str) -> list:
+        """Vùng chữ nhật: "J2:J" (tới hết), "A5:J9", "A5"; dòng trống cuối bị bỏ như API."""
+        start, _, end = a1.partition(":")
+        first_col, first = self._split_a1(start)
+        last_col, last = self._split_a1(end or start)
+        first = first or 1
+        if last is None:
+            last = first if not end else len(self.rows)
+        cells = [
+            [str(value) for value in row[first_col - 1 : last_col]]
+            for row in self.rows[first - 1 : last]
+        ]
+        while cells and not cells[-1]:
+            cells.pop()
+        return cells
+
+    def batch_get(self, ranges: list, **kwargs):
+        self._io("batch_get")
+        return [self._cells(a1) for a1 in ranges]
+
+    def get_values(self, range_name: str, **kwargs):
+        self._io("get_values")
+        return self._cells(range_name)
+
+    def col_values(self, col: int):
+        self._io("col_values")
+        return [row[col - 1] if len(row) >= col else "" for row in self.rows]
+
+    def acell(self, label: str):
+        self._io("acell")
+        return FakeCell("1")
+
+    def append_row(self, values, **kwargs):
+        self._io("append_row")
+        with self._lock:
+            self.rows.append(list(values))
+
+    def append_rows(self, values, **kwargs):
+        self._io("append_rows")
+        with self._lock:
+            first = len(self.rows) + 1
+            self.rows.extend(list(row) for row in values)
+            last = len(self.rows)
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:J{last}"}}
+
+    def batch_update(self, data, **kwargs):
+        self._io("batch_update")
+
+    def update_cell(self, row, col, value):
+        self._io("update_cell")
+
+
+class FakeSpreadsheet:
+    def __init__(self, menu_items: int, latency: float, jitter: float, seed: int):
+        menu = [["id", "name_vi", "name_en", "price", "image_url", "status", "category"]]
+        for i in range(1, menu_items + 1):
+            menu.append(
+                [
+                    f"F{i:02d}",
+                    f"Món số {i}",
+                    f"Dish {i}",
+                    str(20000 + 5000 * (i % 8)),
+                    f"https://img.example/{i}.jpg" if i % 3 == 0 else "",
+                    "sold_out" if i % 11 == 0 else "active",
+                    f"Nhóm {i % 4}",
+                ]
+            )
+        orders = [
+            [
+                "order_id",
+                "user_id",
+                "username",
+                "phone",
+                "items_text",
+                "total",
+                "address",
+                "lang",
+                "created_at",
+                "status",
+            ]
+        ]
+        settings = [["key", "value"], ["language_default", "vi"]]
+        self.sheets = {
+            "MENU": FakeWorksheet("MENU", menu, latency, jitter, seed),
+            "ORDERS": FakeWorksheet("ORDERS", orders, latency, jitter, seed + 1),
+            "SETTINGS": FakeWorksheet("SETTINGS", settings, latency, jitter, seed + 2),
+        }
+
+    def worksheet(self, name: str):
+        return self.sheets[name]
+
+
+# ================== TELEGRAM BOT API GIẢ ==================
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Thay tầng HTTP của python-telegram-bot: trả JSON hợp lệ, ghi lại mọi lệnh."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = {}
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params: dict) -> dict:
+        self._message_id += 1
+        chat_id = int(params.get("chat_id") or 0)
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "text": params.get("text", ""),
+        }
+        return message
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {
+                "id": 123456,
+                "is_bot": True,
+                "first_name": "Bench",
+                "username": "bench_bot",
+            }
+        elif endpoint == "sendPhoto":
+            result = self._message(params)
+            photo = params.get("photo")
+            file_id = photo if isinstance(photo, str) and not photo.startswith("http") else f"file-{self._message_id}"
+            result["photo"] = [
+                {"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}
+            ]
+        elif endpoint in ("sendMessage", "editMessageText", "editMessageReplyMarkup", "editMessageCaption"):
+            result = self._message(params)
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+# ================== NGƯỜI DÙNG ẢO ==================
+
+
+def user_payload(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"u{user_id}"}
+
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user_payload(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user_payload(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "bench",
+            },
+        },
+    }
+
+
+def user_script(user_id: int, rng: random.Random, menu_items: int) -> list:
+    """Danh sách (tên handler, update JSON) của một người dùng ảo."""
+    item = f"F{rng.randint(1, menu_items):02d}"
+    qty = rng.randint(1, 3)
+    base = user_id * 100
+    return [
+        ("start", message_update(base + 1, user_id, "/start")),
+        ("lang_button", callback_update(base + 2, user_id, "lang_vi")),
+        ("menu_cmd", message_update(base + 3, user_id, "/menu")),
+        ("add_cmd", message_update(base + 4, user_id, f"/add {item} {qty}")),
+        ("order_start", message_update(base + 5, user_id, "/order")),
+        ("order_phone", message_update(base + 6, user_id, f"09{user_id:08d}")),
+        ("order_address", message_update(base + 7, user_id, f"{user_id} Đường Bench")),
+        ("order_confirm_button", callback_update(base + 8, user_id, "order_yes")),
+    ]
+
+
+# ================== CHẠY & BÁO CÁO ==================
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def run_benchmark(args) -> dict:
+    import bot_v2
+    from telegram import Update
+
+    spreadsheet = FakeSpreadsheet(
+        args.menu_items, args.sheets_latency_ms / 1000, args.jitter_ms / 1000, args.seed
+    )
+    bot_v2.sheets._open_spreadsheet = lambda: spreadsheet
+
+    request = FakeTelegramRequest(args.telegram_latency_ms / 1000)
+    builder = ApplicationBuilder().token(FAKE_TOKEN).request(request).get_updates_request(request)
+    app = bot_v2.build_app(builder)
+
+    await app.initialize()
+    await app.post_init(app)
+    await bot_v2.readiness._task
+
+    rng = random.Random(args.seed)
+    scripts = [user_script(1000 + i, rng, args.menu_items) for i in range(args.users)]
+    latencies = {name: [] for name in STEPS}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_user(script):
+        async with semaphore:
+            for name, payload in script:
+                update = Update.de_json(payload, app.bot)
+                started = time.perf_counter()
+                await app.process_update(update)
+                latencies[name].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(script) for script in scripts))
+    elapsed = time.perf_counter() - started
+
+    await bot_v2.order_journal.flush_all()
+    await app.shutdown()
+    await app.post_shutdown(app)
+
+    handlers = {}
+    for name in STEPS:
+        values = sorted(latencies[name])
+        handlers[name] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    total_updates = sum(len(v) for v in latencies.values())
+    return {
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "updates": total_updates,
+        "throughput_updates_per_s": round(total_updates / elapsed, 1) if elapsed else 0,
+        "orders_written": len(spreadsheet.sheets["ORDERS"].rows) - 1,
+        "handlers": handlers,
+        "sheets_calls": {name: ws.calls for name, ws in spreadsheet.sheets.items()},
+        "telegram_calls": request.calls,
+    }
+
+
+def print_report(result: dict):
+    print(
+        f"{result['updates']} updates in {result['elapsed_s']}s "
+        f"→ {result['throughput_updates_per_s']} updates/s, "
+        f"{result['orders_written']} orders written"
+    )
+    print(f"{'handler':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in result["handlers"].items():
+        print(
+            f"{name:<22}{row['count']:>7}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+        )
+    print("Sheets calls:", json.dumps(result["sheets_calls"], sort_keys=True))
+    print("Telegram calls:", json.dumps(result["telegram_calls"], sort_keys=True))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark cho bot_v2.py")
+    parser.add_argument("--users", type=int, default=100, help="số người dùng ảo")
+    parser.add_argument("--concurrency", type=int, default=20, help="số người dùng chạy song song")
+    parser.add_argument("--menu-items", type=int, default=40, help="số món trong MENU giả")
+    parser.add_argument("--sheets-latency-ms", type=float, default=200, help="độ trễ mỗi lệnh Sheets")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="dao động ± của độ trễ Sheets")
+    parser.add_argument("--telegram-latency-ms", type=float, default=30, help="độ trễ mỗi lệnh Bot API")
+    parser.add_argument("--seed", type=int, default=77)
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Cấu hình bot_v2 trước khi import: token giả, DB trạng thái tạm, nhóm admin giả
+    state_dir = tempfile.mkdtemp(prefix="bench-")
+    os.environ["BOT_TOKEN"] = FAKE_TOKEN
+    os.environ["ADMIN_CHAT_ID"] = str(ADMIN_CHAT)
+    os.environ["STATE_DB_PATH"] = os.path.join(state_dir, "bot_state.db")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    result = asyncio.run(run_benchmark(args))
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
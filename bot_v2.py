@@ -2,22 +2,48 @@ from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
 )
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
+    ApplicationHandlerStop,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
     ConversationHandler,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import BaseRateLimiter
+from webhook import ShardRouter, run_app
+from sheet_schema import MENU_SCHEMA, ORDER_SCHEMA, OrderRow
+from menu_search import SearchIndex, fold_text
+from sales_report import SalesLedger, parse_items_text
+from state_backend import open_backend
+from tracing import Tracer, untraced
+import metrics
 
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from http import HTTPStatus
+import asyncio
+import functools
+import hashlib
+import heapq
+import itertools
 import os
 import json
+import random
+import sqlite3
+import threading
+import time
 
 # ================== CẤU HÌNH TOKEN & ADMIN ==================
 
@@ -31,6 +57,207 @@ try:
 except ValueError:
     ADMIN_CHAT_ID = None
 
+# Danh sách user_id admin, cách nhau bởi dấu phẩy (VD: "111,222")
+ADMIN_USER_IDS = {
+    int(x) for x in os.environ.get("ADMIN_USER_IDS", "").split(",") if x.strip().isdigit()
+}
+
+
+def env_int(name: str, default: int) -> int:
+    """Đọc biến môi trường kiểu số nguyên, sai định dạng thì dùng mặc định."""
+    raw = os.environ.get(name, "").strip()
+    try:
+        return int(raw) if raw else default
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Như env_int, cho số thực (VD: tỉ lệ lấy mẫu)."""
+    raw = os.environ.get(name, "").strip()
+    try:
+        return float(raw) if raw else default
+    except ValueError:
+        return default
+
+
+# Chu kỳ làm mới MENU trong bộ nhớ (giây)
+MENU_REFRESH_SECONDS = env_int("MENU_REFRESH_SECONDS", 60)
+# Ô trong MENU chứa số phiên bản menu (VD: "Z1"), tăng mỗi lần sửa menu; có ô này
+# thì lần làm mới chỉ đọc một ô khi menu không đổi. Để trống thì luôn tải lại MENU.
+MENU_VERSION_CELL = os.environ.get("MENU_VERSION_CELL", "").strip()
+# Chu kỳ làm mới SETTINGS trong bộ nhớ (giây)
+SETTINGS_REFRESH_SECONDS = env_int("SETTINGS_REFRESH_SECONDS", 300)
+# Số luồng tối đa gọi Google Sheets cùng lúc và timeout mỗi lệnh (giây)
+SHEETS_WORKERS = env_int("SHEETS_WORKERS", 4)
+SHEETS_TIMEOUT_SECONDS = env_int("SHEETS_TIMEOUT_SECONDS", 15)
+# Ngân sách request tới Google Sheets (mỗi phút, dùng chung đọc + ghi) và số lượt
+# được dùng dồn. Quota Google: 60 đọc + 60 ghi mỗi phút cho một service account;
+# ngân sách chung nên không được vượt 60, kể cả khi chỉ toàn lệnh đọc.
+SHEETS_REQUESTS_PER_MINUTE = env_int("SHEETS_REQUESTS_PER_MINUTE", 60)
+SHEETS_BURST = env_int("SHEETS_BURST", 10)
+# Số lần thử lại khi Google trả 429/5xx hoặc mất kết nối (backoff mũ có jitter)
+SHEETS_RETRIES = env_int("SHEETS_RETRIES", 3)
+# Sau ngần này lỗi liên tiếp, ngừng gọi Sheets (chế độ dự phòng) trong
+# SHEETS_BREAKER_RESET_SECONDS giây rồi thử lại một lệnh
+SHEETS_BREAKER_FAILURES = env_int("SHEETS_BREAKER_FAILURES", 5)
+SHEETS_BREAKER_RESET_SECONDS = env_int("SHEETS_BREAKER_RESET_SECONDS", 30)
+# File SQLite lưu trạng thái cục bộ (nhật ký đơn...). Trên Railway nên trỏ vào volume.
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", "bot_state.db")
+# Nơi lưu giỏ hàng, user_data, bước /order và bộ đếm mã đơn: trống = SQLite ở
+# STATE_DB_PATH; redis://host:port/0 để nhiều replica dùng chung (xem state_backend.py)
+STATE_BACKEND_URL = os.environ.get("STATE_BACKEND_URL", "").strip()
+# Tiền tố khóa trên Redis, để nhiều bot dùng chung một Redis
+STATE_KEY_PREFIX = os.environ.get("STATE_KEY_PREFIX", "").strip()
+# Chu kỳ đẩy đơn từ nhật ký lên ORDERS (giây) và số dòng tối đa mỗi lần
+ORDER_FLUSH_SECONDS = env_int("ORDER_FLUSH_SECONDS", 2)
+ORDER_FLUSH_BATCH = env_int("ORDER_FLUSH_BATCH", 50)
+# Chu kỳ đọc lại cột trạng thái của ORDERS cho /status, /myorders (giây)
+ORDER_STATUS_REFRESH_SECONDS = env_int("ORDER_STATUS_REFRESH_SECONDS", 60)
+# Gom các lần đổi trạng thái trong khoảng này (giây) thành một batch_update
+ORDER_STATUS_WRITE_SECONDS = env_int("ORDER_STATUS_WRITE_SECONDS", 2)
+# Replica chủ (SHARD_INDEX=0, hoặc không chia replica): nơi duy nhất nhận lệnh
+# admin, đổi trạng thái đơn và báo khách (xem ShardRouter trong webhook.py)
+SHARD_OWNER = ShardRouter.owner_here()
+# Giỏ hàng / bước /order không thao tác quá thời gian này (giây) sẽ bị xóa
+CART_IDLE_TTL_SECONDS = env_int("CART_IDLE_TTL_SECONDS", 24 * 3600)
+# =1: khi khởi động, tải trước ảnh các món lên nhóm admin để lấy file_id
+PREWARM_IMAGES = os.environ.get("PREWARM_IMAGES", "").strip() == "1"
+# Số món mỗi trang khi duyệt menu bằng nút
+BROWSE_PAGE_SIZE = env_int("BROWSE_PAGE_SIZE", 6)
+# Số kết quả tối đa cho một inline query (Telegram cho phép 50)
+INLINE_RESULTS = env_int("INLINE_RESULTS", 20)
+# Số update xử lý song song (0 = tuần tự như cũ); cùng một người dùng vẫn tuần tự
+CONCURRENT_UPDATES = env_int("CONCURRENT_UPDATES", 0)
+# Giới hạn gửi thông báo vào mỗi chat (Telegram: ~20 tin/phút cho nhóm)
+NOTIFY_PER_MINUTE = env_int("NOTIFY_PER_MINUTE", 20)
+# Số tin được gửi dồn ngay trước khi bắt đầu gộp thành tin tổng hợp
+NOTIFY_BURST = env_int("NOTIFY_BURST", 3)
+
+# Trace từng update (xem tracing.py): tỉ lệ update được ghi, tỉ lệ trong số đó
+# chạy kèm cProfile, ngưỡng (ms) luôn ghi update chậm, thư mục file JSONL
+TRACE_SAMPLE_RATE = env_float("TRACE_SAMPLE_RATE", 0.0)
+TRACE_PROFILE_RATE = env_float("TRACE_PROFILE_RATE", 0.0)
+TRACE_SLOW_MS = env_int("TRACE_SLOW_MS", 0)
+TRACE_DIR = os.environ.get("TRACE_DIR", "").strip() or "traces"
+
+# ================== METRICS ==================
+
+tracer = Tracer(TRACE_DIR, TRACE_SAMPLE_RATE, TRACE_PROFILE_RATE, TRACE_SLOW_MS)
+
+HANDLER_LATENCY = metrics.histogram(
+    "bot_handler_latency_seconds", "Thời gian xử lý mỗi handler", ["handler"]
+)
+HANDLER_ERRORS = metrics.counter(
+    "bot_handler_errors_total", "Số lần handler ném lỗi", ["handler"]
+)
+SHEETS_LATENCY = metrics.histogram(
+    "bot_sheets_call_latency_seconds", "Thời gian mỗi lệnh Google Sheets", ["op"]
+)
+SHEETS_ERRORS = metrics.counter(
+    "bot_sheets_call_errors_total", "Số lệnh Google Sheets lỗi", ["op", "error"]
+)
+TELEGRAM_LATENCY = metrics.histogram(
+    "bot_telegram_api_latency_seconds", "Thời gian mỗi lệnh Telegram Bot API", ["endpoint"]
+)
+TELEGRAM_ERRORS = metrics.counter(
+    "bot_telegram_api_errors_total", "Số lệnh Telegram Bot API lỗi", ["endpoint"]
+)
+
+# user_id đang ở giữa luồng /order (PHONE / ADDRESS / CONFIRM)
+OPEN_CONVERSATIONS = set()
+
+
+def timed_handler(callback, name: str = None, conversation: bool = False):
+    """Bọc một callback async để đo thời gian và đếm lỗi theo tên handler.
+
+    Với callback thuộc ConversationHandler /order, cập nhật OPEN_CONVERSATIONS
+    theo trạng thái trả về.
+    """
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            with tracer.span(name, "handler"):
+                result = await callback(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+        update = args[0] if args else None
+        if conversation and isinstance(update, Update) and update.effective_user:
+            if result == ConversationHandler.END:
+                OPEN_CONVERSATIONS.discard(update.effective_user.id)
+            elif result is not None:
+                OPEN_CONVERSATIONS.add(update.effective_user.id)
+        return result
+
+    return wrapper
+
+
+class TelegramCallTimer(BaseRateLimiter):
+    """Móc vào mọi lệnh Bot API (qua cơ chế rate_limiter của PTB) để đo thời gian.
+
+    Không giới hạn tốc độ gì cả; getUpdates (long polling) được bỏ qua.
+    """
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint == "getUpdates":
+            return await callback(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            with tracer.span(endpoint, "telegram"):
+                return await callback(*args, **kwargs)
+        except Exception:
+            TELEGRAM_ERRORS.inc(endpoint=endpoint)
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+
+
+def instrument_handlers(app):
+    """Bọc callback của mọi handler đã đăng ký (kể cả trong ConversationHandler)."""
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                children = list(handler.entry_points) + list(handler.fallbacks)
+                for state_handlers in handler.states.values():
+                    children.extend(state_handlers)
+                for child in children:
+                    child.callback = timed_handler(child.callback, conversation=True)
+            elif not isinstance(handler, TypeHandler):
+                handler.callback = timed_handler(handler.callback)
+
+
+metrics.gauge("bot_active_carts", "Số giỏ hàng đang có món", lambda: len(cart_store))
+metrics.gauge(
+    "bot_open_conversations", "Số người dùng đang trong luồng /order", lambda: len(OPEN_CONVERSATIONS)
+)
+metrics.gauge(
+    "bot_order_journal_pending", "Số đơn chưa đẩy lên ORDERS", lambda: order_journal.pending_count()
+)
+metrics.gauge(
+    "bot_notify_pending", "Số thông báo đang chờ gửi", lambda: notifier.pending_count()
+)
+metrics.gauge(
+    "bot_sheets_degraded", "1 khi đang ở chế độ dự phòng (Sheets bị ngắt mạch)", lambda: int(sheets.breaker.open)
+)
+metrics.gauge(
+    "bot_sheets_quota_waiting", "Số lệnh Sheets đang chờ lượt quota", lambda: sheets.governor.pending()
+)
+NOTIFY_SENT = metrics.counter(
+    "bot_notify_messages_total", "Số thông báo đã xử lý (single / digest / dropped)", ["kind"]
+)
+
 # ================== KẾT NỐI GOOGLE SHEET ==================
 
 scope = [
@@ -38,29 +265,1740 @@ scope = [
     "https://www.googleapis.com/auth/drive",
 ]
 
-if "GOOGLE_CREDENTIALS" in os.environ:
-    creds_dict = json.loads(os.environ["GOOGLE_CREDENTIALS"])
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-else:
-    creds = ServiceAccountCredentials.from_json_keyfile_name(
-        "service_account.json", scope
+SHEET_NAME = os.environ.get("SHEET_NAME", "").strip() or "77_Delivery_System"
+
+
+def google_client():
+    """Xác thực service account và trả về gspread client (blocking)."""
+    if "GOOGLE_CREDENTIALS" in os.environ:
+        creds_dict = json.loads(os.environ["GOOGLE_CREDENTIALS"])
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    else:
+        creds = ServiceAccountCredentials.from_json_keyfile_name(
+            "service_account.json", scope
+        )
+
+    return gspread.authorize(creds)
+
+
+def open_spreadsheet(client=None):
+    """Mở file Google Sheet (blocking). Gọi lười, một lần, từ SheetsGateway.
+
+    `client` cho phép dùng chung một gspread client đã xác thực (xem tenants.py).
+    """
+    return (client or google_client()).open(SHEET_NAME)
+
+
+# ================== TRUY CẬP SHEETS (ASYNC) ==================
+
+SHEETS_QUOTA_WAIT = metrics.histogram(
+    "bot_sheets_quota_wait_seconds", "Thời gian chờ lượt quota Sheets", ["kind"]
+)
+SHEETS_RETRIED = metrics.counter(
+    "bot_sheets_retries_total", "Số lần thử lại lệnh Sheets sau lỗi tạm thời", ["op"]
+)
+SHEETS_COALESCED = metrics.counter(
+    "bot_sheets_coalesced_total", "Số lệnh đọc Sheets dùng chung kết quả của lệnh đang chạy", ["op"]
+)
+
+# Lệnh gspread tính vào quota ghi; các lệnh khác coi là đọc
+SHEETS_WRITE_METHODS = {
+    "append_row",
+    "append_rows",
+    "batch_update",
+    "clear",
+    "delete_rows",
+    "insert_row",
+    "insert_rows",
+    "update",
+    "update_cell",
+    "update_cells",
+}
+
+
+class SheetsUnavailable(Exception):
+    """Circuit breaker đang mở: không gọi Google Sheets, dùng dữ liệu đã lưu."""
+
+
+def is_transient(error: Exception) -> bool:
+    """Lỗi có thể tự hết khi thử lại: 429, 5xx, timeout, mất kết nối."""
+    if isinstance(error, gspread.exceptions.APIError):
+        status = getattr(getattr(error, "response", None), "status_code", 0)
+        return status == 429 or status >= 500
+    return isinstance(error, (asyncio.TimeoutError, OSError))
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Google từ chối vì quota (429): chắc chắn chưa ghi gì, thử lại lệnh ghi được."""
+    return (
+        isinstance(error, gspread.exceptions.APIError)
+        and getattr(getattr(error, "response", None), "status_code", 0) == 429
     )
 
-client = gspread.authorize(creds)
 
-SHEET_NAME = "77_Delivery_System"
-menu_sheet = client.open(SHEET_NAME).worksheet("MENU")
-orders_sheet = client.open(SHEET_NAME).worksheet("ORDERS")
-settings_sheet = client.open(SHEET_NAME).worksheet("SETTINGS")
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8) -> float:
+    """Backoff mũ "full jitter": ngẫu nhiên trong [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class CircuitBreaker:
+    """Ngắt mạch cho Google Sheets.
+
+    Đóng (bình thường) → mở sau `threshold` lỗi tạm thời liên tiếp; khi mở, mọi
+    lệnh bị từ chối ngay bằng SheetsUnavailable. Sau `reset_seconds`, cho một
+    lệnh thử đi qua: thành công thì đóng lại, lỗi thì mở tiếp.
+    """
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = max(1, threshold)
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.degraded_since = None
+        self.last_error = None
+        self._trial = False
+        self._listeners = []
+
+    @property
+    def open(self) -> bool:
+        return self.opened_at is not None
+
+    def on_change(self, listener):
+        """Đăng ký `listener(degraded)` gọi khi vào (True) hoặc thoát (False) chế độ dự phòng."""
+        self._listeners.append(listener)
+
+    def _notify(self, degraded: bool):
+        for listener in self._listeners:
+            try:
+                listener(degraded)
+            except Exception as e:
+                print(f"[SHEETS_BREAKER_LISTENER_ERROR] {e}")
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self._trial or time.monotonic() - self.opened_at < self.reset_seconds:
+            return False
+        self._trial = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._trial = False
+        if self.opened_at is not None:
+            self.opened_at = None
+            print(f"[SHEETS] circuit closed after {time.monotonic() - self.degraded_since:.0f}s")
+            self._notify(False)
+            self.degraded_since = None
+
+    def record_failure(self, error: Exception):
+        self.failures += 1
+        self.last_error = error
+        self._trial = False
+        if self.opened_at is not None:
+            self.opened_at = time.monotonic()
+        elif self.failures >= self.threshold:
+            self.opened_at = self.degraded_since = time.monotonic()
+            print(f"[SHEETS] circuit open after {self.failures} failures: {error!r}")
+            self._notify(True)
+
+
+class QuotaGovernor:
+    """Token bucket cho quota Google Sheets: `per_minute` lượt mỗi phút, dồn tối đa `burst`.
+
+    Khi hết lượt, các lệnh xếp hàng theo độ ưu tiên: lệnh ghi (đơn hàng, trạng
+    thái) được cấp lượt trước lệnh đọc (MENU, SETTINGS...), cùng mức thì theo
+    thứ tự đến. per_minute <= 0 là không giới hạn.
+    """
+
+    WRITE, READ = 0, 1
+
+    def __init__(self, per_minute: int, burst: int):
+        self.rate = per_minute / 60
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._task = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pending(self) -> int:
+        return sum(1 for *_, future in self._waiters if not future.done())
+
+    def _drop_abandoned(self):
+        """Bỏ các người chờ đã hủy (timeout / hủy) ở đầu hàng."""
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+    def _ensure_dispatch(self):
+        if self._waiters and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(untraced(self._dispatch()))
+
+    async def acquire(self, priority: int):
+        if self.rate <= 0:
+            return
+        self._refill()
+        self._drop_abandoned()
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._ensure_dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Đã được cấp lượt nhưng bị hủy trước khi kịp dùng: trả lại lượt
+                self.tokens = min(self.capacity, self.tokens + 1)
+                self._ensure_dispatch()
+            raise
+
+    async def _dispatch(self):
+        while self._waiters:
+            self._drop_abandoned()
+            if not self._waiters:
+                break
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                heapq.heappop(self._waiters)[2].set_result(None)
+            else:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SheetsGateway:
+    """Cổng duy nhất để handler gọi Google Sheets mà không chặn event loop.
+
+    Lệnh gspread (blocking) chạy trên pool luồng giới hạn, mỗi lệnh có timeout.
+    Khi hết thời gian, handler nhận asyncio.TimeoutError; luồng gspread vẫn
+    chạy nốt ở nền nhưng không còn giữ chân update nào.
+
+    File Sheet chỉ được mở một lần, ở lệnh đầu tiên; handle từng worksheet
+    cũng được lấy lười và giữ lại.
+
+    Mọi lệnh đi qua `governor` (quota, ghi trước đọc). Các lệnh đọc giống hệt
+    nhau gọi cùng lúc được gộp thành một request: lệnh đến sau chờ kết quả của
+    lệnh đang chạy, nên kết quả đọc là dùng chung và không được sửa tại chỗ.
+
+    Lỗi tạm thời được thử lại tối đa `retries` lần với backoff có jitter (lệnh
+    ghi chỉ thử lại khi bị 429, để không ghi lặp). `breaker` ngắt mạch khi lỗi
+    kéo dài: lệnh bị từ chối ngay bằng SheetsUnavailable, còn bot phục vụ MENU /
+    SETTINGS đã lưu và xếp hàng đơn mới trong nhật ký.
+    """
+
+    def __init__(
+        self,
+        open_spreadsheet,
+        max_workers: int,
+        timeout: float,
+        governor: QuotaGovernor,
+        breaker: CircuitBreaker,
+        retries: int = 3,
+    ):
+        self._open_spreadsheet = open_spreadsheet
+        self._spreadsheet = None
+        self._sheets = {}
+        self._inflight = {}
+        self.governor = governor
+        self.breaker = breaker
+        self.retries = retries
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="sheets"
+        )
+        self.timeout = timeout
+
+    def spreadsheet(self):
+        """Blocking: chỉ gọi từ trong pool luồng (qua run/call)."""
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = self._open_spreadsheet()
+            return self._spreadsheet
+
+    def worksheet(self, name: str):
+        """Blocking: chỉ gọi từ trong pool luồng (qua run/call)."""
+        worksheet = self._sheets.get(name)
+        if worksheet is None:
+            worksheet = self.spreadsheet().worksheet(name)
+            self._sheets[name] = worksheet
+        return worksheet
+
+    async def _execute(self, fn, op: str, priority: int, timeout: float):
+        kind = "write" if priority == QuotaGovernor.WRITE else "read"
+        with tracer.span(op, "sheets") as span:
+            waited = time.perf_counter()
+            with SHEETS_QUOTA_WAIT.time(kind=kind):
+                await self.governor.acquire(priority)
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            if span is not None:
+                span.attrs["quota_wait_ms"] = round((started - waited) * 1000, 3)
+            try:
+                # Timeout chỉ tính từ lúc được cấp lượt: xếp hàng quota là chuyện
+                # nội bộ, không phải dấu hiệu Google gặp sự cố
+                return await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, fn), timeout
+                )
+            finally:
+                SHEETS_LATENCY.observe(time.perf_counter() - started, op=op)
+
+    async def _submit(self, fn, timeout: float, op: str, priority: int = QuotaGovernor.READ):
+        retryable = is_rate_limited if priority == QuotaGovernor.WRITE else is_transient
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                SHEETS_ERRORS.inc(op=op, error="SheetsUnavailable")
+                raise SheetsUnavailable(f"{op}: Google Sheets tạm ngưng ({self.breaker.last_error!r})")
+            try:
+                result = await self._execute(fn, op, priority, timeout or self.timeout)
+            except Exception as e:
+                SHEETS_ERRORS.inc(op=op, error=type(e).__name__)
+                if not is_transient(e):
+                    # Google vẫn trả lời (VD: 400, sai tên sheet): không phải sự cố
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure(e)
+                if attempt >= self.retries or not retryable(e) or self.breaker.open:
+                    raise
+                attempt += 1
+                SHEETS_RETRIED.inc(op=op)
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def _read_once(self, key: tuple, fn, timeout: float, op: str):
+        """Đọc có gộp: cùng `key` đang chạy thì chờ chung kết quả thay vì gọi lại."""
+        task = self._inflight.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(self._submit(fn, timeout, op))
+            self._inflight[key] = task
+
+            def done(task):
+                self._inflight.pop(key, None)
+                if not task.cancelled():
+                    task.exception()  # tránh cảnh báo khi không còn ai chờ
+
+            task.add_done_callback(done)
+        else:
+            SHEETS_COALESCED.inc(op=op)
+        # shield: một người chờ bị hủy không làm hủy request của những người khác.
+        # Span của request thật nằm trong trace của người khởi tạo; người đi ké
+        # chỉ ghi thời gian chờ.
+        if leader:
+            return await asyncio.shield(task)
+        with tracer.span(op, "sheets", coalesced=True):
+            return await asyncio.shield(task)
+
+    async def run(self, fn, *args, timeout: float = None, **kwargs):
+        """Chạy một hàm blocking bất kỳ trên pool luồng của Sheets (tính như một lệnh đọc)."""
+        op = getattr(fn, "__name__", "run")
+        return await self._submit(functools.partial(fn, *args, **kwargs), timeout, op)
+
+    async def call(self, sheet: str, method: str, *args, timeout: float = None, **kwargs):
+        """Gọi `worksheet.<method>(*args, **kwargs)` trên sheet theo tên."""
+
+        def invoke():
+            return getattr(self.worksheet(sheet), method)(*args, **kwargs)
+
+        op = f"{sheet}.{method}"
+        if method in SHEETS_WRITE_METHODS:
+            return await self._submit(invoke, timeout, op, QuotaGovernor.WRITE)
+        key = (sheet, method, repr(args), repr(sorted(kwargs.items())))
+        return await self._read_once(key, invoke, timeout, op)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+async def refresh_every(seconds: int, refresh, label: str):
+    """Gọi `await refresh()` mỗi `seconds` giây; lỗi chỉ được log, vòng lặp vẫn chạy."""
+    while True:
+        await asyncio.sleep(seconds)
+        try:
+            await refresh()
+        except Exception as e:
+            print(f"[{label}_REFRESH_ERROR] {e}")
+
+
+sheets = SheetsGateway(
+    open_spreadsheet,
+    SHEETS_WORKERS,
+    SHEETS_TIMEOUT_SECONDS,
+    QuotaGovernor(SHEETS_REQUESTS_PER_MINUTE, SHEETS_BURST),
+    CircuitBreaker(SHEETS_BREAKER_FAILURES, SHEETS_BREAKER_RESET_SECONDS),
+    SHEETS_RETRIES,
+)
+
+# ================== NHẬT KÝ ĐƠN (WRITE-BEHIND) ==================
+
+
+def open_state_db(path: str) -> sqlite3.Connection:
+    """Mở file SQLite trạng thái ở chế độ WAL, autocommit.
+
+    synchronous=NORMAL: với WAL, commit không fsync mỗi lần (chỉ lúc checkpoint),
+    nên mỗi lần bấm giỏ hàng không phải chờ đĩa trên event loop. Mất điện có thể
+    làm mất vài giao dịch cuối, nhưng file không bao giờ hỏng.
+    """
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+def appended_first_row(response):
+    """Số dòng đầu tiên vừa được append, đọc từ `updates.updatedRange` ("ORDERS!A5:J7")."""
+    try:
+        cell = response["updates"]["updatedRange"].split("!")[-1].split(":")[0]
+        return int(cell.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+    except (TypeError, KeyError, ValueError, AttributeError):
+        return None
+
+
+async def order_id_tail(gateway: SheetsGateway, limit: int, window: int = 50) -> list:
+    """[(số dòng, mã đơn), ...] của tối đa `limit` mã cuối cột A ORDERS, cũ trước.
+
+    Đọc ngược từ cuối lưới (row_count) từng khúc, khúc sau gấp 4 khúc trước.
+    row_count lấy từ worksheet đã mở nên có thể cũ hơn vài lần append; khúc đầu
+    vì thế để mở (A{n}:A) để vẫn thấy các dòng đó.
+    """
+    row_count = await gateway.run(lambda: gateway.worksheet("ORDERS").row_count)
+    found = []
+    last = row_count
+    open_end = True
+    while last >= 2 and len(found) < limit:
+        first = max(2, last - window + 1)
+        a1 = f"A{first}:A" if open_end else f"A{first}:A{last}"
+        cells = await gateway.call("ORDERS", "get_values", a1)
+        chunk = []
+        for offset, cell in enumerate(cells):
+            try:
+                chunk.append((first + offset, int(str(cell[0]).strip())))
+            except (IndexError, ValueError):
+                continue
+        found = chunk + found
+        last, window, open_end = first - 1, window * 4, False
+    return found[-limit:]
+
+
+class OrderJournal:
+    """Ghi đơn xác nhận vào SQLite trước, rồi đẩy nền lên ORDERS bằng append_rows.
+
+    Dòng chưa đẩy được sẽ được thử lại cho tới khi thành công, kể cả sau khi
+    khởi động lại. append_rows quá timeout (hoặc lỗi mạng) vẫn có thể đã được
+    Google ghi xong, nên trước khi gửi lại một lô sau lỗi (hoặc lô còn tồn từ lần
+    chạy trước), các mã đơn của lô được dò ở đuôi cột A; mã đã có thì không gửi
+    lại.
+    """
+
+    # Số mã cuối cột A được dò, ngoài số dòng của lô
+    DEDUPE_TAIL = 200
+
+    def __init__(self, db: sqlite3.Connection, gateway: SheetsGateway, flush_seconds: int, batch_size: int):
+        self.db = db
+        self.gateway = gateway
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS order_journal ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " row TEXT NOT NULL,"
+            " flushed INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS order_journal_pending"
+            " ON order_journal (flushed, seq)"
+        )
+        self._wake = None
+        self._task = None
+        self._stopping = False
+        self._flush_lock = asyncio.Lock()
+        self._listeners = []
+        # Lần append trước có thể đã ghi mà không biết (lỗi, hoặc tồn từ lần chạy trước)
+        self._unsure = self.pending_count() > 0
+
+    def on_flushed(self, listener):
+        """Đăng ký `listener(rows, first_row)` gọi sau mỗi lô append_rows thành công.
+
+        `first_row` là số dòng trên sheet của dòng đầu lô (None nếu không rõ).
+        """
+        self._listeners.append(listener)
+
+    def append(self, row: list):
+        """Ghi một dòng ORDERS xuống đĩa (bền vững ngay khi hàm trả về)."""
+        self.db.execute(
+            "INSERT INTO order_journal (row) VALUES (?)",
+            (json.dumps(row, ensure_ascii=False),),
+        )
+        if self._wake is not None:
+            self._wake.set()
+
+    def pending_count(self) -> int:
+        return self.db.execute(
+            "SELECT COUNT(*) FROM order_journal WHERE flushed = 0"
+        ).fetchone()[0]
+
+    def flush_soon(self):
+        """Đẩy ngay ở vòng tiếp theo, bỏ qua thời gian chờ backoff hiện tại."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def flush_once(self) -> int:
+        """Đẩy một lô dòng chưa ghi lên ORDERS. Trả về số dòng đã đẩy."""
+        # Khóa để hai lần flush chạy chồng nhau không đẩy cùng một lô hai lần
+        async with self._flush_lock:
+            pending = self.db.execute(
+                "SELECT seq, row FROM order_journal WHERE flushed = 0"
+                " ORDER BY seq LIMIT ?",
+                (self.batch_size,),
+            ).fetchall()
+            if not pending:
+                return 0
+
+            seqs = [seq for seq, _ in pending]
+            rows = [json.loads(row) for _, row in pending]
+            if self._unsure:
+                tail = await order_id_tail(self.gateway, len(rows) + self.DEDUPE_TAIL)
+                on_sheet = {order_id: sheet_row for sheet_row, order_id in tail}
+                for seq, row in zip(seqs, rows):
+                    if row[0] in on_sheet:
+                        print(f"[ORDERS_APPEND] #{row[0]} already on ORDERS, not resent")
+                        self._mark_flushed([seq])
+                        self._notify([row], on_sheet[row[0]])
+                kept = [(seq, row) for seq, row in zip(seqs, rows) if row[0] not in on_sheet]
+                self._unsure = False
+                if not kept:
+                    return len(pending)
+                seqs, rows = map(list, zip(*kept))
+
+            try:
+                response = await self.gateway.call("ORDERS", "append_rows", rows)
+            except Exception:
+                self._unsure = True
+                raise
+            self._mark_flushed(seqs)
+            self._notify(rows, appended_first_row(response))
+            return len(pending)
+
+    def _mark_flushed(self, seqs: list):
+        self.db.executemany(
+            "UPDATE order_journal SET flushed = 1 WHERE seq = ?", [(seq,) for seq in seqs]
+        )
+
+    def _notify(self, rows: list, first_row):
+        for listener in self._listeners:
+            try:
+                listener(rows, first_row)
+            except Exception as e:
+                print(f"[ORDERS_FLUSH_LISTENER_ERROR] {e}")
+
+    async def flush_all(self):
+        while await self.flush_once():
+            pass
+
+    async def _flush_loop(self):
+        backoff = self.flush_seconds
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush_all()
+                backoff = self.flush_seconds
+            except Exception as e:
+                print(f"[ORDERS_APPEND_ERROR] {e} (pending={self.pending_count()})")
+                backoff = min(backoff * 2, 60)
+            if self._stopping:
+                return
+
+    def start(self):
+        """Bắt đầu luồng đẩy nền; dòng còn tồn từ lần chạy trước được đẩy ngay."""
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._wake.set()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Đẩy lần cuối rồi dừng; dòng còn tồn sẽ được đẩy ở lần chạy sau."""
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+
+
+class OrderIdAllocator:
+    """Cấp mã đơn tăng dần từ bộ đếm `order_id` của state backend, không đọc sheet mỗi đơn.
+
+    next_id() là một phép tăng nguyên tử của backend (giao dịch SQLite hoặc
+    INCRBY), nên các callback order_yes chạy song song, kể cả ở nhiều replica,
+    không thể nhận trùng mã.
+    """
+
+    def __init__(self, backend, gateway: SheetsGateway, start: int = 10001):
+        self.backend = backend
+        self.gateway = gateway
+        self.start = start
+
+    async def bump_to(self, value: int):
+        """Đảm bảo mã tiếp theo lớn hơn `value`."""
+        await self.backend.call(self.backend.bump_to, "order_id", value)
+
+    async def next_id(self) -> int:
+        return await self.backend.call(self.backend.incr, "order_id")
+
+    async def current(self) -> int:
+        """Mã cấp gần nhất (0 nếu chưa từng cấp)."""
+        return await self.backend.call(self.backend.incr, "order_id", 0)
+
+    async def last_sheet_id(self):
+        """Mã đơn cuối cùng ở cột A của ORDERS, chỉ đọc phần đuôi cột."""
+        tail = await order_id_tail(self.gateway, 1)
+        return tail[-1][1] if tail else None
+
+    async def reconcile(self):
+        """Khi khởi động: đưa bộ đếm lên ít nhất bằng mã cuối cùng ở cột A của ORDERS."""
+        last_id = await self.last_sheet_id()
+        await self.bump_to(max(self.start - 1, last_id or 0))
+
+
+def column_letter(index: int) -> str:
+    """Chỉ số cột (từ 0) → chữ cái A1: 0 → A, 9 → J, 26 → AA."""
+    letters = ""
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        letters = chr(ord("A") + rest) + letters
+    return letters
+
+
+class OrderIndex:
+    """Chỉ mục đơn cục bộ theo order_id và user_id, lưu trong SQLite.
+
+    Đơn được thêm ngay khi khách xác nhận; trạng thái được đồng bộ nền từ cột
+    status của ORDERS (chỉ đọc 2 cột mã đơn + trạng thái). Lần đồng bộ đầu đọc
+    toàn bộ ORDERS một lần. Mã đơn lạ trên sheet (đơn từ replica khác, bot.py)
+    chỉ được replica chủ (`owner`) đọc thêm, và chỉ đọc các dòng đó; replica
+    khác bỏ qua vì không phục vụ lệnh admin cho chúng.
+
+    Chỉ mục cũng giữ số dòng trên sheet của từng đơn (từ kết quả append_rows hoặc
+    lần đồng bộ), nên admin đổi trạng thái không cần find() trên ORDERS. Các lần
+    đổi được ghi vào SQLite rồi gom thành một batch_update mỗi `write_seconds`.
+    """
+
+    def __init__(
+        self,
+        db: sqlite3.Connection,
+        gateway: SheetsGateway,
+        refresh_seconds: int,
+        write_seconds: int = 2,
+        owner: bool = True,
+    ):
+        self.db = db
+        self.gateway = gateway
+        self.refresh_seconds = refresh_seconds
+        self.write_seconds = write_seconds
+        self.owner = owner
+        self.by_id = {}
+        self.by_user = {}
+        # (chữ cột order_id, chữ cột status) trên ORDERS; None = cần đọc toàn bộ
+        self._columns = None
+        # Header của ORDERS ở lần đọc toàn bộ gần nhất
+        self._header = None
+        self._synced_at = 0
+        self._listeners = []
+        self._task = None
+        self._write_wake = None
+        self._write_task = None
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS status_writes ("
+            " order_id INTEGER PRIMARY KEY,"
+            " status TEXT NOT NULL)"
+        )
+        # {order_id: status} chưa ghi lên sheet
+        self.pending_writes = dict(self.db.execute("SELECT order_id, status FROM status_writes"))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS order_index ("
+            " order_id INTEGER PRIMARY KEY,"
+            " user_id INTEGER NOT NULL,"
+            " sheet_row INTEGER,"
+            " data TEXT NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS order_index_user ON order_index (user_id, order_id)"
+        )
+        for sheet_row, data in self.db.execute(
+            "SELECT sheet_row, data FROM order_index ORDER BY order_id"
+        ):
+            self._remember(OrderRow(sheet_row, **dict(zip(OrderRow.FIELDS, json.loads(data)))))
+
+    def _remember(self, order: OrderRow):
+        if order.order_id not in self.by_id:
+            self.by_user.setdefault(order.user_id, []).append(order.order_id)
+        self.by_id[order.order_id] = order
+
+    def _save(self, order: OrderRow):
+        self.db.execute(
+            "INSERT OR REPLACE INTO order_index (order_id, user_id, sheet_row, data)"
+            " VALUES (?, ?, ?, ?)",
+            (order.order_id, order.user_id, order.row, json.dumps(order.to_values())),
+        )
+
+    def add(self, order: OrderRow):
+        """Thêm (hoặc thay) một đơn vào chỉ mục."""
+        self._remember(order)
+        self._save(order)
+
+    def get(self, order_id: int):
+        return self.by_id.get(order_id)
+
+    def for_user(self, user_id: int, limit: int = 10) -> list:
+        """Các đơn mới nhất của user, mới trước."""
+        ids = self.by_user.get(user_id, [])
+        return [self.by_id[order_id] for order_id in reversed(ids[-limit:])]
+
+    def on_status_change(self, listener):
+        """Đăng ký `listener(order, old_status)` gọi khi trạng thái một đơn đổi."""
+        self._listeners.append(listener)
+
+    def _status_changed(self, order: OrderRow, old_status: str):
+        for listener in self._listeners:
+            try:
+                listener(order, old_status)
+            except Exception as e:
+                print(f"[ORDER_STATUS_LISTENER_ERROR] {e}")
+
+    def set_status(self, order_id: int, status: str, sheet_row: int = None) -> bool:
+        """Nhận trạng thái (và số dòng) đọc từ sheet; trả về True nếu trạng thái đổi.
+
+        Đơn đang có thay đổi chờ ghi chỉ được cập nhật số dòng.
+        """
+        order = self.by_id.get(order_id)
+        if order is None:
+            return False
+        if order_id in self.pending_writes:
+            status = order.status
+        sheet_row = sheet_row or order.row
+        if order.status == status and order.row == sheet_row:
+            return False
+        old_status = order.status
+        order.status = status
+        order.row = sheet_row
+        self._save(order)
+        if old_status != status:
+            self._status_changed(order, old_status)
+            return True
+        return False
+
+    def update_status(self, order_id: int, status: str) -> bool:
+        """Admin đổi trạng thái: cập nhật ngay trong chỉ mục, ghi lên sheet ở lô sau.
+
+        Trả về False nếu không có đơn này hoặc trạng thái không đổi.
+        """
+        order = self.by_id.get(order_id)
+        if order is None or order.status == status:
+            return False
+        old_status = order.status
+        order.status = status
+        self._save(order)
+        self.pending_writes[order_id] = status
+        self.db.execute(
+            "INSERT OR REPLACE INTO status_writes (order_id, status) VALUES (?, ?)",
+            (order_id, status),
+        )
+        if self._write_wake is not None:
+            self._write_wake.set()
+        self._status_changed(order, old_status)
+        return True
+
+    def rows_appended(self, rows: list, first_row: int):
+        """Listener của OrderJournal: ghi nhớ số dòng của các đơn vừa được append."""
+        if first_row is None:
+            return
+        for offset, values in enumerate(rows):
+            order = self.by_id.get(values[0])
+            if order is not None and order.row != first_row + offset:
+                order.row = first_row + offset
+                self._save(order)
+        if self.pending_writes and self._write_wake is not None:
+            self._write_wake.set()
+
+    async def flush_status_writes(self) -> int:
+        """Ghi các trạng thái chờ bằng một batch_update. Trả về số ô đã ghi.
+
+        Số dòng trong chỉ mục có thể đã cũ (có người chèn/xóa/sắp xếp dòng trên
+        ORDERS), nên trước khi ghi đọc lại ô mã đơn của từng dòng trong cùng lần
+        flush; dòng không còn đúng mã đơn thì bỏ qua và đồng bộ lại ở lần sau.
+        """
+        if not self.pending_writes:
+            return 0
+        missing_rows = any(not self.by_id[oid].row for oid in self.pending_writes)
+        if self._columns is None or (missing_rows and time.monotonic() - self._synced_at > 10):
+            await self.sync()
+        if self._columns is None:
+            return 0
+
+        id_col, status_col = self._columns
+        batch = {
+            order_id: status
+            for order_id, status in self.pending_writes.items()
+            if self.by_id[order_id].row
+        }
+        if not batch:
+            return 0
+        id_cells = await self.gateway.call(
+            "ORDERS", "batch_get", [f"{id_col}{self.by_id[order_id].row}" for order_id in batch]
+        )
+        for order_id, cells in zip(list(batch), id_cells):
+            try:
+                found = int(str(cells[0][0]).strip())
+            except (IndexError, ValueError):
+                found = None
+            if found != order_id:
+                order = self.by_id[order_id]
+                print(f"[ORDER_INDEX] row {order.row} no longer holds #{order_id}; resyncing")
+                del batch[order_id]
+                order.row = None
+                self._save(order)
+                # Để lần flush sau đồng bộ lại ngay, không chờ 10 giây
+                self._synced_at = 0
+        if not batch:
+            return 0
+        await self.gateway.call(
+            "ORDERS",
+            "batch_update",
+            [
+                {"range": f"{status_col}{self.by_id[order_id].row}", "values": [[status]]}
+                for order_id, status in batch.items()
+            ],
+        )
+        for order_id, status in batch.items():
+            # Có thể đã đổi tiếp trong lúc chờ Google; khi đó để lô sau ghi
+            if self.pending_writes.get(order_id) == status:
+                del self.pending_writes[order_id]
+                self.db.execute("DELETE FROM status_writes WHERE order_id = ?", (order_id,))
+        return len(batch)
+
+    async def _write_loop(self):
+        delay = self.write_seconds
+        while True:
+            await self._write_wake.wait()
+            # Chờ một nhịp để gom các lần bấm nút dồn dập
+            await asyncio.sleep(delay)
+            self._write_wake.clear()
+            try:
+                await self.flush_status_writes()
+                delay = self.write_seconds
+            except Exception as e:
+                print(f"[ORDER_STATUS_WRITE_ERROR] {e} (pending={len(self.pending_writes)})")
+                delay = min(delay * 2, 60)
+            if self.pending_writes:
+                self._write_wake.set()
+
+    def _merge(self, records: list):
+        for order in records:
+            if order.order_id in self.pending_writes:
+                order.status = self.pending_writes[order.order_id]
+            known = self.by_id.get(order.order_id)
+            if known is None or known.to_values() != order.to_values() or known.row != order.row:
+                self.add(order)
+                # Trạng thái đổi trên sheet cũng phải báo listener như ở sync()
+                if known is not None and known.status != order.status:
+                    self._status_changed(order, known.status)
+
+    async def _load_all(self):
+        values = await self.gateway.call("ORDERS", "get_all_values")
+        if not values:
+            return
+        records, problems = ORDER_SCHEMA.parse(values)
+        self._merge(records)
+        if problems:
+            print(f"[ORDER_INDEX] skipped {len(problems)} ORDERS rows: {problems[:5]}")
+        self._header = values[0]
+        status_index = ORDER_SCHEMA.position(values[0], "status")
+        if status_index is None:
+            print("[ORDER_INDEX] ORDERS has no status column; statuses are not synced")
+            return
+        self._columns = (
+            column_letter(ORDER_SCHEMA.position(values[0], "order_id")),
+            column_letter(status_index),
+        )
+
+    async def _load_rows(self, first: int, last: int):
+        """Đọc riêng các dòng first..last của ORDERS và thêm các đơn chưa biết."""
+        values = await self.gateway.call(
+            "ORDERS", "get_values", f"A{first}:{column_letter(len(self._header) - 1)}{last}"
+        )
+        records, problems = ORDER_SCHEMA.parse([self._header, *values])
+        for order in records:
+            # parse() đánh số dòng như thể bắt đầu từ dòng 2
+            order.row += first - 2
+        self._merge([order for order in records if order.order_id not in self.by_id])
+        if problems:
+            print(f"[ORDER_INDEX] skipped {len(problems)} ORDERS rows: {problems[:5]}")
+
+    async def sync(self):
+        """Đồng bộ trạng thái từ ORDERS."""
+        self._synced_at = time.monotonic()
+        if self._columns is None:
+            await self._load_all()
+            return
+        id_col, status_col = self._columns
+        id_cells, status_cells = await self.gateway.call(
+            "ORDERS", "batch_get", [f"{id_col}2:{id_col}", f"{status_col}2:{status_col}"]
+        )
+        unknown_rows = []
+        for offset, id_cell in enumerate(id_cells):
+            try:
+                order_id = int(str(id_cell[0]).strip()) if id_cell else None
+            except ValueError:
+                continue
+            if order_id is None:
+                continue
+            if order_id not in self.by_id:
+                # Đơn ghi từ nơi khác (replica khác, bot.py)
+                unknown_rows.append(offset + 2)
+                continue
+            status_cell = status_cells[offset] if offset < len(status_cells) else []
+            status = str(status_cell[0]).strip().lower() if status_cell else ""
+            self.set_status(order_id, status, sheet_row=offset + 2)
+        if unknown_rows and self.owner:
+            await self._load_rows(min(unknown_rows), max(unknown_rows))
+
+    async def _sync_loop(self):
+        try:
+            await self.sync()
+        except Exception as e:
+            print(f"[ORDER_INDEX_REFRESH_ERROR] {e}")
+        await refresh_every(self.refresh_seconds, self.sync, "ORDER_INDEX")
+
+    def start(self):
+        if self._task is None and self.refresh_seconds > 0:
+            self._task = asyncio.create_task(self._sync_loop())
+        if self._write_task is None:
+            self._write_wake = asyncio.Event()
+            if self.pending_writes:
+                self._write_wake.set()
+            self._write_task = asyncio.create_task(self._write_loop())
+
+    async def stop(self):
+        """Dừng nền, ghi nốt trạng thái đang chờ (phần còn lại ghi ở lần chạy sau)."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._write_task is not None:
+            self._write_task.cancel()
+            self._write_task = None
+            try:
+                await self.flush_status_writes()
+            except Exception as e:
+                print(f"[ORDER_STATUS_WRITE_ERROR] {e} (pending={len(self.pending_writes)})")
+
+
+state_db = open_state_db(STATE_DB_PATH)
+state_backend = open_backend(STATE_BACKEND_URL, state_db, STATE_KEY_PREFIX)
+order_journal = OrderJournal(state_db, sheets, ORDER_FLUSH_SECONDS, ORDER_FLUSH_BATCH)
+order_ids = OrderIdAllocator(state_backend, sheets)
+order_index = OrderIndex(
+    state_db, sheets, ORDER_STATUS_REFRESH_SECONDS, ORDER_STATUS_WRITE_SECONDS, SHARD_OWNER
+)
+order_journal.on_flushed(order_index.rows_appended)
 
 # ================== TRẠNG THÁI CONVERSATION ==================
 
 PHONE, ADDRESS, CONFIRM = range(3)
 
-# ================== BỘ NHỚ TẠM ==================
+# ================== GIỎ HÀNG ==================
+
+
+class CartStore:
+    """Giỏ hàng gọn theo người dùng: {item_id: qty}, lưu ở state backend (khóa cart:<user_id>).
+
+    Chỉ giữ ID món (đã chuẩn hóa) và số lượng; tên, giá, ảnh tra từ MENU khi hiển
+    thị. Bản trong bộ nhớ là cache: nạp từ backend lần đầu gặp người dùng (hoặc ở
+    mỗi update nếu backend dùng chung, xem UserStateSync); mỗi thay đổi được gửi
+    xuống backend (call_soon, không chờ) với TTL `idle_ttl`, nên giỏ bỏ quên tự
+    hết hạn.
+    """
+
+    def __init__(self, backend, idle_ttl: int):
+        self.backend = backend
+        self.idle_ttl = idle_ttl
+        self._carts = {}
+        self._touched = {}
+        self._task = None
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f"cart:{user_id}"
+
+    def load(self, user_id: int, raw):
+        """Đặt cache của người dùng từ giá trị đọc ở backend (None = giỏ trống)."""
+        self._carts[user_id] = json.loads(raw) if raw else {}
+        self._touched[user_id] = time.time()
+
+    def _save(self, user_id: int):
+        self._touched[user_id] = time.time()
+        items = self._carts.get(user_id)
+        if items:
+            self.backend.call_soon(
+                self.backend.set, self.key(user_id), json.dumps(items), self.idle_ttl or None
+            )
+        else:
+            self.backend.call_soon(self.backend.delete, self.key(user_id))
+
+    async def add(self, user_id: int, item_id: str, qty: int) -> int:
+        """Cộng `qty` (có thể âm) vào món; về 0 thì bỏ khỏi giỏ. Trả về số lượng mới."""
+        key = normalize_item_id(item_id)
+        items = await self.items(user_id)
+        new_qty = items.get(key, 0) + qty
+        if new_qty > 0:
+            items[key] = new_qty
+        else:
+            items.pop(key, None)
+            new_qty = 0
+        self._save(user_id)
+        return new_qty
+
+    async def items(self, user_id: int) -> dict:
+        items = self._carts.get(user_id)
+        if items is None:
+            raw = await self.backend.call(self.backend.get, self.key(user_id))
+            # Có thể đã được nạp trong lúc chờ backend
+            if user_id not in self._carts:
+                self.load(user_id, raw)
+            items = self._carts[user_id]
+        return items
+
+    def clear(self, user_id: int):
+        self._carts[user_id] = {}
+        self._save(user_id)
+
+    def __len__(self):
+        return sum(1 for items in self._carts.values() if items)
+
+    async def evict_idle(self) -> int:
+        """Bỏ khỏi cache các giỏ không thao tác quá TTL (backend tự xóa theo TTL).
+
+        Trả về số giỏ đã bỏ.
+        """
+        cutoff = time.time() - self.idle_ttl
+        stale = [uid for uid, ts in self._touched.items() if ts < cutoff]
+        for user_id in stale:
+            self._carts.pop(user_id, None)
+            self._touched.pop(user_id, None)
+        await self.backend.call(self.backend.purge_expired)
+        return len(stale)
+
+    def start(self):
+        if self._task is None and self.idle_ttl > 0:
+            interval = max(60, min(self.idle_ttl // 10, 3600))
+            self._task = asyncio.create_task(
+                refresh_every(interval, self.evict_idle, "CART_EVICT")
+            )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+cart_store = CartStore(state_backend, CART_IDLE_TTL_SECONDS)
+
+# ================== MENU TRONG BỘ NHỚ ==================
+
+
+def normalize_item_id(raw) -> str:
+    """Chuẩn hóa ID món để tra cứu: bỏ khoảng trắng, không phân biệt hoa thường."""
+    return str(raw or "").strip().lower()
+
+
+class SheetSnapshots:
+    """Bản đọc thành công gần nhất của từng sheet (MENU, SETTINGS) trong SQLite.
+
+    Khi khởi động lúc Google Sheets đang lỗi, bot dùng bản này thay vì đứng chờ.
+    """
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sheet_snapshots ("
+            " name TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " saved_at REAL NOT NULL)"
+        )
+
+    def save(self, name: str, data):
+        self.db.execute(
+            "INSERT OR REPLACE INTO sheet_snapshots (name, data, saved_at) VALUES (?, ?, ?)",
+            (name, json.dumps(data, ensure_ascii=False, default=str), time.time()),
+        )
+
+    def load(self, name: str):
+        """Trả về (data, saved_at) hoặc None."""
+        row = self.db.execute(
+            "SELECT data, saved_at FROM sheet_snapshots WHERE name = ?", (name,)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+
+sheet_snapshots = SheetSnapshots(state_db)
+
+
+class MenuCatalog:
+    """Bản sao MENU trong bộ nhớ, nạp 1 lần khi khởi động và làm mới nền theo chu kỳ.
+
+    Nếu có `version_cell`, đọc ô phiên bản đó trước và bỏ qua lần tải nếu không
+    đổi. (Không dùng thời điểm sửa file trên Drive: chính bot cũng sửa file mỗi
+    lần ghi ORDERS.) Bản tải về giống hệt lần trước thì không dựng lại chỉ mục.
+    Mỗi lần đọc được MENU hợp lệ, bản thô được lưu vào `snapshots`.
+    """
+
+    def __init__(
+        self,
+        gateway: SheetsGateway,
+        refresh_seconds: int,
+        version_cell: str = "",
+        snapshots: SheetSnapshots = None,
+    ):
+        self.gateway = gateway
+        self.refresh_seconds = refresh_seconds
+        self.version_cell = version_cell
+        self.snapshots = snapshots
+        self.records = []
+        self.by_id = {}
+        # Các dòng MENU bị loại ở lần nạp gần nhất ("dòng 7: giá 'abc' không phải số")
+        self.problems = []
+        self._derived = {}
+        self._listeners = []
+        self._stamp = None
+        self._digest = None
+        self._task = None
+
+    async def _read_stamp(self):
+        if not self.version_cell:
+            return None
+        cell = await self.gateway.call("MENU", "acell", self.version_cell)
+        return cell.value
+
+    async def fetch_if_changed(self, force: bool = False):
+        """Trả về (records, problems) mới, hoặc None nếu menu không đổi.
+
+        Raise SchemaError nếu MENU thiếu cột bắt buộc (snapshot cũ được giữ).
+        """
+        try:
+            stamp = await self._read_stamp()
+        except SheetsUnavailable:
+            raise
+        except Exception:
+            stamp = None
+        if not force and stamp is not None and stamp == self._stamp:
+            return None
+
+        values = await self.gateway.call("MENU", "get_all_values")
+        digest = hashlib.sha1(
+            json.dumps(values, default=str).encode("utf-8")
+        ).hexdigest()
+        self._stamp = stamp
+        if not force and digest == self._digest:
+            return None
+        parsed = MENU_SCHEMA.parse(values)
+        self._digest = digest
+        if self.snapshots is not None:
+            self.snapshots.save("MENU", values)
+        return parsed
+
+    def apply(self, records: list, problems: list = ()):
+        """Thay snapshot hiện tại và dựng lại chỉ mục theo ID món."""
+        by_id = {}
+        problems = list(problems)
+        for item in records:
+            if item.key in by_id:
+                problems.append(
+                    f"dòng {item.row}: trùng id {item.id} (đã có ở dòng {by_id[item.key].row})"
+                )
+            else:
+                by_id[item.key] = item
+        self.records = [item for item in records if by_id[item.key] is item]
+        self.by_id = by_id
+        self.problems = problems
+        self._derived = {}
+        for listener in self._listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                print(f"[MENU_LISTENER_ERROR] {e}")
+
+    def on_change(self, listener):
+        """Đăng ký hàm `listener(catalog)` gọi mỗi khi nạp menu mới."""
+        self._listeners.append(listener)
+
+    async def load(self):
+        """Nạp menu lần đầu, dùng khi khởi động."""
+        self.apply(*await self.fetch_if_changed(force=True))
+
+    def restore(self):
+        """Nạp bản MENU đã lưu (khi Sheets lỗi lúc khởi động). Trả về thời điểm lưu hoặc None."""
+        snapshot = self.snapshots.load("MENU") if self.snapshots is not None else None
+        if snapshot is None:
+            return None
+        values, saved_at = snapshot
+        self.apply(*MENU_SCHEMA.parse(values))
+        return saved_at
+
+    def get(self, item_id):
+        return self.by_id.get(normalize_item_id(item_id))
+
+    def derived(self, key, build):
+        """Giá trị dựng từ snapshot hiện tại (VD: trang menu đã render), cache theo `key`.
+
+        Cache tự bị xóa mỗi khi apply() nạp menu mới.
+        """
+        if key not in self._derived:
+            self._derived[key] = build()
+        return self._derived[key]
+
+    async def refresh(self, force: bool = False):
+        parsed = await self.fetch_if_changed(force=force)
+        if parsed is not None:
+            self.apply(*parsed)
+
+    def start(self):
+        if self._task is None and self.refresh_seconds > 0:
+            self._task = asyncio.create_task(
+                refresh_every(self.refresh_seconds, self.refresh, "MENU")
+            )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+menu_catalog = MenuCatalog(sheets, MENU_REFRESH_SECONDS, MENU_VERSION_CELL, sheet_snapshots)
+
+# ================== CACHE ẢNH TELEGRAM ==================
+
+
+class PhotoCache:
+    """Ánh xạ image_url → file_id Telegram, lưu trong SQLite.
+
+    Lần gửi đầu Telegram phải tải ảnh từ URL; các lần sau gửi lại bằng file_id.
+    Khi URL trong MENU đổi, mục cũ bị xóa (xem prune).
+    """
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS photo_file_ids ("
+            " image_url TEXT PRIMARY KEY,"
+            " file_id TEXT NOT NULL)"
+        )
+        self._file_ids = dict(
+            self.db.execute("SELECT image_url, file_id FROM photo_file_ids")
+        )
+
+    def get(self, image_url: str):
+        return self._file_ids.get(image_url)
+
+    def remember(self, image_url: str, message):
+        """Lưu file_id (bản lớn nhất) từ tin nhắn ảnh vừa gửi thành công."""
+        if not message or not getattr(message, "photo", None):
+            return
+        file_id = message.photo[-1].file_id
+        if self._file_ids.get(image_url) != file_id:
+            self._file_ids[image_url] = file_id
+            self.db.execute(
+                "INSERT OR REPLACE INTO photo_file_ids (image_url, file_id) VALUES (?, ?)",
+                (image_url, file_id),
+            )
+
+    def forget(self, image_url: str):
+        self._file_ids.pop(image_url, None)
+        self.db.execute("DELETE FROM photo_file_ids WHERE image_url = ?", (image_url,))
+
+    def prune(self, keep_urls: set):
+        """Xóa file_id của các URL không còn trong MENU."""
+        for image_url in [u for u in self._file_ids if u not in keep_urls]:
+            self.forget(image_url)
+
+    async def send(self, send_photo, image_url: str, **kwargs):
+        """Gửi ảnh qua `send_photo` (bot.send_photo / message.reply_photo), ưu tiên file_id."""
+        file_id = self.get(image_url)
+        if file_id:
+            try:
+                return await send_photo(photo=file_id, **kwargs)
+            except BadRequest:
+                # file_id hết hạn hoặc không hợp lệ: gửi lại bằng URL
+                self.forget(image_url)
+        message = await send_photo(photo=image_url, **kwargs)
+        self.remember(image_url, message)
+        return message
+
+
+def menu_image_urls(catalog: MenuCatalog) -> set:
+    urls = set()
+    for item in catalog.records:
+        if item.image_url:
+            urls.add(item.image_url)
+    return urls
+
+
+photo_cache = PhotoCache(state_db)
+menu_catalog.on_change(lambda catalog: photo_cache.prune(menu_image_urls(catalog)))
+
+
+async def prewarm_photos(bot, chat_id: int):
+    """Gửi ảnh các món chưa có file_id vào nhóm admin (rồi xóa) để lấy file_id."""
+    for image_url in sorted(menu_image_urls(menu_catalog)):
+        if photo_cache.get(image_url):
+            continue
+        try:
+            message = await bot.send_photo(
+                chat_id=chat_id, photo=image_url, disable_notification=True
+            )
+            photo_cache.remember(image_url, message)
+            await bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+        except Exception as e:
+            print(f"[PHOTO_PREWARM_ERROR] {image_url}: {e}")
+
+
+# ================== THÔNG BÁO NỀN (ADMIN) ==================
+
+
+class Notifier:
+    """Hàng đợi gửi tin nền, giới hạn tốc độ theo từng chat (token bucket).
+
+    Handler chỉ gọi submit() rồi trả lời khách ngay, không chờ nhóm admin.
+    Khi nhiều tin dồn lại trong lúc chờ token, chúng được gộp thành một tin
+    tổng hợp (mỗi tin một dòng `summary`) thay vì gửi lần lượt.
+
+    Vòng gửi của một chat tự kết thúc (và chat bị xóa khỏi bộ nhớ) khi hàng đợi
+    rỗng đủ lâu để token bucket đầy lại, nên số chat từng nhận tin (VD: mọi
+    khách được báo trạng thái đơn) không làm phình bộ nhớ hay số task.
+    """
+
+    def __init__(self, per_minute: int, burst: int):
+        self.interval = 60 / max(per_minute, 1)
+        self.burst = max(burst, 1)
+        self.bot = None
+        self._chats = {}
+        self._stopping = False
+
+    def pending_count(self) -> int:
+        return sum(len(chat["queue"]) for chat in self._chats.values())
+
+    def submit(
+        self,
+        chat_id: int,
+        text: str,
+        image_url: str = None,
+        summary: str = None,
+        reply_markup=None,
+        digest_title: str = None,
+    ):
+        """Xếp một tin vào hàng đợi của `chat_id`; `summary` là dòng dùng khi gộp.
+
+        `reply_markup` (nút bấm) chỉ đi kèm khi tin được gửi riêng, không khi gộp.
+        `digest_title` (có "{count}") thay dòng đầu của tin gộp, VD: theo ngôn ngữ
+        của khách.
+        """
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = {
+                "queue": [],
+                "wake": asyncio.Event(),
+                "tokens": float(self.burst),
+                "updated": time.monotonic(),
+                "task": None,
+            }
+        chat["queue"].append(
+            {
+                "text": text,
+                "image_url": image_url,
+                "summary": summary or text.split("\n", 1)[0],
+                "reply_markup": reply_markup,
+                "digest_title": digest_title,
+            }
+        )
+        chat["wake"].set()
+        if self.bot is not None and chat["task"] is None:
+            # Vòng gửi sống lâu hơn update đã gọi submit(): không thuộc trace của nó
+            chat["task"] = asyncio.create_task(untraced(self._send_loop(chat_id, chat)))
+
+    async def _take_token(self, chat: dict):
+        while True:
+            now = time.monotonic()
+            chat["tokens"] = min(
+                self.burst, chat["tokens"] + (now - chat["updated"]) / self.interval
+            )
+            chat["updated"] = now
+            if chat["tokens"] >= 1:
+                chat["tokens"] -= 1
+                return
+            await asyncio.sleep((1 - chat["tokens"]) * self.interval)
+
+    async def _send_one(self, chat_id: int, item: dict):
+        if item["image_url"]:
+            await photo_cache.send(
+                self.bot.send_photo,
+                item["image_url"],
+                chat_id=chat_id,
+                caption=item["text"],
+                reply_markup=item["reply_markup"],
+            )
+        else:
+            await self.bot.send_message(
+                chat_id=chat_id, text=item["text"], reply_markup=item["reply_markup"]
+            )
+
+    async def _send_digest(self, chat: dict, chat_id: int, batch: list):
+        title = batch[-1]["digest_title"] or "📦 {count} thông báo gộp:"
+        lines = [title.format(count=len(batch)), ""]
+        lines.extend(f"• {item['summary']}" for item in batch)
+        for i, page in enumerate(paginate_lines(lines)):
+            if i:
+                await self._take_token(chat)
+            await self.bot.send_message(chat_id=chat_id, text=page)
+
+    async def _send_loop(self, chat_id: int, chat: dict):
+        # Sau ngần này giây không có tin, bucket đã đầy lại: chat không còn gì để nhớ
+        idle = self.burst * self.interval
+        while True:
+            if not chat["queue"]:
+                if self._stopping:
+                    return
+                chat["wake"].clear()
+                try:
+                    await asyncio.wait_for(chat["wake"].wait(), idle)
+                except asyncio.TimeoutError:
+                    if not chat["queue"] and self._chats.get(chat_id) is chat:
+                        del self._chats[chat_id]
+                        return
+                continue
+            await self._take_token(chat)
+            batch, chat["queue"] = chat["queue"], []
+            try:
+                if len(batch) == 1:
+                    await self._send_one(chat_id, batch[0])
+                    NOTIFY_SENT.inc(kind="single")
+                else:
+                    await self._send_digest(chat, chat_id, batch)
+                    NOTIFY_SENT.inc(kind="digest")
+            except RetryAfter as e:
+                print(f"[NOTIFY_FLOOD] chat {chat_id}: retry after {e.retry_after}s")
+                chat["queue"][:0] = batch
+                chat["tokens"] = 0
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                print(f"[ADMIN_NOTIFY_ERROR] chat {chat_id}: {e}")
+                NOTIFY_SENT.inc(len(batch), kind="dropped")
+
+    def start(self, bot):
+        self.bot = bot
+        self._stopping = False
+        for chat_id, chat in self._chats.items():
+            if chat["task"] is None:
+                chat["task"] = asyncio.create_task(untraced(self._send_loop(chat_id, chat)))
+
+    async def stop(self, timeout: float = 10):
+        """Gửi nốt tin còn trong hàng đợi (tối đa `timeout` giây) rồi dừng."""
+        self._stopping = True
+        tasks = [chat["task"] for chat in self._chats.values() if chat["task"] is not None]
+        for chat in self._chats.values():
+            chat["wake"].set()
+        if tasks:
+            _, still_running = await asyncio.wait(tasks, timeout=timeout)
+            for task in still_running:
+                task.cancel()
+            if still_running:
+                print(f"[NOTIFY] dropped {self.pending_count()} pending notifications on shutdown")
+        for chat in self._chats.values():
+            chat["task"] = None
+
+
+notifier = Notifier(NOTIFY_PER_MINUTE, NOTIFY_BURST)
+
+
+def format_menu_problems(catalog: MenuCatalog, limit: int = 30) -> str:
+    """Báo cáo các dòng MENU bị loại (rỗng nếu không có)."""
+    if not catalog.problems:
+        return ""
+    lines = [f"⚠️ MENU có {len(catalog.problems)} dòng bị bỏ qua:"]
+    lines.extend(f"• {problem}" for problem in catalog.problems[:limit])
+    if len(catalog.problems) > limit:
+        lines.append(f"… và {len(catalog.problems) - limit} dòng khác")
+    return "\n".join(lines)
+
+
+# Danh sách lỗi đã báo gần nhất, để không báo lại mỗi lần làm mới
+_reported_menu_problems = []
+
+
+def report_menu_problems(catalog: MenuCatalog):
+    """Gửi báo cáo dòng lỗi cho nhóm admin, chỉ khi danh sách lỗi thay đổi."""
+    if catalog.problems == _reported_menu_problems:
+        return
+    _reported_menu_problems[:] = catalog.problems
+    if catalog.problems:
+        print(f"[MENU_BAD_ROWS] {catalog.problems}")
+        if ADMIN_CHAT_ID:
+            notifier.submit(ADMIN_CHAT_ID, format_menu_problems(catalog))
+
+
+menu_catalog.on_change(report_menu_problems)
+
+
+def announce_sheets_state(degraded: bool):
+    """Báo nhóm admin khi vào / thoát chế độ dự phòng; khi thoát, đẩy ngay các đơn đã xếp hàng."""
+    if not degraded:
+        order_journal.flush_soon()
+    if not ADMIN_CHAT_ID:
+        return
+    if degraded:
+        text = (
+            f"⚠️ Google Sheets đang lỗi ({sheets.breaker.last_error!r}).\n"
+            f"Bot chuyển sang chế độ dự phòng: dùng MENU/SETTINGS đã lưu, đơn mới được "
+            f"xếp hàng và sẽ ghi lên ORDERS khi Sheets hoạt động lại."
+        )
+    else:
+        minutes = (time.monotonic() - sheets.breaker.degraded_since) / 60
+        text = (
+            f"✅ Google Sheets đã hoạt động lại sau {minutes:.0f} phút. Đang ghi "
+            f"{order_journal.pending_count()} đơn đã xếp hàng lên ORDERS."
+        )
+    notifier.submit(ADMIN_CHAT_ID, text)
+
+
+sheets.breaker.on_change(announce_sheets_state)
+
+# ================== TÌM MÓN (INLINE QUERY) ==================
+
+menu_search = SearchIndex()
+
+SEARCH_LATENCY = metrics.histogram(
+    "bot_menu_search_seconds",
+    "Thời gian tra chỉ mục tìm món (không gồm gọi Telegram)",
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01),
+)
+
+
+def reindex_menu(catalog: MenuCatalog):
+    """Cập nhật chỉ mục tìm kiếm theo menu mới (chỉ các món thêm / bớt / đổi tên)."""
+    menu_search.sync(
+        {
+            item.key: (item.id, item.name_vi, item.name_en)
+            for item in catalog.records
+            if item.listed
+        }
+    )
+
+
+menu_catalog.on_change(reindex_menu)
+
+# ================== BÁO CÁO DOANH THU ==================
+
+sales = SalesLedger()
+
+
+def order_time(order: OrderRow):
+    try:
+        return datetime.strptime(str(order.created_at), "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def record_sale(order: OrderRow, items: dict):
+    """Ghi đơn vào sổ bán hàng; `items` là {item_key: số lượng}."""
+    when = order_time(order)
+    if when is None:
+        return
+    sales.record(
+        order.order_id,
+        order.user_id,
+        when,
+        order.total or 0,
+        items,
+        active=order.status != "cancelled",
+    )
+
+
+def load_sales_history():
+    """Nạp các đơn có trong chỉ mục đơn (không đọc ORDERS) mà sổ bán hàng chưa có.
+
+    Gọi lười ở mỗi /report: ngoài lịch sử lúc khởi động, chỉ mục ở replica chủ
+    còn nhận thêm đơn đặt qua replica khác. items_text chỉ có tên món, nên tên
+    được đổi ngược sang ID theo MENU hiện tại; món không còn trong MENU giữ
+    nguyên tên.
+    """
+    missing = [order_id for order_id in order_index.by_id if order_id not in sales]
+    if not missing:
+        return
+    names = {}
+    for item in menu_catalog.records:
+        for name in (item.name_vi, item.name_en):
+            if name:
+                names.setdefault(fold_text(name), item.key)
+    for order_id in sorted(missing):
+        order = order_index.by_id[order_id]
+        items = {}
+        for qty, name in parse_items_text(order.items_text):
+            key = names.get(fold_text(name), name)
+            items[key] = items.get(key, 0) + qty
+        record_sale(order, items)
+
+
+def update_sale_status(order: OrderRow, old_status: str):
+    sales.set_active(order.order_id, order.status != "cancelled")
+
+
+order_index.on_status_change(update_sale_status)
+
+
+def parse_report_range(args: list, today: date):
+    """["today"] | ["week"] | ["2026-10-01"] | ["2026-10-01", "2026-10-07"] → (start, end) hoặc None."""
+    if not args or args[0].lower() in ("today", "homnay"):
+        return today, today
+    if args[0].lower() in ("week", "tuan"):
+        return today - timedelta(days=6), today
+    try:
+        start = datetime.strptime(args[0], "%Y-%m-%d").date()
+        end = datetime.strptime(args[1], "%Y-%m-%d").date() if len(args) > 1 else start
+    except ValueError:
+        return None
+    return (start, end) if start <= end else (end, start)
+
+
+def format_report(report) -> str:
+    """Báo cáo cho lệnh /report."""
+    period = str(report.start) if report.start == report.end else f"{report.start} → {report.end}"
+    if not report.orders:
+        return f"📈 Báo cáo {period}\n\nChưa có đơn nào trong khoảng này."
+
+    lines = [
+        f"📈 Báo cáo {period}",
+        f"🧾 {report.orders} đơn | 💰 {report.revenue}đ",
+        f"🛒 TB mỗi đơn: {report.average_basket:.0f}đ, {report.average_units:.1f} món",
+        "",
+        "⏰ Doanh thu theo giờ:",
+        *(f"  {hour:02d}h: {revenue}đ" for hour, revenue in enumerate(report.hours) if revenue),
+    ]
+    if len(report.days) > 1:
+        lines += ["", "📅 Theo ngày:"]
+        lines += [f"  {day}: {orders} đơn, {revenue}đ" for day, orders, revenue in report.days]
+
+    lines += ["", "🍜 Món bán chạy:"]
+    for key, qty in report.top_items(10):
+        item = menu_catalog.get(key)
+        lines.append(f"  {item.id} {item.name('vi')}: {qty}" if item else f"  {key}: {qty}")
+
+    lines += ["", "👤 Khách mua nhiều nhất:"]
+    for user_id, orders, revenue in report.top_customers(5):
+        recent = order_index.for_user(user_id, 1)
+        name = f"@{recent[0].username}" if recent and recent[0].username else f"id {user_id}"
+        lines.append(f"  {name}: {orders} đơn, {revenue}đ")
+    return "\n".join(lines)
+
+
+# ================== SETTINGS TRONG BỘ NHỚ ==================
+
+
+# Kiểu của các khóa SETTINGS không phải chuỗi, VD: {"max_items": int, "open": bool}.
+# Khóa khác giữ nguyên chuỗi như trong ô (số hotline "0901234567" không mất số 0).
+SETTING_TYPES = {}
 
-# {user_id: [{"id": str, "name": str, "price": int, "qty": int, "image_url": str}, ...]}
-CARTS = {}
+
+def parse_setting(key: str, raw):
+    """Đổi giá trị ô SETTINGS theo SETTING_TYPES; khóa không khai báo giữ nguyên chuỗi.
+
+    Giá trị sai kiểu cũng giữ nguyên chuỗi.
+    """
+    value = str(raw).strip()
+    cast = SETTING_TYPES.get(key)
+    if cast is bool:
+        if value.lower() in ("true", "yes", "on", "1"):
+            return True
+        if value.lower() in ("false", "no", "off", "0", ""):
+            return False
+        return value
+    if cast is not None:
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def settings_records(values: list) -> list:
+    """get_all_values của SETTINGS → [{"key": ..., "value": ...}], giữ nguyên chuỗi."""
+    if not values:
+        return []
+    header = [str(name).strip().lower() for name in values[0]]
+    return [dict(zip(header, row)) for row in values[1:]]
+
+
+class SettingsStore:
+    """Bảng key→value của SETTINGS trong bộ nhớ, làm mới theo chu kỳ hoặc bằng /reload.
+
+    Bản đọc thành công gần nhất được lưu vào `snapshots` như MenuCatalog.
+    """
+
+    def __init__(self, gateway: SheetsGateway, refresh_seconds: int, snapshots: SheetSnapshots = None):
+        self.gateway = gateway
+        self.refresh_seconds = refresh_seconds
+        self.snapshots = snapshots
+        self.values = {}
+        self._task = None
+
+    async def refresh(self):
+        # get_all_values thay vì get_all_records: gspread tự đổi "0901..." thành số
+        records = settings_records(await self.gateway.call("SETTINGS", "get_all_values"))
+        self.apply(records)
+        if self.snapshots is not None:
+            self.snapshots.save("SETTINGS", records)
+
+    def restore(self):
+        """Nạp bản SETTINGS đã lưu. Trả về thời điểm lưu hoặc None."""
+        snapshot = self.snapshots.load("SETTINGS") if self.snapshots is not None else None
+        if snapshot is None:
+            return None
+        records, saved_at = snapshot
+        self.apply(records)
+        return saved_at
+
+    def apply(self, records: list):
+        values = {}
+        for row in records:
+            key = str(row.get("key", "")).strip()
+            if key:
+                values[key] = parse_setting(key, row.get("value", ""))
+        self.values = values
+
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
+
+    def start(self):
+        if self._task is None and self.refresh_seconds > 0:
+            self._task = asyncio.create_task(
+                refresh_every(self.refresh_seconds, self.refresh, "SETTINGS")
+            )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+settings_store = SettingsStore(sheets, SETTINGS_REFRESH_SECONDS, sheet_snapshots)
 
 # ================== ĐA NGÔN NGỮ ==================
 
@@ -85,6 +2023,24 @@ MESSAGES = {
     "btn_cart": {"vi": "🛒 Giỏ hàng", "en": "🛒 Cart"},
     "btn_order": {"vi": "📦 Đặt hàng", "en": "📦 Order"},
     "btn_help": {"vi": "❓ Hướng dẫn", "en": "❓ Help"},
+    "btn_browse": {"vi": "🛍 Chọn món", "en": "🛍 Browse & add"},
+    "btn_search": {"vi": "🔍 Tìm món", "en": "🔍 Search"},
+    "inline_open_bot": {
+        "vi": "Mở bot để tìm và đặt món",
+        "en": "Open the bot to search and order",
+    },
+    "btn_back": {"vi": "⬅️ Nhóm món", "en": "⬅️ Categories"},
+    "browse_all": {"vi": "Tất cả món", "en": "All items"},
+    "browse_root": {"vi": "🛍 Chọn nhóm món:", "en": "🛍 Choose a category:"},
+    "browse_page": {
+        "vi": "🛍 {category} (trang {page}/{pages})\nBấm ➕ / ➖ để thêm, bớt món.",
+        "en": "🛍 {category} (page {page}/{pages})\nTap ➕ / ➖ to add or remove items.",
+    },
+    "browse_cart": {
+        "vi": "🛒 Giỏ: {qty} món · {total}đ — /cart để xem, /order để đặt.",
+        "en": "🛒 Cart: {qty} items · {total}đ — /cart to view, /order to check out.",
+    },
+    "browse_qty": {"vi": "{name}: {qty} trong giỏ", "en": "{name}: {qty} in cart"},
     "menu_header": {"vi": "📋 MENU HÔM NAY:", "en": "📋 TODAY'S MENU:"},
     "empty_menu": {
         "vi": "Hiện chưa có món nào trong menu.",
@@ -121,8 +2077,11 @@ MESSAGES = {
             "/help - Xem hướng dẫn\n"
             "/menu - Xem menu hiện tại\n"
             "/add <id> [số_lượng] - Thêm món vào giỏ (VD: /add F01 2)\n"
+            "/browse - Chọn món bằng nút bấm\n"
             "/cart - Xem giỏ hàng\n"
             "/order - Đặt hàng theo giỏ\n"
+            "/myorders - Xem các đơn gần đây\n"
+            "/status <mã_đơn> - Xem trạng thái một đơn\n"
             "/cancel - Hủy luồng đặt hàng hiện tại\n\n"
             "💡 Gợi ý: Bạn có thể xem ảnh món + ID món trong nhóm menu, "
             "sau đó dùng /add để đặt nhanh."
@@ -133,8 +2092,11 @@ MESSAGES = {
             "/help - Show help\n"
             "/menu - Show current menu\n"
             "/add <id> [qty] - Add item to cart (Ex: /add F01 2)\n"
+            "/browse - Pick items with buttons\n"
             "/cart - View cart\n"
             "/order - Place order by cart\n"
+            "/myorders - Your recent orders\n"
+            "/status <order_id> - Check an order's status\n"
             "/cancel - Cancel current ordering\n\n"
             "💡 Tip: Check dish photos + IDs in the menu group, then use /add."
         ),
@@ -159,6 +2121,88 @@ MESSAGES = {
         "vi": "✅ Đơn của bạn đã được ghi nhận! Mã đơn: {order_id}",
         "en": "✅ Your order has been placed! Order ID: {order_id}",
     },
+    "myorders_empty": {
+        "vi": "Bạn chưa có đơn nào.",
+        "en": "You have no orders yet.",
+    },
+    "myorders_header": {
+        "vi": "🧾 Các đơn gần đây của bạn:",
+        "en": "🧾 Your recent orders:",
+    },
+    "myorders_footer": {
+        "vi": "Xem chi tiết: /status <mã_đơn>",
+        "en": "Details: /status <order_id>",
+    },
+    "status_usage": {
+        "vi": "Cách dùng: /status <mã_đơn>. Ví dụ: /status 10001",
+        "en": "Usage: /status <order_id>. Example: /status 10001",
+    },
+    "status_not_found": {
+        "vi": "Không tìm thấy đơn #{order_id} của bạn.",
+        "en": "Order #{order_id} not found.",
+    },
+    "order_status": {
+        "vi": (
+            "🧾 Đơn #{order_id}\n"
+            "Trạng thái: {status}\n"
+            "Món: {items}\n"
+            "Tổng: {total}đ\n"
+            "Địa chỉ: {address}\n"
+            "Thời gian: {created_at}"
+        ),
+        "en": (
+            "🧾 Order #{order_id}\n"
+            "Status: {status}\n"
+            "Items: {items}\n"
+            "Total: {total}đ\n"
+            "Address: {address}\n"
+            "Placed at: {created_at}"
+        ),
+    },
+    "status_changed": {
+        "vi": "🔔 Đơn #{order_id} của bạn: {status}",
+        "en": "🔔 Your order #{order_id}: {status}",
+    },
+    "status_digest": {
+        "vi": "🔔 {count} cập nhật đơn hàng của bạn:",
+        "en": "🔔 {count} updates to your orders:",
+    },
+    "setstatus_usage": {
+        "vi": "Cách dùng: /setstatus <mã_đơn> <trạng_thái>. Trạng thái: {statuses}",
+        "en": "Usage: /setstatus <order_id> <status>. Statuses: {statuses}",
+    },
+    "report_usage": {
+        "vi": "Cách dùng: /report [today|week|YYYY-MM-DD [YYYY-MM-DD]]",
+        "en": "Usage: /report [today|week|YYYY-MM-DD [YYYY-MM-DD]]",
+    },
+    "status_updated": {
+        "vi": "Đơn #{order_id} → {status}",
+        "en": "Order #{order_id} → {status}",
+    },
+    "status_unchanged": {
+        "vi": "Đơn #{order_id} không tồn tại hoặc đã ở trạng thái này.",
+        "en": "Order #{order_id} not found or already in this status.",
+    },
+    "order_failed": {
+        "vi": "⚠️ Chưa lưu được đơn, vui lòng bấm xác nhận lại sau giây lát.",
+        "en": "⚠️ Could not save your order, please confirm again in a moment.",
+    },
+    "admin_only": {
+        "vi": "⛔ Lệnh này chỉ dành cho admin.",
+        "en": "⛔ This command is for admins only.",
+    },
+    "reload_done": {
+        "vi": "🔄 Đã nạp lại {settings} cài đặt và {items} món.",
+        "en": "🔄 Reloaded {settings} settings and {items} menu items.",
+    },
+    "reload_failed": {
+        "vi": "⚠️ Không nạp lại được từ Google Sheets ({error}). Bot vẫn dùng bản cũ ({items} món).",
+        "en": "⚠️ Could not reload from Google Sheets ({error}). Still serving the previous copy ({items} items).",
+    },
+    "not_ready": {
+        "vi": "⏳ Bot đang khởi động, vui lòng thử lại sau giây lát.",
+        "en": "⏳ The bot is starting up, please try again in a moment.",
+    },
     "order_btn_order_hint": {
         "vi": "📦 Bấm /order để bắt đầu đặt hàng.",
         "en": "📦 Type /order to start ordering.",
@@ -167,16 +2211,47 @@ MESSAGES = {
 
 
 def get_default_lang() -> str:
-    """Đọc SETTINGS.language_default nếu có, mặc định 'vi'."""
-    try:
-        records = settings_sheet.get_all_records()
-        for row in records:
-            if str(row.get("key", "")).strip() == "language_default":
-                value = str(row.get("value", "")).strip().lower()
-                return value if value in ("vi", "en") else "vi"
-    except Exception:
-        pass
-    return "vi"
+    """Đọc SETTINGS.language_default (từ bộ nhớ) nếu có, mặc định 'vi'."""
+    value = str(settings_store.get("language_default", "")).strip().lower()
+    return value if value in ("vi", "en") else "vi"
+
+
+# Nhãn hiển thị cho giá trị cột status của ORDERS
+ORDER_STATUS_LABELS = {
+    "pending": {"vi": "⏳ Chờ xác nhận", "en": "⏳ Pending"},
+    "confirmed": {"vi": "👍 Đã xác nhận", "en": "👍 Confirmed"},
+    "delivering": {"vi": "🛵 Đang giao", "en": "🛵 Out for delivery"},
+    "done": {"vi": "✅ Đã giao", "en": "✅ Delivered"},
+    "cancelled": {"vi": "❌ Đã hủy", "en": "❌ Cancelled"},
+}
+
+
+# Tên ngắn admin có thể gõ trong /setstatus
+ORDER_STATUS_ALIASES = {
+    "accept": "confirmed",
+    "ok": "confirmed",
+    "deliver": "delivering",
+    "ship": "delivering",
+    "delivered": "done",
+    "cancel": "cancelled",
+    "canceled": "cancelled",
+}
+
+
+def status_label(status: str, lang: str) -> str:
+    labels = ORDER_STATUS_LABELS.get(status)
+    return labels[lang] if labels else (status or "-")
+
+
+def order_status_keyboard(order_id: int):
+    """Nút đổi trạng thái gắn vào thông báo đơn mới trong nhóm admin."""
+    buttons = [
+        InlineKeyboardButton(
+            ORDER_STATUS_LABELS[status]["vi"], callback_data=f"ost:{order_id}:{status}"
+        )
+        for status in ("confirmed", "delivering", "done", "cancelled")
+    ]
+    return InlineKeyboardMarkup([buttons[:2], buttons[2:]])
 
 
 def get_lang(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> str:
@@ -187,6 +2262,15 @@ def get_lang(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> str:
     return lang
 
 
+def is_admin(update: Update) -> bool:
+    """Admin: người trong ADMIN_USER_IDS hoặc lệnh gửi từ nhóm ADMIN_CHAT_ID."""
+    user = update.effective_user
+    chat = update.effective_chat
+    if user and user.id in ADMIN_USER_IDS:
+        return True
+    return bool(ADMIN_CHAT_ID and chat and chat.id == ADMIN_CHAT_ID)
+
+
 def t(context: ContextTypes.DEFAULT_TYPE, user_id: int, key: str, **kwargs) -> str:
     lang = get_lang(context, user_id)
     text = MESSAGES.get(key, {}).get(lang, "")
@@ -199,10 +2283,23 @@ def t(context: ContextTypes.DEFAULT_TYPE, user_id: int, key: str, **kwargs) -> s
 
 
 def main_menu_keyboard(context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    """Inline keyboard 4 nút sau khi chọn ngôn ngữ."""
-    lang = get_lang(context, user_id)
+    """Inline keyboard các nút thao tác sau khi chọn ngôn ngữ."""
+    return main_menu_markup(get_lang(context, user_id))
+
+
+@functools.lru_cache(maxsize=None)
+def main_menu_markup(lang: str) -> InlineKeyboardMarkup:
+    """Bàn phím thao tác chính, dựng một lần cho mỗi ngôn ngữ."""
     return InlineKeyboardMarkup(
         [
+            [
+                InlineKeyboardButton(
+                    MESSAGES["btn_browse"][lang], callback_data="main_menu_browse"
+                ),
+                InlineKeyboardButton(
+                    MESSAGES["btn_search"][lang], switch_inline_query_current_chat=""
+                ),
+            ],
             [
                 InlineKeyboardButton(
                     MESSAGES["btn_menu"][lang], callback_data="main_menu_menu"
@@ -224,65 +2321,96 @@ def main_menu_keyboard(context: ContextTypes.DEFAULT_TYPE, user_id: int):
 
 
 def load_menu():
-    """Đọc toàn bộ menu từ sheet."""
-    return menu_sheet.get_all_records()
-
+    """Trả về menu từ bản sao trong bộ nhớ (không gọi Sheets)."""
+    return menu_catalog.records
 
-def add_to_cart(user_id: int, item: dict, qty: int):
-    """Thêm món vào giỏ, cộng dồn nếu trùng id."""
-    cart = CARTS.get(user_id, [])
-    for row in cart:
-        if row["id"] == item["id"]:
-            row["qty"] += qty
-            break
-    else:
-        cart.append(item | {"qty": qty})
-    CARTS[user_id] = cart
 
+async def get_cart(user_id: int, lang: str) -> list:
+    """Dựng giỏ để hiển thị: [{"id", "name", "price", "qty", "image_url"}, ...].
 
-async def send_menu(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE):
-    """Gửi menu theo ngôn ngữ người dùng."""
-    lang = get_lang(context, user_id)
+    Món không còn trong MENU bị bỏ qua.
+    """
+    cart = []
+    for item_id, qty in (await cart_store.items(user_id)).items():
+        item = menu_catalog.get(item_id)
+        if not item:
+            continue
+        cart.append(
+            {
+                "id": item_id,
+                "name": item.name(lang),
+                "price": item.price,
+                "qty": qty,
+                "image_url": item.image_url,
+            }
+        )
+    return cart
+
+
+# Giới hạn độ dài một tin nhắn Telegram
+TELEGRAM_MAX_MESSAGE = 4096
+
+
+def paginate_lines(lines: list, limit: int = TELEGRAM_MAX_MESSAGE) -> list:
+    """Ghép các dòng thành các trang, mỗi trang không quá `limit` ký tự."""
+    pages = []
+    current = []
+    size = 0
+    for line in lines:
+        line = line[:limit]
+        extra = len(line) + (1 if current else 0)
+        if current and size + extra > limit:
+            pages.append("\n".join(current))
+            current = []
+            extra = len(line)
+            size = 0
+        current.append(line)
+        size += extra
+    if current:
+        pages.append("\n".join(current))
+    return pages
+
+
+def render_menu_pages(lang: str) -> list:
+    """Render menu thành các trang tin nhắn; trả về [] nếu menu trống."""
     records = load_menu()
-
     if not records:
-        await context.bot.send_message(chat_id, t(context, user_id, "empty_menu"))
-        return
+        return []
 
-    lines = [t(context, user_id, "menu_header"), ""]
+    lines = [MESSAGES["menu_header"][lang], ""]
     for item in records:
-        # Chấp nhận các tên cột linh hoạt
-        status = str(item.get("status", "") or item.get("Status", "")).lower()
-        if status not in ("", "active", "sold_out"):
+        if not item.listed:
             continue
 
-        item_id = str(item.get("id") or item.get("ID") or "").strip()
-        name_vi = item.get("name_vi") or item.get("Name_VI") or item.get("NAME_VI")
-        name_en = item.get("name_en") or item.get("Name_EN") or item.get("NAME_EN")
-        price = item.get("price") or item.get("Price")
-
-        try:
-            price = int(price)
-        except Exception:
-            continue
-
-        name = name_vi if lang == "vi" else (name_en or name_vi or "")
-
         status_txt = ""
-        if status == "sold_out":
+        if item.sold_out:
             status_txt = " (hết / sold out)"
 
-        lines.append(f"{item_id}. {name} - {price}đ{status_txt}")
+        lines.append(f"{item.id}. {item.name(lang)} - {item.price}đ{status_txt}")
 
     lines.append("")
-    lines.append(t(context, user_id, "add_usage"))
+    lines.append(MESSAGES["add_usage"][lang])
+    return paginate_lines(lines)
 
-    await context.bot.send_message(chat_id, "\n".join(lines))
+
+@functools.partial(timed_handler, name="send_menu")
+async def send_menu(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE):
+    """Gửi menu theo ngôn ngữ người dùng (trang đã render sẵn theo phiên bản menu)."""
+    lang = get_lang(context, user_id)
+    pages = menu_catalog.derived(("menu_pages", lang), lambda: render_menu_pages(lang))
+
+    if not pages:
+        await context.bot.send_message(chat_id, t(context, user_id, "empty_menu"))
+        return
+
+    for page in pages:
+        await context.bot.send_message(chat_id, page)
 
 
+@functools.partial(timed_handler, name="send_cart")
 async def send_cart(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE):
     """Gửi nội dung giỏ hàng."""
-    cart = CARTS.get(user_id, [])
+    cart = await get_cart(user_id, get_lang(context, user_id))
     if not cart:
         await context.bot.send_message(chat_id, t(context, user_id, "cart_empty"))
         return
@@ -301,6 +2429,228 @@ async def send_cart(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TY
     await context.bot.send_message(chat_id, "\n".join(lines))
 
 
+# ================== DUYỆT MENU BẰNG NÚT ==================
+#
+# callback_data (tối đa 64 byte):
+#   b:r                     danh sách nhóm món
+#   b:c:<nhóm>:<trang>      một trang của nhóm (nhóm = chỉ số trong danh sách nhóm)
+#   b:+:<nhóm>:<trang>:<id> / b:-:...   thêm / bớt 1 món rồi hiện lại trang đó
+#   b:i:<id>                xem nhanh thông tin món (toast)
+#   b:p:<nhóm>:<trang>:<vị trí>  như b:i, cho món có ID quá dài (không có nút ➕/➖)
+#   b:cart                  gửi giỏ hàng
+
+
+def build_browse_views(lang: str) -> dict:
+    """Dựng sẵn mọi bàn phím duyệt menu cho một ngôn ngữ.
+
+    Kết quả được cache theo phiên bản menu (menu_catalog.derived), nên mỗi lần
+    bấm nút chỉ còn chọn bàn phím có sẵn và dựng dòng tóm tắt giỏ.
+    """
+    grouped = {}
+    for item in load_menu():
+        if item.listed:
+            grouped.setdefault(item.category, []).append(item)
+    categories = [name or MESSAGES["browse_all"][lang] for name in grouped]
+    # "items": (nhóm, trang) -> ID các món trên trang, cho nút b:p
+    views = {"categories": categories, "pages": [], "keyboards": {}, "items": {}}
+
+    cart_button = InlineKeyboardButton(MESSAGES["btn_cart"][lang], callback_data="b:cart")
+    back_button = InlineKeyboardButton(MESSAGES["btn_back"][lang], callback_data="b:r")
+
+    for index, items in enumerate(grouped.values()):
+        pages = [
+            items[start : start + BROWSE_PAGE_SIZE]
+            for start in range(0, len(items), BROWSE_PAGE_SIZE)
+        ]
+        views["pages"].append(len(pages))
+        for page, page_items in enumerate(pages):
+            rows = []
+            views["items"][(index, page)] = [item.key for item in page_items]
+            for slot, item in enumerate(page_items):
+                label = f"{item.name(lang)} · {item.price}đ"
+                if item.sold_out:
+                    label += " (hết / sold out)"
+                info = f"b:i:{item.key}"
+                if len(info.encode("utf-8")) > 64:
+                    # Một nút quá 64 byte làm Telegram từ chối cả bàn phím
+                    info = f"b:p:{index}:{page}:{slot}"
+                row = [InlineKeyboardButton(label, callback_data=info)]
+                plus = f"b:+:{index}:{page}:{item.key}"
+                minus = f"b:-:{index}:{page}:{item.key}"
+                if len(plus.encode("utf-8")) <= 64:
+                    row.insert(0, InlineKeyboardButton("➖", callback_data=minus))
+                    row.append(InlineKeyboardButton("➕", callback_data=plus))
+                rows.append(row)
+
+            nav = []
+            if page > 0:
+                nav.append(InlineKeyboardButton("◀️", callback_data=f"b:c:{index}:{page - 1}"))
+            if len(pages) > 1:
+                nav.append(
+                    InlineKeyboardButton(
+                        f"{page + 1}/{len(pages)}", callback_data=f"b:c:{index}:{page}"
+                    )
+                )
+            if page < len(pages) - 1:
+                nav.append(InlineKeyboardButton("▶️", callback_data=f"b:c:{index}:{page + 1}"))
+            if nav:
+                rows.append(nav)
+            rows.append([back_button, cart_button] if len(grouped) > 1 else [cart_button])
+            views["keyboards"][(index, page)] = InlineKeyboardMarkup(rows)
+
+    category_buttons = [
+        InlineKeyboardButton(name, callback_data=f"b:c:{index}:0")
+        for index, name in enumerate(categories)
+    ]
+    root_rows = [category_buttons[i : i + 2] for i in range(0, len(category_buttons), 2)]
+    root_rows.append([cart_button])
+    views["keyboards"]["root"] = InlineKeyboardMarkup(root_rows)
+    return views
+
+
+async def browse_view(lang: str, user_id: int, category: int = None, page: int = 0):
+    """(text, reply_markup) cho màn hình duyệt; `category` None = danh sách nhóm."""
+    views = menu_catalog.derived(("browse", lang), lambda: build_browse_views(lang))
+    categories = views["categories"]
+    if not categories:
+        return MESSAGES["empty_menu"][lang], None
+    if len(categories) == 1:
+        category = 0
+    if category is None or not 0 <= category < len(categories):
+        text = MESSAGES["browse_root"][lang]
+        markup = views["keyboards"]["root"]
+    else:
+        pages = views["pages"][category]
+        page = min(max(page, 0), pages - 1)
+        text = MESSAGES["browse_page"][lang].format(
+            category=categories[category], page=page + 1, pages=pages
+        )
+        markup = views["keyboards"][(category, page)]
+
+    cart = await get_cart(user_id, lang)
+    if cart:
+        text += "\n\n" + MESSAGES["browse_cart"][lang].format(
+            qty=sum(row["qty"] for row in cart),
+            total=sum(row["price"] * row["qty"] for row in cart),
+        )
+    return text, markup
+
+
+async def send_browse(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE):
+    """Gửi màn hình duyệt menu mới (danh sách nhóm, hoặc trang đầu nếu chỉ có một nhóm)."""
+    text, markup = await browse_view(get_lang(context, user_id), user_id)
+    await context.bot.send_message(chat_id, text, reply_markup=markup)
+
+
+async def browse_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    await send_browse(update.effective_chat.id, user.id, context)
+
+
+async def browse_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Xử lý mọi nút b:... của màn hình duyệt menu."""
+    query = update.callback_query
+    user = query.from_user
+    lang = get_lang(context, user.id)
+    parts = query.data.split(":", 4)
+    action = parts[1]
+
+    if action == "p":
+        views = menu_catalog.derived(("browse", lang), lambda: build_browse_views(lang))
+        keys = views["items"].get((int(parts[2]), int(parts[3])), [])
+        slot = int(parts[4])
+        parts, action = ["b", "i", keys[slot] if slot < len(keys) else ""], "i"
+    if action == "i":
+        item = menu_catalog.get(parts[2])
+        if item is None:
+            await query.answer(t(context, user.id, "item_not_found"))
+        else:
+            qty = (await cart_store.items(user.id)).get(item.key, 0)
+            await query.answer(
+                f"{item.name(lang)} · {item.price}đ\n"
+                + t(context, user.id, "browse_qty", name=item.id, qty=qty)
+            )
+        return
+    if action == "cart":
+        await query.answer()
+        await send_cart(query.message.chat_id, user.id, context)
+        return
+
+    category, page, toast = None, 0, None
+    if action in ("+", "-"):
+        category, page = int(parts[2]), int(parts[3])
+        item = menu_catalog.get(parts[4])
+        if item is None:
+            toast = t(context, user.id, "item_not_found")
+        else:
+            qty = await cart_store.add(user.id, item.key, 1 if action == "+" else -1)
+            toast = t(context, user.id, "browse_qty", name=item.name(lang), qty=qty)
+    elif action == "c":
+        category, page = int(parts[2]), int(parts[3])
+    await query.answer(toast)
+
+    text, markup = await browse_view(lang, user.id, category, page)
+    try:
+        await query.edit_message_text(text, reply_markup=markup)
+    except BadRequest as e:
+        # "Message is not modified": bấm lại đúng trang đang xem
+        if "not modified" not in str(e).lower():
+            raise
+
+
+def build_inline_results(lang: str) -> dict:
+    """{item.key: InlineQueryResultArticle} cho mọi món đang hiện, theo ngôn ngữ.
+
+    Chọn một kết quả sẽ gửi "/add <id>" vào chat, add_cmd thêm món vào giỏ. Chỉ
+    đúng trong chat riêng với bot (xem inline_search).
+    """
+    results = {}
+    for item in load_menu():
+        if not item.listed:
+            continue
+        description = f"{item.price}đ"
+        if item.sold_out:
+            description += " (hết / sold out)"
+        results[item.key] = InlineQueryResultArticle(
+            id=item.key[:64],
+            title=item.name(lang),
+            description=description,
+            input_message_content=InputTextMessageContent(f"/add {item.id}"),
+            thumb_url=item.image_url or None,
+        )
+    return results
+
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """@bot <tên món>: tìm món không dấu, trả kết quả từ chỉ mục trong bộ nhớ.
+
+    Chỉ phục vụ trong chat riêng với bot (nút 🔍 Tìm món mở inline ngay tại đó):
+    kết quả gửi "/add <id>", mà ở chat khác tin đó không tới bot hoặc bị hiểu là
+    lệnh cho bot khác. Ở chat khác chỉ trả nút mở chat riêng với bot.
+    """
+    query = update.inline_query
+    lang = get_lang(context, query.from_user.id)
+    if query.chat_type != "sender":
+        await query.answer(
+            [],
+            cache_time=30,
+            is_personal=True,
+            switch_pm_text=MESSAGES["inline_open_bot"][lang],
+            switch_pm_parameter="search",
+        )
+        return
+    results = menu_catalog.derived(("inline_results", lang), lambda: build_inline_results(lang))
+
+    if query.query.strip():
+        with SEARCH_LATENCY.time():
+            keys = menu_search.search(query.query, limit=INLINE_RESULTS)
+        answer = [results[key] for key in keys if key in results]
+    else:
+        answer = list(results.values())[:INLINE_RESULTS]
+    # Kết quả theo ngôn ngữ của người hỏi: Telegram không được dùng chung cache giữa các user
+    await query.answer(answer, cache_time=30, is_personal=True)
+
+
 # ================== HANDLER LỆNH CƠ BẢN ==================
 
 
@@ -372,53 +2722,266 @@ async def add_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             qty = 1
 
     lang = get_lang(context, user.id)
-    records = load_menu()
-    target = None
-
-    for item in records:
-        raw_id = str(item.get("id") or item.get("ID") or "").strip()
-        if raw_id.lower() == item_code.lower():
-            target = item
-            break
+    target = menu_catalog.get(item_code)
 
     if not target:
         await update.message.reply_text(t(context, user.id, "item_not_found"))
         return
 
-    name_vi = target.get("name_vi") or target.get("Name_VI") or target.get("NAME_VI")
-    name_en = target.get("name_en") or target.get("Name_EN") or target.get("NAME_EN")
-    price = target.get("price") or target.get("Price")
+    name = target.name(lang)
+    await cart_store.add(user.id, item_code, qty)
+
+    await update.message.reply_text(
+        t(context, user.id, "added_to_cart", qty=qty, name=name)
+        + "\n"
+        + t(context, user.id, "cart_next_actions")
+    )
+
+
+# ================== TRA CỨU ĐƠN ==================
+
+
+async def myorders_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/myorders: các đơn gần đây của người dùng, đọc từ chỉ mục cục bộ."""
+    user = update.effective_user
+    lang = get_lang(context, user.id)
+    orders = order_index.for_user(user.id)
+    if not orders:
+        await update.message.reply_text(t(context, user.id, "myorders_empty"))
+        return
+
+    lines = [t(context, user.id, "myorders_header"), ""]
+    for order in orders:
+        lines.append(
+            f"#{order.order_id} · {order.created_at} · {order.total}đ · "
+            f"{status_label(order.status, lang)}"
+        )
+    lines.append("")
+    lines.append(t(context, user.id, "myorders_footer"))
+    await update.message.reply_text("\n".join(lines))
+
+
+async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/status <order_id>: trạng thái một đơn của chính người dùng (admin xem được mọi đơn)."""
+    user = update.effective_user
+    args = context.args
     try:
-        price = int(price)
-    except Exception:
-        await update.message.reply_text("Lỗi dữ liệu giá trong MENU.")
+        order_id = int(args[0].lstrip("#"))
+    except (IndexError, ValueError):
+        await update.message.reply_text(t(context, user.id, "status_usage"))
         return
 
-    name = name_vi if lang == "vi" else (name_en or name_vi or "")
+    order = order_index.get(order_id)
+    if order is None or (order.user_id != user.id and not is_admin(update)):
+        await update.message.reply_text(
+            t(context, user.id, "status_not_found", order_id=order_id)
+        )
+        return
 
-    image_url = (
-        target.get("image_url")
-        or target.get("Image_URL")
-        or target.get("IMAGE_URL")
-        or ""
+    await update.message.reply_text(
+        t(
+            context,
+            user.id,
+            "order_status",
+            order_id=order.order_id,
+            status=status_label(order.status, get_lang(context, user.id)),
+            items=order.items_text,
+            total=order.total,
+            address=order.address,
+            created_at=order.created_at,
+        )
     )
 
-    add_to_cart(
-        user.id,
-        {
-            "id": str(item_code),
-            "name": name,
-            "price": price,
-            "image_url": image_url,
-        },
-        qty,
+
+# ================== LỆNH ADMIN ==================
+
+
+def notify_customer_status(order: OrderRow, old_status: str):
+    """Listener của order_index: báo khách mỗi khi trạng thái đơn đổi.
+
+    Chỉ replica chủ báo: mọi lệnh đổi trạng thái chạy ở đó, còn các replica
+    khác chỉ thấy lại cùng thay đổi đó khi đồng bộ ORDERS.
+    """
+    if not order_index.owner:
+        return
+    lang = order.lang if order.lang in ("vi", "en") else get_default_lang()
+    notifier.submit(
+        order.user_id,
+        MESSAGES["status_changed"][lang].format(
+            order_id=order.order_id, status=status_label(order.status, lang)
+        ),
+        digest_title=MESSAGES["status_digest"][lang],
     )
 
-    await update.message.reply_text(
-        t(context, user.id, "added_to_cart", qty=qty, name=name)
-        + "\n"
-        + t(context, user.id, "cart_next_actions")
+
+order_index.on_status_change(notify_customer_status)
+
+
+async def find_order(order_id: int):
+    """Đơn trong chỉ mục; chưa có thì đồng bộ ORDERS một lần rồi tìm lại.
+
+    Ở replica chủ, đơn vừa đặt qua replica khác chỉ có trong chỉ mục sau lần
+    đồng bộ kế tiếp.
+    """
+    if order_index.get(order_id) is None:
+        try:
+            await order_index.sync()
+        except Exception as e:
+            print(f"[ORDER_INDEX_REFRESH_ERROR] {e}")
+    return order_index.get(order_id)
+
+
+async def setstatus_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/setstatus <order_id> <status>: admin đổi trạng thái đơn."""
+    user = update.effective_user
+    if not is_admin(update):
+        await update.message.reply_text(t(context, user.id, "admin_only"))
+        return
+
+    args = context.args
+    try:
+        order_id = int(args[0].lstrip("#"))
+        status = args[1].strip().lower()
+    except (IndexError, ValueError):
+        status = None
+    status = ORDER_STATUS_ALIASES.get(status, status)
+    if status not in ORDER_STATUS_LABELS:
+        await update.message.reply_text(
+            t(context, user.id, "setstatus_usage", statuses=", ".join(ORDER_STATUS_LABELS))
+        )
+        return
+
+    lang = get_lang(context, user.id)
+    await find_order(order_id)
+    if order_index.update_status(order_id, status):
+        text = t(
+            context,
+            user.id,
+            "status_updated",
+            order_id=order_id,
+            status=status_label(status, lang),
+        )
+    else:
+        text = t(context, user.id, "status_unchanged", order_id=order_id)
+    await update.message.reply_text(text)
+
+
+async def order_status_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Nút ost:<order_id>:<status> trên thông báo đơn trong nhóm admin."""
+    query = update.callback_query
+    user = query.from_user
+    if not is_admin(update):
+        await query.answer(t(context, user.id, "admin_only"), show_alert=True)
+        return
+
+    _, order_id, status = query.data.split(":", 2)
+    order_id = int(order_id)
+    if status not in ORDER_STATUS_LABELS:
+        await query.answer()
+        return
+    lang = get_lang(context, user.id)
+    await find_order(order_id)
+    if order_index.update_status(order_id, status):
+        text = t(
+            context,
+            user.id,
+            "status_updated",
+            order_id=order_id,
+            status=status_label(status, lang),
+        )
+    else:
+        text = t(context, user.id, "status_unchanged", order_id=order_id)
+    await query.answer(text)
+
+
+async def reload_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/reload: nạp lại SETTINGS và MENU ngay, không chờ chu kỳ làm mới."""
+    user = update.effective_user
+    if not is_admin(update):
+        await update.message.reply_text(t(context, user.id, "admin_only"))
+        return
+
+    try:
+        await settings_store.refresh()
+        await menu_catalog.refresh(force=True)
+    except Exception as e:
+        await update.message.reply_text(
+            t(context, user.id, "reload_failed", error=repr(e), items=len(menu_catalog.records))
+        )
+        return
+    text = t(
+        context,
+        user.id,
+        "reload_done",
+        settings=len(settings_store.values),
+        items=len(menu_catalog.records),
     )
+    problems = format_menu_problems(menu_catalog)
+    await update.message.reply_text(f"{text}\n\n{problems}" if problems else text)
+
+
+def format_stats() -> str:
+    """Tóm tắt metrics cho lệnh /stats."""
+
+    def rows(histogram, limit=8):
+        summary = sorted(histogram.summary().items(), key=lambda kv: -kv[1][0])[:limit]
+        lines = []
+        for (label,), (count, total, _, p95) in summary:
+            avg_ms = total / count * 1000 if count else 0
+            lines.append(f"  {label}: {count}x, avg {avg_ms:.0f}ms, p95 ≤{p95 * 1000:.0f}ms")
+        return lines or ["  (chưa có)"]
+
+    sheets_errors = sum(SHEETS_ERRORS.values().values())
+    handler_errors = sum(HANDLER_ERRORS.values().values())
+    uptime = time.monotonic() - readiness.started_at
+    lines = [
+        f"📊 Uptime: {uptime / 60:.0f} phút | ready: {readiness.ready}",
+        f"🛒 Giỏ đang mở: {len(cart_store)} | /order đang dở: {len(OPEN_CONVERSATIONS)}",
+        f"🧾 Đơn chờ đẩy lên ORDERS: {order_journal.pending_count()}"
+        f" | thông báo chờ gửi: {notifier.pending_count()}",
+        "📄 Sheets: " + ("⚠️ chế độ dự phòng" if sheets.breaker.open else "bình thường"),
+        "",
+        f"⚙️ Handler (lỗi: {handler_errors}):",
+        *rows(HANDLER_LATENCY),
+        "",
+        f"📄 Google Sheets (lỗi: {sheets_errors}):",
+        *rows(SHEETS_LATENCY),
+        "",
+        "✈️ Telegram API:",
+        *rows(TELEGRAM_LATENCY),
+    ]
+    return "\n".join(lines)
+
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats: tóm tắt độ trễ handler, Sheets, Telegram và trạng thái bộ nhớ (admin)."""
+    user = update.effective_user
+    if not is_admin(update):
+        await update.message.reply_text(t(context, user.id, "admin_only"))
+        return
+    await update.message.reply_text(format_stats())
+
+
+async def report_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/report [today|week|YYYY-MM-DD [YYYY-MM-DD]]: doanh thu, món bán chạy, khách top (admin)."""
+    user = update.effective_user
+    if not is_admin(update):
+        await update.message.reply_text(t(context, user.id, "admin_only"))
+        return
+
+    period = parse_report_range(context.args, date.today())
+    if period is None:
+        await update.message.reply_text(t(context, user.id, "report_usage"))
+        return
+    load_sales_history()
+    text = format_report(sales.report(*period))
+    for page in paginate_lines(text.split("\n")):
+        await update.message.reply_text(page)
+
+
+async def metrics_endpoint(headers, body):
+    """GET /metrics theo định dạng text của Prometheus."""
+    return HTTPStatus.OK, "text/plain; version=0.0.4", metrics.render().encode("utf-8")
 
 
 # ================== NÚT MAIN MENU (INLINE) ==================
@@ -432,7 +2995,9 @@ async def main_menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = query.message.chat_id
     data = query.data
 
-    if data == "main_menu_menu":
+    if data == "main_menu_browse":
+        await send_browse(chat_id, user.id, context)
+    elif data == "main_menu_menu":
         await send_menu(chat_id, user.id, context)
     elif data == "main_menu_cart":
         await send_cart(chat_id, user.id, context)
@@ -448,7 +3013,7 @@ async def main_menu_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def order_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    cart = CARTS.get(user.id, [])
+    cart = await cart_store.items(user.id)
     if not cart:
         await update.message.reply_text(t(context, user.id, "cart_empty"))
         return ConversationHandler.END
@@ -468,7 +3033,10 @@ async def order_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     context.user_data["order_address"] = update.message.text.strip()
 
-    cart = CARTS.get(user.id, [])
+    cart = await get_cart(user.id, get_lang(context, user.id))
+    # Đơn được lập từ đúng các dòng khách thấy ở đây, dù MENU đổi giá / bỏ món
+    # trước khi khách bấm xác nhận
+    context.user_data["order_cart"] = cart
     total = sum(row["price"] * row["qty"] for row in cart)
 
     lines = []
@@ -504,8 +3072,9 @@ async def order_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
     markup = InlineKeyboardMarkup(keyboard)
 
     if first_image:
-        await update.message.reply_photo(
-            photo=first_image,
+        await photo_cache.send(
+            update.message.reply_photo,
+            first_image,
             caption=text,
             reply_markup=markup,
         )
@@ -523,12 +3092,16 @@ async def order_confirm_button(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = user.id
 
     if query.data == "order_no":
+        context.user_data.pop("order_cart", None)
         await query.edit_message_reply_markup(reply_markup=None)
         await query.message.reply_text(t(context, user_id, "order_cancelled"))
         return ConversationHandler.END
 
     # order_yes
-    cart = CARTS.get(user_id, [])
+    lang = get_lang(context, user_id)
+    cart = context.user_data.get("order_cart")
+    if cart is None:
+        cart = await get_cart(user_id, lang)
     if not cart:
         await query.message.reply_text(t(context, user_id, "cart_empty"))
         return ConversationHandler.END
@@ -536,39 +3109,42 @@ async def order_confirm_button(update: Update, context: ContextTypes.DEFAULT_TYP
     total = sum(row["price"] * row["qty"] for row in cart)
     phone = context.user_data.get("order_phone", "")
     address = context.user_data.get("order_address", "")
-    lang = get_lang(context, user_id)
 
-    # tạo order_id
-    current_records = orders_sheet.get_all_records()
-    order_id = 10001 + len(current_records)
+    # tạo order_id từ bộ đếm cục bộ
+    order_id = await order_ids.next_id()
 
     items_text = ", ".join([f"{row['qty']}x {row['name']}" for row in cart])
     now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    # ghi vào sheet ORDERS
+    # ghi vào nhật ký cục bộ; luồng nền sẽ đẩy lên sheet ORDERS
     try:
-        orders_sheet.append_row(
-            [
-                order_id,
-                user_id,
-                user.username or "",
-                phone,
-                items_text,
-                total,
-                address,
-                lang,
-                now_str,
-                "pending",
-            ]
+        order = OrderRow(
+            order_id=order_id,
+            user_id=user_id,
+            username=user.username or "",
+            phone=phone,
+            items_text=items_text,
+            total=total,
+            address=address,
+            lang=lang,
+            created_at=now_str,
+            status="pending",
         )
+        order_journal.append(order.to_values())
     except Exception as e:
-        print(f"[ORDERS_APPEND_ERROR] {e}")
+        print(f"[ORDER_JOURNAL_ERROR] {e}")
+        await query.message.reply_text(t(context, user_id, "order_failed"))
+        return CONFIRM
+
+    context.user_data.pop("order_cart", None)
+    order_index.add(order)
+    record_sale(order, {row["id"]: row["qty"] for row in cart})
 
     # Tắt nút Yes/No trên message cũ
     await query.edit_message_reply_markup(reply_markup=None)
 
     # Xóa giỏ
-    CARTS[user_id] = []
+    cart_store.clear(user_id)
 
     # Tìm ảnh đầu tiên trong giỏ cho admin (nếu có)
     first_image = None
@@ -577,7 +3153,7 @@ async def order_confirm_button(update: Update, context: ContextTypes.DEFAULT_TYP
             first_image = row["image_url"]
             break
 
-    # Thông báo sang nhóm Admin nếu có
+    # Thông báo sang nhóm Admin nếu có (gửi nền, không chờ)
     if ADMIN_CHAT_ID:
         admin_text = (
             f"🆕 ĐƠN HÀNG MỚI #{order_id}\n"
@@ -589,20 +3165,13 @@ async def order_confirm_button(update: Update, context: ContextTypes.DEFAULT_TYP
             f"Tổng: {total}đ\n"
             f"Thời gian: {now_str}"
         )
-        try:
-            if first_image:
-                await context.bot.send_photo(
-                    chat_id=ADMIN_CHAT_ID,
-                    photo=first_image,
-                    caption=admin_text,
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id=ADMIN_CHAT_ID,
-                    text=admin_text,
-                )
-        except Exception as e:
-            print(f"[ADMIN_NOTIFY_ERROR] {e}")
+        notifier.submit(
+            ADMIN_CHAT_ID,
+            admin_text,
+            image_url=first_image,
+            summary=f"#{order_id} {user.full_name} - {phone} - {items_text} - {total}đ",
+            reply_markup=order_status_keyboard(order_id),
+        )
 
     # Báo lại cho khách
     await query.message.reply_text(
@@ -613,15 +3182,413 @@ async def order_confirm_button(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def order_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
+    context.user_data.pop("order_cart", None)
     await update.message.reply_text(t(context, user.id, "order_cancelled"))
     return ConversationHandler.END
 
 
+# ================== TRẠNG THÁI NGƯỜI DÙNG (STATE BACKEND) ==================
+
+
+class UserStateSync:
+    """Nạp trạng thái của người dùng từ state backend trước mỗi update, ghi lại
+    phần đã đổi sau update: context.user_data (khóa user:<id>), bước của các
+    ConversationHandler đã đăng ký (conv:<tên>:<chat>:<user>) và giỏ hàng.
+
+    Với backend cục bộ (SQLite, một tiến trình), bản trong bộ nhớ là chuẩn nên
+    chỉ nạp lần đầu gặp người dùng (VD: sau khi khởi động lại). Với backend dùng
+    chung (Redis), nạp lại ở mỗi update vì update trước có thể do replica khác
+    xử lý. Mọi khóa của một update được đọc bằng một lần get_many; đọc và ghi
+    đi qua backend.call(), không chặn event loop.
+
+    Dùng thuộc tính riêng `_user_data` / `_conversations` / `_get_key` của PTB
+    (phiên bản đã ghim trong requirements.txt), vì persistence của PTB chỉ ghi
+    theo chu kỳ, không đủ cho nhiều replica.
+    """
+
+    def __init__(self, backend, carts: CartStore, conversation_ttl: int):
+        self.backend = backend
+        self.carts = carts
+        self.conversation_ttl = conversation_ttl
+        self._conversations = {}
+        self._loaded = set()
+
+    def track(self, name: str, handler: ConversationHandler):
+        """Lưu bước của `handler` vào backend dưới tên `name`."""
+        self._conversations[name] = handler
+
+    def _conversation_keys(self, update: Update) -> list:
+        keys = []
+        for name, handler in self._conversations.items():
+            try:
+                conv_key = handler._get_key(update)
+            except RuntimeError:
+                continue
+            keys.append((handler, conv_key, f"conv:{name}:" + ":".join(map(str, conv_key))))
+        return keys
+
+    @staticmethod
+    def _dump_user(app: Application, user_id: int) -> str:
+        return json.dumps(app._user_data.get(user_id, {}), sort_keys=True, ensure_ascii=False)
+
+    async def load(self, app: Application, update: Update):
+        """Nạp trạng thái; trả về ảnh chụp cho save(), hoặc None nếu update không có người dùng."""
+        user = update.effective_user
+        if user is None:
+            return None
+        conversations = self._conversation_keys(update)
+        if self.backend.shared or user.id not in self._loaded:
+            keys = [f"user:{user.id}", CartStore.key(user.id)]
+            keys += [key for _, _, key in conversations]
+            raw_user, raw_cart, *raw_states = await self.backend.call(
+                self.backend.get_many, keys
+            )
+            data = app._user_data[user.id]
+            data.clear()
+            data.update(json.loads(raw_user) if raw_user else {})
+            self.carts.load(user.id, raw_cart)
+            for (handler, conv_key, _), raw in zip(conversations, raw_states):
+                if raw is None:
+                    handler._conversations.pop(conv_key, None)
+                else:
+                    handler._conversations[conv_key] = json.loads(raw)
+            self._loaded.add(user.id)
+        states = [
+            (handler, conv_key, key, handler._conversations.get(conv_key))
+            for handler, conv_key, key in conversations
+        ]
+        return user.id, self._dump_user(app, user.id), states
+
+    async def save(self, app: Application, snapshot):
+        """Ghi phần user_data / bước conversation đã đổi kể từ load()."""
+        user_id, user_before, states = snapshot
+        user_after = self._dump_user(app, user_id)
+        if user_after != user_before:
+            await self.backend.call(self.backend.set, f"user:{user_id}", user_after)
+
+        changed = {}
+        ended = []
+        for handler, conv_key, key, before in states:
+            after = handler._conversations.get(conv_key)
+            if after == before:
+                continue
+            if after is None:
+                ended.append(key)
+            elif isinstance(after, int):
+                changed[key] = json.dumps(after)
+        if changed:
+            await self.backend.call(self.backend.set_many, changed, self.conversation_ttl or None)
+        if ended:
+            await self.backend.call(self.backend.delete, *ended)
+
+
+user_state = UserStateSync(state_backend, cart_store, CART_IDLE_TTL_SECONDS)
+
+# ================== XỬ LÝ SONG SONG ==================
+
+
+def update_label(update: object) -> str:
+    """Tên ngắn của update cho trace: "/order", "callback:b", "message", "inline_query"."""
+    if isinstance(update, Update):
+        message = update.message
+        if message and message.text:
+            if message.text.startswith("/"):
+                return message.text.split()[0].split("@")[0]
+            return "message"
+        if update.callback_query:
+            return "callback:" + (update.callback_query.data or "").split(":")[0]
+        if update.inline_query:
+            return "inline_query"
+    return type(update).__name__
+
+
+class UserOrderedApplication(Application):
+    """Application xử lý update của nhiều người dùng song song, nhưng tuần tự
+    trong cùng một người dùng.
+
+    Giỏ hàng và các bước PHONE/ADDRESS/CONFIRM của /order vì thế không bị hai
+    update của cùng một người chen nhau. Song song khi dùng kèm
+    concurrent_updates(N). Trong khóa của người dùng, `state_sync` (nếu có)
+    nạp trạng thái của người đó từ state backend và ghi lại sau update.
+
+    Update từ update_queue chờ tới lượt của người dùng trước, rồi mới lấy một
+    chỗ trong concurrent_updates: một người gửi dồn nhiều update chỉ giữ một
+    chỗ, không chặn người khác.
+    """
+
+    state_sync = None
+    # id người dùng / chat luôn được xử lý ở replica chủ (xem ShardRouter)
+    shard_pinned = frozenset()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._user_locks = {}
+
+    @staticmethod
+    def ordering_key(update: object):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return ("user", update.effective_user.id)
+            if update.effective_chat:
+                return ("chat", update.effective_chat.id)
+        return None
+
+    async def process_update(self, update: object) -> None:
+        await self._process_in_turn(update, None)
+
+    async def _Application__process_update_wrapper(self, update: object) -> None:
+        # Thay wrapper của PTB 20 (_update_fetcher gọi nó cho mỗi update trong
+        # update_queue), vốn giữ _concurrent_updates_sem suốt process_update
+        await self._process_in_turn(update, self._concurrent_updates_sem)
+        self.update_queue.task_done()
+
+    async def _process_in_turn(self, update: object, slot):
+        """Chờ lượt của người dùng, rồi (nếu có `slot`) chờ một chỗ xử lý."""
+        key = self.ordering_key(update)
+        attrs = {"user": key[1]} if key is not None and key[0] == "user" else {}
+        with tracer.trace(update_label(update), **attrs):
+            if key is None:
+                if slot is None:
+                    await super().process_update(update)
+                    return
+                async with slot:
+                    await super().process_update(update)
+                return
+
+            # [lock, số update đang giữ/chờ]; xóa khi không còn ai dùng
+            entry = self._user_locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                with tracer.span("user_lock", "queue"):
+                    await entry[0].acquire()
+                try:
+                    if slot is None:
+                        await self._process_with_state(update)
+                    else:
+                        with tracer.span("slot", "queue"):
+                            await slot.acquire()
+                        try:
+                            await self._process_with_state(update)
+                        finally:
+                            slot.release()
+                finally:
+                    entry[0].release()
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._user_locks[key]
+
+    async def _process_with_state(self, update: Update):
+        snapshot = None
+        if self.state_sync is not None:
+            try:
+                with tracer.span("load", "state"):
+                    snapshot = await self.state_sync.load(self, update)
+            except Exception as e:
+                print(f"[STATE_LOAD_ERROR] {e!r}")
+        try:
+            await super().process_update(update)
+        finally:
+            if snapshot is not None:
+                try:
+                    with tracer.span("save", "state"):
+                        await self.state_sync.save(self, snapshot)
+                except Exception as e:
+                    print(f"[STATE_SAVE_ERROR] {e!r}")
+
+
+# ================== KHỞI ĐỘNG & READINESS ==================
+
+
+class Readiness:
+    """Làm nóng các backend Sheets ở nền, bot vẫn nhận update trong lúc đó.
+
+    Mỗi bước được thử lại (backoff) cho tới khi thành công, thay vì làm worker
+    crash-loop khi Google chậm hoặc lỗi. Khi mọi bước xong, in dòng [READY].
+    """
+
+    def __init__(self, steps: list):
+        self.steps = steps
+        self.done = {}
+        self.started_at = time.monotonic()
+        self.ready_at = None
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    async def _run_step(self, name: str, step):
+        delay = 1
+        while True:
+            try:
+                await step()
+                break
+            except Exception as e:
+                print(f"[STARTUP] {name} not ready: {e!r}; retry in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+        self.done[name] = round(time.monotonic() - self.started_at, 2)
+
+    async def warm_up(self, on_ready=None):
+        await asyncio.gather(*(self._run_step(name, step) for name, step in self.steps))
+        self.ready_at = time.monotonic()
+        print(
+            f"[READY] Sheets backends warm after "
+            f"{self.ready_at - self.started_at:.1f}s {self.done}"
+        )
+        if on_ready is not None:
+            await on_ready()
+
+    def start(self, on_ready=None):
+        """Bắt đầu làm nóng ở nền; `on_ready` (async) chạy sau khi sẵn sàng."""
+        if self._task is None:
+            self.started_at = time.monotonic()
+            self._task = asyncio.create_task(self.warm_up(on_ready))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "steps": {name: self.done.get(name) for name, _ in self.steps},
+        }
+
+
+async def warm_from_snapshot(name: str, load, restore):
+    """Nạp từ Sheets; nếu Sheets đang bị ngắt mạch thì dùng bản đã lưu (nếu có)."""
+    try:
+        await load()
+    except SheetsUnavailable:
+        saved_at = restore()
+        if saved_at is None:
+            raise
+        print(
+            f"[STARTUP] {name}: Sheets unavailable, serving snapshot saved "
+            f"{time.time() - saved_at:.0f}s ago"
+        )
+
+
+async def warm_settings():
+    await warm_from_snapshot("SETTINGS", settings_store.refresh, settings_store.restore)
+    settings_store.start()
+
+
+async def warm_menu():
+    await warm_from_snapshot("MENU", menu_catalog.load, menu_catalog.restore)
+    menu_catalog.start()
+
+
+async def warm_order_ids():
+    try:
+        await order_ids.reconcile()
+    except SheetsUnavailable:
+        # Đã từng cấp mã thì bộ đếm đã lưu đủ tin cậy; chưa thì bắt buộc đọc ORDERS
+        if await order_ids.current() < order_ids.start:
+            raise
+        print("[STARTUP] order_ids: Sheets unavailable, continuing from stored counter")
+
+
+readiness = Readiness(
+    [
+        ("settings", warm_settings),
+        ("menu", warm_menu),
+        ("order_ids", warm_order_ids),
+    ]
+)
+
+
+async def readiness_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Chạy trước mọi handler: khi Sheets chưa sẵn sàng, chỉ cho /start, /help, các
+    lệnh tra cứu đơn (chỉ mục cục bộ) và nút chọn ngôn ngữ đi qua; các update khác
+    nhận thông báo "đang khởi động".
+    """
+    if readiness.ready or not update.effective_user:
+        return
+
+    message = update.message
+    if message and message.text:
+        command = message.text.split()[0].split("@")[0]
+        if command in ("/start", "/help", "/myorders", "/status"):
+            return
+    query = update.callback_query
+    if query and (query.data or "").startswith("lang_"):
+        return
+
+    text = t(context, update.effective_user.id, "not_ready")
+    if query:
+        await query.answer(text)
+    elif update.effective_message:
+        await update.effective_message.reply_text(text)
+    raise ApplicationHandlerStop
+
+
+async def healthz(headers, body):
+    """Liveness: tiến trình còn chạy."""
+    return HTTPStatus.OK, "text/plain", b"ok"
+
+
+async def readyz(headers, body):
+    """Readiness: 200 khi MENU/SETTINGS/bộ đếm đơn đã nạp xong, ngược lại 503."""
+    status = HTTPStatus.OK if readiness.ready else HTTPStatus.SERVICE_UNAVAILABLE
+    return status, "application/json", json.dumps(readiness.report()).encode("utf-8")
+
+
+async def post_init(app):
+    order_journal.start()
+    notifier.start(app.bot)
+    order_index.start()
+    cart_store.start()
+
+    on_ready = None
+    if PREWARM_IMAGES and ADMIN_CHAT_ID:
+
+        async def on_ready():
+            await prewarm_photos(app.bot, ADMIN_CHAT_ID)
+
+    readiness.start(on_ready)
+
+
+async def post_shutdown(app):
+    await readiness.stop()
+    await menu_catalog.stop()
+    await settings_store.stop()
+    await cart_store.stop()
+    await order_index.stop()
+    await order_journal.stop()
+    await notifier.stop()
+    sheets.shutdown()
+    state_backend.close()
+
+
 # ================== MAIN ==================
 
 
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+def build_app(builder: ApplicationBuilder = None) -> Application:
+    """Dựng Application với đầy đủ handler. `builder` cho phép thay phần kết nối
+    Telegram (VD: bench.py dùng request giả, không cần mạng).
+    """
+    builder = (
+        (builder or ApplicationBuilder().token(BOT_TOKEN))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .rate_limiter(TelegramCallTimer())
+    )
+    builder = builder.application_class(UserOrderedApplication)
+    if CONCURRENT_UPDATES > 0:
+        builder = builder.concurrent_updates(CONCURRENT_UPDATES)
+    app = builder.build()
+    app.state_sync = user_state
+    # Lệnh admin và nút trạng thái đơn chỉ chạy ở replica chủ
+    app.shard_pinned = frozenset(ADMIN_USER_IDS) | (
+        {ADMIN_CHAT_ID} if ADMIN_CHAT_ID else frozenset()
+    )
+
+    # Chặn các thao tác cần Sheets khi bot chưa sẵn sàng
+    app.add_handler(TypeHandler(Update, readiness_gate), group=-1)
 
     # Lệnh cơ bản
     app.add_handler(CommandHandler("start", start))
@@ -629,6 +3596,16 @@ def main():
     app.add_handler(CommandHandler("menu", menu_cmd))
     app.add_handler(CommandHandler("cart", cart_cmd))
     app.add_handler(CommandHandler("add", add_cmd))
+    app.add_handler(CommandHandler("browse", browse_cmd))
+    app.add_handler(CommandHandler("myorders", myorders_cmd))
+    app.add_handler(CommandHandler("status", status_cmd))
+
+    # Lệnh admin
+    app.add_handler(CommandHandler("reload", reload_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CommandHandler("setstatus", setstatus_cmd))
+    app.add_handler(CommandHandler("report", report_cmd))
+    app.add_handler(CallbackQueryHandler(order_status_button, pattern=r"^ost:\d+:\w+$"))
 
     # Nút chọn ngôn ngữ
     app.add_handler(CallbackQueryHandler(lang_button, pattern="^lang_"))
@@ -636,6 +3613,12 @@ def main():
     # Nút main menu
     app.add_handler(CallbackQueryHandler(main_menu_router, pattern="^main_menu_"))
 
+    # Duyệt menu bằng nút
+    app.add_handler(CallbackQueryHandler(browse_button, pattern="^b:"))
+
+    # Tìm món: @bot <tên món>, trong chat riêng với bot
+    app.add_handler(InlineQueryHandler(inline_search))
+
     # Conversation /order
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("order", order_start)],
@@ -649,8 +3632,22 @@ def main():
         fallbacks=[CommandHandler("cancel", order_cancel)],
     )
     app.add_handler(conv_handler)
+    user_state.track("order", conv_handler)
+
+    instrument_handlers(app)
+    return app
 
-    app.run_polling(drop_pending_updates=True)
+
+def main():
+    app = build_app()
+    run_app(
+        app,
+        routes=[
+            ("GET", "/healthz", healthz),
+            ("GET", "/readyz", readyz),
+            ("GET", "/metrics", metrics_endpoint),
+        ],
+    )
 
 
 if __name__ == "__main__":
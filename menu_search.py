@@ -0,0 +1,109 @@
+"""Tìm món theo tên, không phân biệt dấu tiếng Việt ("pho bo" khớp "Phở bò").
+
+Chỉ mục nằm trong bộ nhớ: mỗi từ (đã bỏ dấu) được ghi vào bảng tiền tố, nên
+một truy vấn chỉ là vài lần tra dict và giao các tập ID món.
+
+    index = SearchIndex()
+    index.sync({"f01": ["Phở bò", "Beef pho"], "d01": ["Trà đá", "Iced tea"]})
+    index.search("pho")      # ["f01"]
+"""
+
+import re
+import unicodedata
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def fold_text(text: str) -> str:
+    """Chữ thường, bỏ dấu: "Phở Bò Đặc Biệt" → "pho bo dac biet"."""
+    text = unicodedata.normalize("NFD", str(text or "").lower())
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.replace("đ", "d")
+
+
+def tokenize(text: str) -> list:
+    return _WORD.findall(fold_text(text))
+
+
+class SearchIndex:
+    """Chỉ mục tiền tố theo từ cho một tập tài liệu nhỏ {key: [chuỗi, ...]}.
+
+    sync() chỉ cập nhật những key mới, bị xóa hoặc có nội dung đổi.
+    """
+
+    def __init__(self, max_prefix: int = 12):
+        self.max_prefix = max_prefix
+        # key -> (nội dung gốc, tập từ, các chuỗi đã bỏ dấu)
+        self._docs = {}
+        # tiền tố (tối đa max_prefix ký tự) -> tập key
+        self._prefixes = {}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _add(self, key, texts: tuple):
+        folded = tuple(" ".join(tokenize(text)) for text in texts if text)
+        tokens = {token for text in folded for token in text.split()}
+        self._docs[key] = (texts, tokens, folded)
+        for token in tokens:
+            for size in range(1, min(len(token), self.max_prefix) + 1):
+                self._prefixes.setdefault(token[:size], set()).add(key)
+
+    def _remove(self, key):
+        _, tokens, _ = self._docs.pop(key)
+        for token in tokens:
+            for size in range(1, min(len(token), self.max_prefix) + 1):
+                keys = self._prefixes.get(token[:size])
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._prefixes[token[:size]]
+
+    def sync(self, docs: dict) -> int:
+        """Đưa chỉ mục về đúng `docs`; trả về số key đã thêm / xóa / cập nhật."""
+        changed = 0
+        for key in [key for key in self._docs if key not in docs]:
+            self._remove(key)
+            changed += 1
+        for key, texts in docs.items():
+            texts = tuple(texts)
+            known = self._docs.get(key)
+            if known is not None and known[0] == texts:
+                continue
+            if known is not None:
+                self._remove(key)
+            self._add(key, texts)
+            changed += 1
+        return changed
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """Các key khớp mọi từ của `query` (theo tiền tố), xếp hạng tốt nhất trước."""
+        words = tokenize(query)
+        if not words:
+            return []
+
+        candidates = None
+        for word in words:
+            keys = self._prefixes.get(word[: self.max_prefix], set())
+            candidates = set(keys) if candidates is None else candidates & keys
+            if not candidates:
+                return []
+
+        phrase = " ".join(words)
+        ranked = []
+        for key in candidates:
+            _, tokens, folded = self._docs[key]
+            if any(len(word) > self.max_prefix for word in words) and not all(
+                any(token.startswith(word) for token in tokens) for word in words
+            ):
+                continue
+            # Từ khớp trọn được điểm cao hơn khớp tiền tố; cả cụm ở đầu tên thêm điểm
+            score = sum(2 if word in tokens else 1 for word in words)
+            if any(text.startswith(phrase) for text in folded):
+                score += 3
+            elif any(phrase in text for text in folded):
+                score += 1
+            shortest = min((len(text) for text in folded), default=0)
+            ranked.append((-score, shortest, str(key), key))
+        ranked.sort()
+        return [key for *_, key in ranked[:limit]]
@@ -0,0 +1,221 @@
+"""Bộ đo (counter / gauge / histogram) tối giản, xuất theo định dạng text của Prometheus.
+
+Không phụ thuộc prometheus_client. Ví dụ:
+
+    REQUESTS = counter("bot_requests_total", "Số request", ["handler"])
+    REQUESTS.inc(handler="send_menu")
+
+    LATENCY = histogram("bot_latency_seconds", "Độ trễ", ["handler"])
+    with LATENCY.time(handler="send_menu"):
+        ...
+
+    print(render())   # nội dung cho endpoint /metrics
+"""
+
+from contextlib import contextmanager
+import math
+import threading
+import time
+
+# Ngưỡng mặc định của histogram (giây)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(labelnames, values, extra=(), const=()) -> str:
+    pairs = list(const) + list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + body + "}"
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Nhãn cố định của registry (VD: tenant="shop_a"), gán khi register
+        self.const_labels = ()
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> list:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list:
+        lines = self.header()
+        for key, value in sorted(self.values().items()):
+            labels = _format_labels(self.labelnames, key, const=self.const_labels)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Gauge đọc giá trị lúc scrape qua hàm `fn()` (VD: số giỏ hàng đang mở)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, fn):
+        super().__init__(name, documentation)
+        self.fn = fn
+
+    def value(self):
+        try:
+            return self.fn()
+        except Exception:
+            return math.nan
+
+    def render(self) -> list:
+        labels = _format_labels((), (), const=self.const_labels)
+        return self.header() + [f"{self.name}{labels} {_format_value(self.value())}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # {labels: [count theo từng bucket..., sum, count]}
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def summary(self) -> dict:
+        """{labels: (count, tổng, p50 ước lượng, p95 ước lượng)} — phân vị lấy theo cận trên bucket."""
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        result = {}
+        for key, series in snapshot.items():
+            count = series[-1]
+            result[key] = (
+                count,
+                series[-2],
+                self._quantile(series, count, 0.5),
+                self._quantile(series, count, 0.95),
+            )
+        return result
+
+    def _quantile(self, series, count, q):
+        target = q * count
+        seen = 0
+        for i, bound in enumerate(self.buckets):
+            seen += series[i]
+            if seen >= target:
+                return bound
+        return math.inf
+
+    def render(self) -> list:
+        lines = self.header()
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += series[i]
+                labels = _format_labels(
+                    self.labelnames, key, [("le", _format_value(bound))], self.const_labels
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, const=self.const_labels)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Tập metric; `labels` (VD: {"tenant": "shop_a"}) được gắn vào mọi mẫu."""
+
+    def __init__(self, labels: dict = None):
+        self.labels = tuple((labels or {}).items())
+        self._metrics = []
+
+    def register(self, metric):
+        metric.const_labels = self.labels
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return render_all([self])
+
+
+def render_all(registries: list) -> str:
+    """Gộp nhiều registry; metric trùng tên chỉ in HELP/TYPE một lần."""
+    families = {}
+    for registry in registries:
+        for metric in registry._metrics:
+            lines = metric.render()
+            family = families.setdefault(metric.name, lines[:2])
+            family.extend(lines[2:])
+    return "\n".join(line for lines in families.values() for line in lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, fn) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, fn))
+
+
+def histogram(name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,191 @@
+"""Số liệu bán hàng cập nhật theo từng đơn, không cần đọc lại ORDERS.
+
+Luồng đơn được giữ ở dạng cột (mỗi thuộc tính một array, cùng chỉ số), kèm
+bảng tổng hợp theo ngày được cộng dồn ngay khi ghi đơn. Một báo cáo chỉ cộng
+các bảng tổng hợp của những ngày trong khoảng, nên trả lời trong vài mili giây
+dù có hàng chục nghìn đơn.
+
+    ledger = SalesLedger()
+    ledger.record(10001, 7, datetime.now(), 130000, {"f01": 2, "d01": 1})
+    report = ledger.report(date.today(), date.today())
+    report.revenue, report.top_items(5)
+"""
+
+from array import array
+from datetime import date, datetime
+import re
+
+_ITEM = re.compile(r"^\s*(\d+)\s*x\s*(.+?)\s*$")
+
+
+def parse_items_text(text: str) -> list:
+    """"2x Phở bò, 1x Trà đá" → [(2, "Phở bò"), (1, "Trà đá")]; phần không khớp bị bỏ."""
+    items = []
+    for part in str(text or "").split(","):
+        match = _ITEM.match(part)
+        if match:
+            items.append((int(match.group(1)), match.group(2)))
+    return items
+
+
+class DayTotals:
+    """Tổng hợp của một ngày: doanh thu theo giờ, số lượng theo món, theo khách."""
+
+    __slots__ = ("orders", "revenue", "units", "hours", "items", "customers")
+
+    def __init__(self):
+        self.orders = 0
+        self.revenue = 0
+        self.units = 0
+        self.hours = array("q", bytes(8 * 24))
+        # chỉ số món (SalesLedger.item_keys) -> số lượng
+        self.items = {}
+        # user_id -> [số đơn, doanh thu]
+        self.customers = {}
+
+
+class SalesReport:
+    """Kết quả cộng các DayTotals trong một khoảng ngày."""
+
+    def __init__(self, start: date, end: date, item_keys: list):
+        self.start = start
+        self.end = end
+        self.orders = 0
+        self.revenue = 0
+        self.units = 0
+        self.hours = [0] * 24
+        # [(ngày, số đơn, doanh thu)] theo thứ tự ngày, chỉ ngày có đơn
+        self.days = []
+        self._item_keys = item_keys
+        self._items = {}
+        self._customers = {}
+
+    def add_day(self, day: date, totals: DayTotals):
+        self.orders += totals.orders
+        self.revenue += totals.revenue
+        self.units += totals.units
+        for hour, revenue in enumerate(totals.hours):
+            self.hours[hour] += revenue
+        for index, qty in totals.items.items():
+            self._items[index] = self._items.get(index, 0) + qty
+        for user_id, (orders, revenue) in totals.customers.items():
+            entry = self._customers.setdefault(user_id, [0, 0])
+            entry[0] += orders
+            entry[1] += revenue
+        if totals.orders:
+            self.days.append((day, totals.orders, totals.revenue))
+
+    @property
+    def average_basket(self) -> float:
+        """Giá trị trung bình mỗi đơn."""
+        return self.revenue / self.orders if self.orders else 0
+
+    @property
+    def average_units(self) -> float:
+        """Số món trung bình mỗi đơn."""
+        return self.units / self.orders if self.orders else 0
+
+    def top_items(self, limit: int = 10) -> list:
+        """[(item_key, số lượng)] bán nhiều nhất trước."""
+        ranked = sorted(self._items.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+        return [(self._item_keys[index], qty) for index, qty in ranked if qty > 0]
+
+    def top_customers(self, limit: int = 5) -> list:
+        """[(user_id, số đơn, doanh thu)] doanh thu cao nhất trước."""
+        ranked = sorted(self._customers.items(), key=lambda kv: (-kv[1][1], kv[0]))[:limit]
+        return [(user_id, orders, revenue) for user_id, (orders, revenue) in ranked if orders > 0]
+
+
+class SalesLedger:
+    """Luồng đơn đã xác nhận dạng cột + tổng hợp theo ngày, cập nhật từng đơn.
+
+    record() bỏ qua mã đơn đã có, nên nạp lại lịch sử sau khi đã ghi vài đơn
+    mới là an toàn. Đơn bị hủy được trừ khỏi tổng hợp (set_active).
+    """
+
+    def __init__(self):
+        # Cột theo đơn (cùng chỉ số)
+        self.order_ids = array("q")
+        self.user_ids = array("q")
+        self.days = array("l")  # date.toordinal()
+        self.hours = array("b")
+        self.totals = array("q")
+        self.active = bytearray()
+        # Cột theo dòng món: dòng của đơn i nằm trong [line_start[i], line_start[i + 1])
+        self.line_start = array("l", [0])
+        self.line_item = array("l")
+        self.line_qty = array("l")
+        # Bảng intern item_key <-> chỉ số
+        self.item_keys = []
+        self._item_index = {}
+        self._position = {}
+        self.daily = {}
+
+    def __len__(self):
+        return len(self.order_ids)
+
+    def __contains__(self, order_id):
+        return order_id in self._position
+
+    def _intern(self, key: str) -> int:
+        index = self._item_index.get(key)
+        if index is None:
+            index = self._item_index[key] = len(self.item_keys)
+            self.item_keys.append(key)
+        return index
+
+    def record(self, order_id: int, user_id: int, when: datetime, total: int, items: dict, active: bool = True):
+        """Ghi một đơn; `items` là {item_key: số lượng}. Trả về False nếu đơn đã có."""
+        if order_id in self._position:
+            return False
+        self._position[order_id] = len(self.order_ids)
+        self.order_ids.append(order_id)
+        self.user_ids.append(user_id)
+        self.days.append(when.toordinal())
+        self.hours.append(when.hour)
+        self.totals.append(int(total))
+        self.active.append(1 if active else 0)
+        for key, qty in items.items():
+            self.line_item.append(self._intern(key))
+            self.line_qty.append(int(qty))
+        self.line_start.append(len(self.line_item))
+        if active:
+            self._apply(len(self.order_ids) - 1, 1)
+        return True
+
+    def set_active(self, order_id: int, active: bool):
+        """Đánh dấu đơn còn hiệu lực hay đã hủy, cập nhật tổng hợp tương ứng."""
+        position = self._position.get(order_id)
+        if position is None or bool(self.active[position]) == active:
+            return
+        self.active[position] = 1 if active else 0
+        self._apply(position, 1 if active else -1)
+
+    def _apply(self, position: int, sign: int):
+        totals = self.daily.get(self.days[position])
+        if totals is None:
+            totals = self.daily[self.days[position]] = DayTotals()
+        total = self.totals[position] * sign
+        totals.orders += sign
+        totals.revenue += total
+        totals.hours[self.hours[position]] += total
+        for line in range(self.line_start[position], self.line_start[position + 1]):
+            qty = self.line_qty[line] * sign
+            index = self.line_item[line]
+            totals.items[index] = totals.items.get(index, 0) + qty
+            totals.units += qty
+        customer = totals.customers.setdefault(self.user_ids[position], [0, 0])
+        customer[0] += sign
+        customer[1] += total
+
+    def report(self, start: date, end: date) -> SalesReport:
+        """Cộng tổng hợp các ngày từ `start` tới `end` (tính cả hai đầu)."""
+        result = SalesReport(start, end, self.item_keys)
+        first, last = start.toordinal(), end.toordinal()
+        if last - first + 1 <= len(self.daily):
+            days = [day for day in range(first, last + 1) if day in self.daily]
+        else:
+            days = sorted(day for day in self.daily if first <= day <= last)
+        for day in days:
+            result.add_day(date.fromordinal(day), self.daily[day])
+        return result
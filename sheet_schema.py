@@ -0,0 +1,250 @@
+"""Lược đồ cột cho các sheet MENU / ORDERS.
+
+Thay vì tra từng dòng `item.get("name_vi") or item.get("Name_VI") or ...`, tên
+cột được khớp một lần cho mỗi kiểu header (không phân biệt hoa thường), rồi
+từng dòng thô của `get_all_values()` được đổi sang bản ghi có kiểu (MenuItem,
+OrderRow). Dòng sai dữ liệu bị loại ngay lúc nạp và ghi vào danh sách lỗi để
+báo cho admin.
+
+    records, problems = MENU_SCHEMA.parse(worksheet.get_all_values())
+"""
+
+import re
+
+
+class SchemaError(ValueError):
+    """Header của sheet thiếu cột bắt buộc."""
+
+
+class RowError(ValueError):
+    """Một ô không đúng định dạng; thông điệp dùng trong báo cáo cho admin."""
+
+
+def parse_text(raw) -> str:
+    return str(raw or "").strip()
+
+
+_GROUPED_NUMBER = re.compile(r"^\d{1,3}([.,\s]\d{3})+$")
+
+
+def parse_price(raw) -> int:
+    """Giá nguyên (đồng). Chấp nhận "45000", "45.000", "45,000", "45000đ"."""
+    value = str(raw or "").strip().rstrip("đ₫").strip()
+    if _GROUPED_NUMBER.match(value):
+        value = re.sub(r"[.,\s]", "", value)
+    try:
+        price = int(value)
+    except ValueError:
+        try:
+            price = float(value)
+        except ValueError:
+            raise RowError(f"giá {raw!r} không phải số") from None
+        if not price.is_integer():
+            raise RowError(f"giá {raw!r} không phải số nguyên")
+        price = int(price)
+    if price < 0:
+        raise RowError(f"giá {raw!r} âm")
+    return price
+
+
+def parse_status(raw) -> str:
+    return str(raw or "").strip().lower()
+
+
+def parse_int(raw) -> int:
+    try:
+        return int(str(raw).strip())
+    except ValueError:
+        raise RowError(f"{raw!r} không phải số nguyên") from None
+
+
+class Column:
+    """Một trường của bản ghi: các tên cột chấp nhận và hàm đổi kiểu."""
+
+    __slots__ = ("field", "aliases", "parse", "required", "default")
+
+    def __init__(self, field: str, aliases=(), parse=parse_text, required=False, default=""):
+        self.field = field
+        self.aliases = tuple(a.strip().lower() for a in (field, *aliases))
+        self.parse = parse
+        self.required = required
+        self.default = default
+
+
+class SheetSchema:
+    """Đổi các dòng thô của một sheet thành bản ghi `record_class`.
+
+    Vị trí cột được tính một lần cho mỗi header và cache lại, nên mỗi lần nạp
+    sau chỉ còn việc đổi kiểu từng ô.
+    """
+
+    def __init__(self, record_class, columns: list):
+        self.record_class = record_class
+        self.columns = columns
+        self._layouts = {}
+
+    def compile(self, header: list) -> list:
+        """[(column, chỉ số cột hoặc None), ...] cho một header cụ thể."""
+        key = tuple(header)
+        layout = self._layouts.get(key)
+        if layout is not None:
+            return layout
+
+        positions = {}
+        for index, name in enumerate(header):
+            positions.setdefault(str(name).strip().lower(), index)
+        layout = []
+        missing = []
+        for column in self.columns:
+            index = next((positions[a] for a in column.aliases if a in positions), None)
+            if index is None and column.required:
+                missing.append(column.field)
+            layout.append((column, index))
+        if missing:
+            raise SchemaError(f"thiếu cột: {', '.join(missing)}")
+        self._layouts[key] = layout
+        return layout
+
+    def position(self, header: list, field: str):
+        """Chỉ số cột (từ 0) của `field` trong `header`, hoặc None."""
+        for column, index in self.compile(header):
+            if column.field == field:
+                return index
+        return None
+
+    def parse(self, values: list):
+        """Trả về (records, problems). Dòng trống bị bỏ qua, dòng lỗi vào `problems`.
+
+        Mỗi bản ghi có thêm `row` là số dòng trên sheet (header là dòng 1).
+        """
+        if not values:
+            return [], []
+        layout = self.compile(values[0])
+        records = []
+        problems = []
+        for row_number, row in enumerate(values[1:], start=2):
+            if not any(str(cell).strip() for cell in row):
+                continue
+            fields = {"row": row_number}
+            try:
+                for column, index in layout:
+                    raw = row[index] if index is not None and index < len(row) else ""
+                    if str(raw).strip() == "":
+                        if column.required:
+                            raise RowError(f"thiếu {column.field}")
+                        fields[column.field] = column.default
+                    else:
+                        fields[column.field] = column.parse(raw)
+                records.append(self.record_class(**fields))
+            except RowError as e:
+                problems.append(f"dòng {row_number}: {e}")
+        return records, problems
+
+
+class MenuItem:
+    """Một món trong MENU."""
+
+    __slots__ = (
+        "row",
+        "id",
+        "key",
+        "name_vi",
+        "name_en",
+        "price",
+        "image_url",
+        "status",
+        "category",
+    )
+
+    def __init__(self, row, id, name_vi, name_en, price, image_url, status, category):
+        if not (name_vi or name_en):
+            raise RowError("thiếu tên món")
+        self.row = row
+        self.id = id
+        self.key = id.lower()
+        self.name_vi = name_vi
+        self.name_en = name_en
+        self.price = price
+        self.image_url = image_url
+        self.status = status
+        self.category = category
+
+    def name(self, lang: str) -> str:
+        if lang == "vi":
+            return self.name_vi or self.name_en
+        return self.name_en or self.name_vi
+
+    @property
+    def listed(self) -> bool:
+        """Có hiện trong /menu không (status trống, active hoặc sold_out)."""
+        return self.status in ("", "active", "sold_out")
+
+    @property
+    def sold_out(self) -> bool:
+        return self.status == "sold_out"
+
+    def __repr__(self):
+        return f"MenuItem({self.id!r}, {self.name_vi!r}, {self.price})"
+
+
+MENU_SCHEMA = SheetSchema(
+    MenuItem,
+    [
+        Column("id", required=True),
+        Column("name_vi", aliases=("name",)),
+        Column("name_en"),
+        Column("price", parse=parse_price, required=True),
+        Column("image_url", aliases=("image",)),
+        Column("status", parse=parse_status),
+        Column("category", aliases=("group",)),
+    ],
+)
+
+
+class OrderRow:
+    """Một dòng của sheet ORDERS, theo đúng thứ tự cột trên sheet."""
+
+    __slots__ = (
+        "row",
+        "order_id",
+        "user_id",
+        "username",
+        "phone",
+        "items_text",
+        "total",
+        "address",
+        "lang",
+        "created_at",
+        "status",
+    )
+
+    # Thứ tự cột khi ghi (append_rows)
+    FIELDS = __slots__[1:]
+
+    def __init__(self, row=None, **fields):
+        self.row = row
+        for name in self.FIELDS:
+            setattr(self, name, fields.get(name, ""))
+
+    def to_values(self) -> list:
+        return [getattr(self, name) for name in self.FIELDS]
+
+    def __repr__(self):
+        return f"OrderRow({self.order_id!r}, user={self.user_id!r}, status={self.status!r})"
+
+
+ORDER_SCHEMA = SheetSchema(
+    OrderRow,
+    [
+        Column("order_id", parse=parse_int, required=True),
+        Column("user_id", parse=parse_int, required=True),
+        Column("username"),
+        Column("phone"),
+        Column("items_text"),
+        Column("total", parse=parse_price, default=0),
+        Column("address"),
+        Column("lang"),
+        Column("created_at"),
+        Column("status", parse=parse_status),
+    ],
+)
@@ -0,0 +1,533 @@
+"""Nơi lưu trạng thái theo người dùng (giỏ hàng, user_data, bước /order) và bộ đếm.
+
+Hai bản cài đặt cùng giao diện StateBackend:
+
+    SQLiteBackend   file SQLite cục bộ (mặc định), chỉ dùng được cho một tiến trình
+    RedisBackend    máy chủ nói giao thức Redis (RESP2), dùng chung cho nhiều replica
+
+Chọn qua biến môi trường STATE_BACKEND_URL:
+
+    (trống) | sqlite                 dùng file STATE_DB_PATH
+    redis://[:password@]host:port/0  dùng Redis; STATE_KEY_PREFIX tách khóa giữa các bot
+
+Giá trị luôn là chuỗi (thường là JSON); khóa có thể có TTL. Client Redis ở đây
+chỉ dùng thư viện chuẩn (socket đồng bộ có timeout); từ event loop hãy gọi qua
+`await backend.call(fn, ...)` (đọc) hoặc `backend.call_soon(fn, ...)` (ghi không
+chờ), để Redis chậm không làm đứng mọi chat. Với SQLite hai hàm này gọi thẳng.
+
+Chạy thử không cần Redis thật: bật máy chủ thay thế trong bộ nhớ
+
+    python state_backend.py serve --port 6380
+    STATE_BACKEND_URL=redis://127.0.0.1:6380/0 python bot_v2.py
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import abc
+import argparse
+import asyncio
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+
+class StateBackend(abc.ABC):
+    """Giao diện chung. `shared` = True nếu nhiều tiến trình cùng đọc/ghi (phải
+    nạp lại trạng thái ở mỗi update thay vì tin bản trong bộ nhớ)."""
+
+    shared = False
+
+    @abc.abstractmethod
+    def get_many(self, keys: list) -> list:
+        """Giá trị của từng khóa (None nếu không có hoặc đã hết hạn), cùng thứ tự."""
+        raise NotImplementedError
+
+    def get(self, key: str):
+        return self.get_many([key])[0]
+
+    @abc.abstractmethod
+    def set_many(self, items: dict, ttl: int = None):
+        """Ghi nhiều khóa; `ttl` (giây) áp cho mọi khóa, None = không hết hạn."""
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: int = None):
+        self.set_many({key: value}, ttl)
+
+    @abc.abstractmethod
+    def delete(self, *keys):
+        """Xóa các khóa (khóa không có thì bỏ qua)."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def incr(self, name: str, amount: int = 1) -> int:
+        """Tăng bộ đếm `name` một cách nguyên tử, trả về giá trị mới."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def bump_to(self, name: str, value: int):
+        """Đảm bảo bộ đếm `name` không nhỏ hơn `value`."""
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        """Xóa khóa đã hết hạn (nếu backend không tự làm). Trả về số khóa đã xóa."""
+        return 0
+
+    async def call(self, fn, *args):
+        """Chạy `fn(*args)` (một phương thức của backend) mà không chặn event loop."""
+        return fn(*args)
+
+    def call_soon(self, fn, *args):
+        """Như call() nhưng không chờ kết quả (dùng cho lệnh ghi).
+
+        Lệnh được chạy theo đúng thứ tự gửi, trước mọi call() gửi sau nó, nên
+        lần đọc kế tiếp luôn thấy giá trị vừa ghi.
+        """
+        fn(*args)
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(StateBackend):
+    """Bảng `kv` (key, value, expires_at) và bảng `counters` trong file trạng thái.
+
+    Bảng `counters` giữ nguyên như trước, nên mã đơn tiếp tục đếm từ số cũ.
+    """
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self._lock = threading.Lock()
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            " name TEXT PRIMARY KEY,"
+            " value INTEGER NOT NULL)"
+        )
+
+    def get_many(self, keys: list) -> list:
+        if not keys:
+            return []
+        found = dict(
+            self.db.execute(
+                "SELECT key, value FROM kv WHERE key IN ({})"
+                " AND (expires_at IS NULL OR expires_at > ?)".format(",".join("?" * len(keys))),
+                (*keys, time.time()),
+            ).fetchall()
+        )
+        return [found.get(key) for key in keys]
+
+    def set_many(self, items: dict, ttl: int = None):
+        expires_at = time.time() + ttl if ttl else None
+        self.db.executemany(
+            "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+            [(key, value, expires_at) for key, value in items.items()],
+        )
+
+    def delete(self, *keys):
+        self.db.executemany("DELETE FROM kv WHERE key = ?", [(key,) for key in keys])
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.execute(
+                    "INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)", (name,)
+                )
+                self.db.execute(
+                    "UPDATE counters SET value = value + ? WHERE name = ?", (amount, name)
+                )
+                (value,) = self.db.execute(
+                    "SELECT value FROM counters WHERE name = ?", (name,)
+                ).fetchone()
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+        return value
+
+    def bump_to(self, name: str, value: int):
+        self.db.execute(
+            "INSERT OR IGNORE INTO counters (name, value) VALUES (?, ?)", (name, value)
+        )
+        self.db.execute(
+            "UPDATE counters SET value = MAX(value, ?) WHERE name = ?", (value, name)
+        )
+
+    def purge_expired(self) -> int:
+        return self.db.execute(
+            "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        ).rowcount
+
+
+class RedisError(Exception):
+    """Máy chủ trả lỗi (dòng "-ERR ...")."""
+
+
+def encode_command(args) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+def read_reply(reader):
+    """Đọc một reply RESP2 từ file nhị phân `reader`."""
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("connection closed")
+    prefix, rest = line[:1], line[1:-2]
+    if prefix == b"+":
+        return rest.decode("utf-8")
+    if prefix == b"-":
+        raise RedisError(rest.decode("utf-8"))
+    if prefix == b":":
+        return int(rest)
+    if prefix == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = reader.read(size + 2)
+        if len(data) != size + 2:
+            raise ConnectionError("connection closed")
+        return data[:-2].decode("utf-8")
+    if prefix == b"*":
+        size = int(rest)
+        if size < 0:
+            return None
+        return [read_reply(reader) for _ in range(size)]
+    raise ConnectionError(f"bad reply {line!r}")
+
+
+class RedisBackend(StateBackend):
+    """Client RESP2 tối giản (GET/MGET/SET EX/DEL/INCRBY) trên một socket.
+
+    Mất kết nối thì nối lại và gửi lại một lần; với INCRBY điều này có thể làm
+    bộ đếm nhảy qua một số (mã đơn bị hở), nhưng không bao giờ cấp trùng.
+
+    call() / call_soon() chạy lệnh trên một luồng riêng (một socket nên một luồng
+    là đủ), nên thứ tự các lệnh giữ nguyên như lúc gửi.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "", timeout: float = 2.0):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = urllib.parse.unquote(parsed.password or "")
+        self.database = int(parsed.path.strip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+
+    async def call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def call_soon(self, fn, *args):
+        def done(future):
+            if future.exception() is not None:
+                print(f"[STATE_WRITE_ERROR] {fn.__name__}: {future.exception()!r}")
+
+        self._executor.submit(fn, *args).add_done_callback(done)
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.database:
+            setup.append(("SELECT", self.database))
+        if setup:
+            self._send(setup)
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    def _send(self, commands: list) -> list:
+        self._sock.sendall(b"".join(encode_command(args) for args in commands))
+        replies = []
+        error = None
+        for _ in commands:
+            try:
+                replies.append(read_reply(self._reader))
+            except RedisError as e:
+                # Đọc hết reply còn lại để kết nối không lệch pha
+                error = error or e
+                replies.append(None)
+        if error is not None:
+            raise error
+        return replies
+
+    def _roundtrip(self, commands: list, retry: bool = True) -> list:
+        """Như pipeline() nhưng người gọi đã giữ self._lock."""
+        for attempt in (1, 2):
+            try:
+                if self._sock is None:
+                    self._connect()
+                return self._send(commands)
+            except (OSError, ConnectionError):
+                self._disconnect()
+                if attempt == 2 or not retry:
+                    raise
+
+    def pipeline(self, commands: list) -> list:
+        """Gửi nhiều lệnh trong một vòng mạng, trả về danh sách reply."""
+        with self._lock:
+            return self._roundtrip(commands)
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def get_many(self, keys: list) -> list:
+        if not keys:
+            return []
+        return self.execute("MGET", *(self.prefix + key for key in keys))
+
+    def set_many(self, items: dict, ttl: int = None):
+        if not items:
+            return
+        expiry = ("EX", int(ttl)) if ttl else ()
+        self.pipeline(
+            [("SET", self.prefix + key, value, *expiry) for key, value in items.items()]
+        )
+
+    def delete(self, *keys):
+        if keys:
+            self.execute("DEL", *(self.prefix + key for key in keys))
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        return self.execute("INCRBY", f"{self.prefix}counter:{name}", amount)
+
+    def bump_to(self, name: str, value: int):
+        # WATCH/MULTI/EXEC: nếu replica khác đổi bộ đếm giữa lúc đọc và ghi, EXEC
+        # trả nil và ta đọc lại, nên bộ đếm không bao giờ bị ghi lùi
+        key = f"{self.prefix}counter:{name}"
+        while True:
+            with self._lock:
+                _, current = self._roundtrip([("WATCH", key), ("GET", key)])
+                if current is not None and int(current) >= value:
+                    self._roundtrip([("UNWATCH",)])
+                    return
+                # Không gửi lại khi mất kết nối: kết nối mới không còn WATCH
+                *_, applied = self._roundtrip(
+                    [("MULTI",), ("SET", key, value), ("EXEC",)], retry=False
+                )
+            if applied is not None:
+                return
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._disconnect()
+
+
+def open_backend(url: str, db: sqlite3.Connection, prefix: str = "") -> StateBackend:
+    """Backend theo STATE_BACKEND_URL: trống/"sqlite" → SQLite trên `db`, redis:// → Redis."""
+    url = (url or "").strip()
+    if url in ("", "sqlite"):
+        return SQLiteBackend(db)
+    if url.startswith("redis://"):
+        return RedisBackend(url, prefix)
+    raise ValueError(f"unsupported STATE_BACKEND_URL {url!r}")
+
+
+# ================== MÁY CHỦ THAY THẾ (TEST LOCAL) ==================
+
+NOT_HANDLED = object()
+
+
+class StandInServer:
+    """Máy chủ RESP trong bộ nhớ, đủ các lệnh RedisBackend dùng, để chạy thử
+    nhiều replica trên máy dev. Không lưu xuống đĩa."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6380):
+        self.host = host
+        self.port = port
+        self.data = {}
+        # Số lần ghi mỗi khóa, để EXEC biết khóa đã WATCH có bị đổi không
+        self.versions = {}
+        self._server = None
+
+    def _touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            self._touch(key)
+            return None
+        return entry
+
+    def transaction(self, args: list, session: dict):
+        """WATCH/UNWATCH/MULTI/EXEC/DISCARD theo từng kết nối.
+
+        Trả về NOT_HANDLED nếu `args` là lệnh thường cần chạy ngay.
+        """
+        name = args[0].upper()
+        if name == "WATCH":
+            for key in args[1:]:
+                self._live(key)
+                session["watch"][key] = self.versions.get(key, 0)
+            return "+OK"
+        if name == "UNWATCH":
+            session["watch"] = {}
+            return "+OK"
+        if name == "MULTI":
+            session["queue"] = []
+            return "+OK"
+        if name in ("EXEC", "DISCARD"):
+            queued, session["queue"] = session["queue"], None
+            watched, session["watch"] = session["watch"], {}
+            if queued is None:
+                return RedisError(f"ERR {name} without MULTI")
+            if name == "DISCARD":
+                return "+OK"
+            for key, version in watched.items():
+                self._live(key)
+                if self.versions.get(key, 0) != version:
+                    return None
+            return [self.command(queued_args) for queued_args in queued]
+        if session["queue"] is not None:
+            session["queue"].append(args)
+            return "+QUEUED"
+        return NOT_HANDLED
+
+    def command(self, args: list):
+        name = args[0].upper()
+        if name in ("PING", "AUTH", "SELECT"):
+            return "+PONG" if name == "PING" else "+OK"
+        if name == "GET":
+            entry = self._live(args[1])
+            return entry[0] if entry else None
+        if name == "MGET":
+            return [(self._live(key) or (None,))[0] for key in args[1:]]
+        if name == "SET":
+            expires_at = None
+            if len(args) >= 4 and args[3].upper() == "EX":
+                expires_at = time.time() + int(args[4])
+            self.data[args[1]] = (args[2], expires_at)
+            self._touch(args[1])
+            return "+OK"
+        if name == "DEL":
+            for key in args[1:]:
+                self._touch(key)
+            return sum(self.data.pop(key, None) is not None for key in args[1:])
+        if name in ("INCR", "INCRBY"):
+            entry = self._live(args[1])
+            try:
+                value = int(entry[0] if entry else 0) + int(args[2] if name == "INCRBY" else 1)
+            except ValueError:
+                return RedisError("ERR value is not an integer or out of range")
+            self.data[args[1]] = (str(value), entry[1] if entry else None)
+            self._touch(args[1])
+            return value
+        if name == "FLUSHDB":
+            for key in self.data:
+                self._touch(key)
+            self.data.clear()
+            return "+OK"
+        if name == "DBSIZE":
+            return len(self.data)
+        return RedisError(f"ERR unknown command '{args[0]}'")
+
+    @staticmethod
+    def _encode_reply(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, RedisError):
+            return b"-%s\r\n" % str(value).encode("utf-8")
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(
+                StandInServer._encode_reply(item) for item in value
+            )
+        if value.startswith("+"):
+            return value.encode("utf-8") + b"\r\n"
+        data = value.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.decode("utf-8").split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            size = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(size + 2))[:-2].decode("utf-8"))
+        return args
+
+    async def _handle(self, reader, writer):
+        session = {"watch": {}, "queue": None}
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if args:
+                    reply = self.transaction(args, session)
+                    if reply is NOT_HANDLED:
+                        reply = self.command(args)
+                    writer.write(self._encode_reply(reply))
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+async def _serve(host: str, port: int):
+    server = StandInServer(host, port)
+    await server.start()
+    print(f"[STATE] RESP stand-in listening on {host}:{port}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="chạy máy chủ RESP thay thế trong bộ nhớ")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Chạy nhiều cửa hàng (mỗi cửa hàng một bot + một file Google Sheet) trong một tiến trình.
+
+Cấu hình trong file JSON (TENANTS_FILE, mặc định tenants.json):
+
+    [
+      {
+        "name": "shop_a",
+        "bot_token": "123:ABC",
+        "sheet_name": "Shop_A_Delivery",
+        "admin_chat_id": -1001234567890,
+        "admin_user_ids": [111, 222],
+        "webhook_secret": "...",            (mặc định WEBHOOK_SECRET; webhook bắt buộc có một trong hai)
+        "env": {"MENU_REFRESH_SECONDS": "30"}  (tùy chọn, ghi đè cấu hình khác)
+      },
+      ...
+    ]
+
+Mỗi tenant là một bản nạp riêng của bot_v2.py, nên cache MENU/SETTINGS, giỏ
+hàng, bộ đếm đơn, hàng đợi thông báo và file SQLite (bot_state_<name>.db) đều
+riêng (nếu dùng chung một Redis qua STATE_BACKEND_URL thì khóa có tiền tố
+"<name>:"). Dùng chung giữa các tenant: một gspread client (xác thực một lần)
+cùng ngân sách quota Sheets của nó, một pool kết nối HTTP tới Telegram và một
+HTTP server.
+
+BOT_MODE / PORT / WEBHOOK_* như webhook.py; ở chế độ webhook mỗi tenant nhận
+update tại WEBHOOK_PATH/<name>. Endpoint phụ: /healthz, /readyz, /metrics
+(mọi metric có nhãn tenant="<name>").
+
+    python tenants.py
+"""
+
+from telegram.ext import ApplicationBuilder
+from telegram.request import BaseRequest, HTTPXRequest
+
+from http import HTTPStatus
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import threading
+
+import metrics
+from webhook import WebhookConfig, serve_all
+
+BOT_V2_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_v2.py")
+
+
+class SharedRequest(BaseRequest):
+    """Một pool kết nối HTTP tới Telegram dùng chung cho nhiều Bot.
+
+    Mỗi Bot gọi initialize()/shutdown() riêng; pool chỉ thật sự đóng khi Bot
+    cuối cùng shutdown.
+    """
+
+    def __init__(self, inner: BaseRequest):
+        self._inner = inner
+        self._users = 0
+
+    async def initialize(self):
+        self._users += 1
+        if self._users == 1:
+            await self._inner.initialize()
+
+    async def shutdown(self):
+        self._users -= 1
+        if self._users == 0:
+            await self._inner.shutdown()
+
+    async def do_request(self, *args, **kwargs):
+        return await self._inner.do_request(*args, **kwargs)
+
+
+class SharedGoogleClient:
+    """gspread client xác thực một lần, dùng cho mọi tenant."""
+
+    def __init__(self, authorize):
+        self._authorize = authorize
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._authorize()
+            return self._client
+
+
+def load_tenants(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        tenants = json.load(f)
+    names = set()
+    for tenant in tenants:
+        for key in ("name", "bot_token", "sheet_name"):
+            if not tenant.get(key):
+                raise ValueError(f"tenant {tenant.get('name')!r}: missing {key}")
+        if not tenant["name"].isidentifier():
+            raise ValueError(f"tenant name {tenant['name']!r} must be a valid identifier")
+        if tenant["name"] in names:
+            raise ValueError(f"duplicate tenant name {tenant['name']!r}")
+        names.add(tenant["name"])
+    return tenants
+
+
+def load_bot_module(tenant: dict):
+    """Nạp một bản bot_v2 riêng cho tenant; trả về (module, metrics registry).
+
+    bot_v2 đọc cấu hình từ biến môi trường lúc import, nên biến môi trường được
+    đặt tạm theo tenant trong lúc nạp rồi trả lại như cũ.
+    """
+    name = tenant["name"]
+    env = {
+        "BOT_TOKEN": tenant["bot_token"],
+        "SHEET_NAME": tenant["sheet_name"],
+        "ADMIN_CHAT_ID": str(tenant.get("admin_chat_id") or ""),
+        "ADMIN_USER_IDS": ",".join(str(uid) for uid in tenant.get("admin_user_ids", [])),
+        "STATE_DB_PATH": tenant.get("state_db_path") or f"bot_state_{name}.db",
+        # Khi STATE_BACKEND_URL là Redis dùng chung, khóa của mỗi tenant có tiền tố riêng
+        "STATE_KEY_PREFIX": f"{name}:",
+    }
+    env.update({key: str(value) for key, value in tenant.get("env", {}).items()})
+
+    saved_env = {key: os.environ.get(key) for key in env}
+    saved_registry = metrics.REGISTRY
+    registry = metrics.REGISTRY = metrics.Registry({"tenant": name})
+    os.environ.update(env)
+    try:
+        spec = importlib.util.spec_from_file_location(f"bot_v2__{name}", BOT_V2_PATH)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    finally:
+        metrics.REGISTRY = saved_registry
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return module, registry
+
+
+def build_tenants(tenants: list, request: BaseRequest = None):
+    """Trả về [(tenant, module, app, registry), ...] với auth và pool HTTP dùng chung.
+
+    `request` thay tầng HTTP tới Telegram (VD: request giả khi đo hiệu năng).
+    """
+    request = SharedRequest(
+        request or HTTPXRequest(connection_pool_size=max(8, 4 * len(tenants)))
+    )
+    google = None
+    built = []
+    for tenant in tenants:
+        module, registry = load_bot_module(tenant)
+        if google is None:
+            google = SharedGoogleClient(module.google_client)
+            # Quota Sheets tính theo service account, nên mọi tenant chung một ngân sách
+            governor = module.sheets.governor
+        module.sheets._open_spreadsheet = (
+            lambda module=module: module.open_spreadsheet(google.get())
+        )
+        module.sheets.governor = governor
+        app = module.build_app(ApplicationBuilder().token(tenant["bot_token"]).request(request))
+        built.append((tenant, module, app, registry))
+    return built
+
+
+def tenant_routes(built: list) -> list:
+    async def healthz(headers, body):
+        return HTTPStatus.OK, "text/plain", b"ok"
+
+    async def readyz(headers, body):
+        reports = {tenant["name"]: module.readiness.report() for tenant, module, _, _ in built}
+        ready = all(report["ready"] for report in reports.values())
+        status = HTTPStatus.OK if ready else HTTPStatus.SERVICE_UNAVAILABLE
+        return status, "application/json", json.dumps(reports).encode("utf-8")
+
+    async def metrics_endpoint(headers, body):
+        registries = [metrics.REGISTRY] + [registry for *_, registry in built]
+        return (
+            HTTPStatus.OK,
+            "text/plain; version=0.0.4",
+            metrics.render_all(registries).encode("utf-8"),
+        )
+
+    return [
+        ("GET", "/healthz", healthz),
+        ("GET", "/readyz", readyz),
+        ("GET", "/metrics", metrics_endpoint),
+    ]
+
+
+def main():
+    tenants = load_tenants(os.environ.get("TENANTS_FILE", "tenants.json"))
+    built = build_tenants(tenants)
+    print(f"[TENANTS] {', '.join(tenant['name'] for tenant in tenants)}")
+
+    mode = os.environ.get("BOT_MODE", "polling").strip().lower()
+    config = WebhookConfig.from_env()
+    apps = [
+        (
+            app,
+            f"{config.path.rstrip('/')}/{tenant['name']}",
+            tenant.get("webhook_secret") or config.secret,
+        )
+        for tenant, _, app, _ in built
+    ]
+    asyncio.run(
+        serve_all(
+            apps,
+            mode,
+            config,
+            drop_pending_updates=False,
+            routes=tenant_routes(built),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
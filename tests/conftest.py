@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# bot_v2 đọc cấu hình và mở file trạng thái ngay khi import
+_STATE_DIR = tempfile.mkdtemp(prefix="bot_v2_tests_")
+os.environ.setdefault("BOT_TOKEN", "123:test")
+os.environ.setdefault("STATE_DB_PATH", os.path.join(_STATE_DIR, "state.db"))
+os.environ.pop("STATE_BACKEND_URL", None)
+os.environ.pop("SHARD_URLS", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,39 @@
+import time
+
+from bot_v2 import CircuitBreaker
+
+
+def test_open_half_open_close():
+    breaker = CircuitBreaker(threshold=2, reset_seconds=0.05)
+    changes = []
+    breaker.on_change(changes.append)
+
+    assert breaker.allow()
+    breaker.record_failure(TimeoutError())
+    assert not breaker.open
+    breaker.record_failure(TimeoutError())
+    assert breaker.open and changes == [True]
+    assert not breaker.allow()
+
+    # Hết reset_seconds: đúng một lệnh thử được đi qua
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # Lệnh thử lỗi: mở tiếp, đếm lại reset_seconds
+    breaker.record_failure(TimeoutError())
+    assert breaker.open and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.open and breaker.allow()
+    assert changes == [True, False]
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(threshold=2, reset_seconds=10)
+    breaker.record_failure(TimeoutError())
+    breaker.record_success()
+    breaker.record_failure(TimeoutError())
+    assert not breaker.open
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from bot_v2 import QuotaGovernor
+
+
+def test_burst_then_refill():
+    async def main():
+        governor = QuotaGovernor(per_minute=600, burst=2)  # 10 lượt/giây
+        started = time.monotonic()
+        await governor.acquire(QuotaGovernor.READ)
+        await governor.acquire(QuotaGovernor.READ)
+        assert time.monotonic() - started < 0.05
+        await governor.acquire(QuotaGovernor.READ)
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.08
+
+
+def test_writes_granted_before_reads():
+    async def main():
+        governor = QuotaGovernor(per_minute=600, burst=1)
+        await governor.acquire(QuotaGovernor.READ)
+        order = []
+
+        async def take(priority, label):
+            await governor.acquire(priority)
+            order.append(label)
+
+        read = asyncio.create_task(take(QuotaGovernor.READ, "read"))
+        await asyncio.sleep(0)
+        write = asyncio.create_task(take(QuotaGovernor.WRITE, "write"))
+        await asyncio.gather(read, write)
+        return order
+
+    assert asyncio.run(main()) == ["write", "read"]
+
+
+def test_cancelled_waiter_does_not_block_fast_path():
+    async def main():
+        governor = QuotaGovernor(per_minute=1, burst=1)
+        governor.tokens = 0
+        waiter = asyncio.create_task(governor.acquire(QuotaGovernor.READ))
+        # Để _dispatch chạy tới chỗ ngủ chờ lượt, với người chờ vẫn trong hàng
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        # Có lượt trở lại: người đến sau không phải xếp sau người đã bỏ
+        governor.tokens = 1
+        await asyncio.wait_for(governor.acquire(QuotaGovernor.READ), 0.1)
+        return governor.tokens
+
+    assert asyncio.run(main()) < 1
+
+
+def test_token_refunded_when_cancelled_after_grant():
+    async def main():
+        governor = QuotaGovernor(per_minute=1, burst=1)
+        governor.tokens = 0
+        waiter = asyncio.create_task(governor.acquire(QuotaGovernor.READ))
+        await asyncio.sleep(0)
+        # Như _dispatch cấp lượt, rồi người chờ bị hủy trước khi kịp chạy tiếp
+        _, _, future = governor._waiters[0]
+        future.set_result(None)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert waiter.cancelled()
+        return governor.tokens
+
+    assert asyncio.run(main()) >= 1
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+
+from bot_v2 import CircuitBreaker, QuotaGovernor, SheetsGateway
+
+
+class SlowWorksheet:
+    def __init__(self):
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def get_all_values(self):
+        with self._lock:
+            self.reads += 1
+        time.sleep(0.1)
+        return [["id", "name"], ["F01", "Phở"]]
+
+    def get_values(self, range_name):
+        with self._lock:
+            self.reads += 1
+        time.sleep(0.1)
+        return [[range_name]]
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.sheet = SlowWorksheet()
+
+    def worksheet(self, name):
+        return self.sheet
+
+
+def make_gateway():
+    spreadsheet = FakeSpreadsheet()
+    gateway = SheetsGateway(
+        lambda: spreadsheet,
+        max_workers=4,
+        timeout=5,
+        governor=QuotaGovernor(per_minute=0, burst=1),
+        breaker=CircuitBreaker(threshold=3, reset_seconds=30),
+    )
+    return gateway, spreadsheet.sheet
+
+
+def test_identical_reads_share_one_request():
+    async def main():
+        gateway, sheet = make_gateway()
+        try:
+            results = await asyncio.gather(
+                *(gateway.call("MENU", "get_all_values") for _ in range(5))
+            )
+        finally:
+            gateway.shutdown()
+        return results, sheet.reads
+
+    results, reads = asyncio.run(main())
+    assert reads == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_different_reads_are_not_coalesced():
+    async def main():
+        gateway, sheet = make_gateway()
+        try:
+            results = await asyncio.gather(
+                gateway.call("ORDERS", "get_values", "A2:A"),
+                gateway.call("ORDERS", "get_values", "J2:J"),
+            )
+        finally:
+            gateway.shutdown()
+        return results, sheet.reads
+
+    results, reads = asyncio.run(main())
+    assert reads == 2
+    assert results == [[["A2:A"]], [["J2:J"]]]
+
+
+def test_cancelled_follower_keeps_leader_running():
+    async def main():
+        gateway, sheet = make_gateway()
+        try:
+            leader = asyncio.create_task(gateway.call("MENU", "get_all_values"))
+            await asyncio.sleep(0.01)
+            follower = asyncio.create_task(gateway.call("MENU", "get_all_values"))
+            await asyncio.sleep(0.01)
+            follower.cancel()
+            result = await leader
+        finally:
+            gateway.shutdown()
+        return result, sheet.reads
+
+    result, reads = asyncio.run(main())
+    assert reads == 1
+    assert result[1] == ["F01", "Phở"]
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from state_backend import RedisBackend, StandInServer, StateBackend
+
+
+async def with_server(scenario):
+    server = StandInServer(port=0)
+    await server.start()
+    port = server._server.sockets[0].getsockname()[1]
+    backend = RedisBackend(f"redis://127.0.0.1:{port}/0", prefix="t:")
+    try:
+        return await scenario(backend, server)
+    finally:
+        backend.close()
+        await server.stop()
+
+
+def test_get_set_delete_round_trip():
+    async def scenario(backend, server):
+        await backend.call(backend.set_many, {"cart:1": '{"f01": 2}', "cart:2": "x"})
+        both = await backend.call(backend.get_many, ["cart:1", "cart:2", "cart:3"])
+        await backend.call(backend.delete, "cart:2")
+        after = await backend.call(backend.get_many, ["cart:1", "cart:2"])
+        return both, after, sorted(server.data)
+
+    both, after, keys = asyncio.run(with_server(scenario))
+    assert both == ['{"f01": 2}', "x", None]
+    assert after == ['{"f01": 2}', None]
+    assert keys == ["t:cart:1"]
+
+
+def test_ttl_expires_keys():
+    async def scenario(backend, server):
+        await backend.call(backend.set, "k", "v", 1)
+        first = await backend.call(backend.get, "k")
+        await asyncio.sleep(1.1)
+        return first, await backend.call(backend.get, "k")
+
+    assert asyncio.run(with_server(scenario)) == ("v", None)
+
+
+def test_counter_incr_and_bump_to():
+    async def scenario(backend, server):
+        first = await backend.call(backend.incr, "order_id")
+        await backend.call(backend.bump_to, "order_id", 10000)
+        await backend.call(backend.bump_to, "order_id", 5)
+        return first, await backend.call(backend.incr, "order_id")
+
+    assert asyncio.run(with_server(scenario)) == (1, 10001)
+
+
+def test_call_soon_is_ordered_before_later_reads():
+    async def scenario(backend, server):
+        for value in ("a", "b", "c"):
+            backend.call_soon(backend.set, "k", value)
+        return await backend.call(backend.get, "k")
+
+    assert asyncio.run(with_server(scenario)) == "c"
+
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
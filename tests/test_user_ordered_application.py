@@ -0,0 +1,54 @@
+import asyncio
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import ApplicationBuilder, TypeHandler
+
+from bench import FAKE_TOKEN, FakeTelegramRequest
+from bot_v2 import UserOrderedApplication
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    user = User(user_id, f"u{user_id}", False)
+    message = Message(update_id, None, Chat(user_id, "private"), from_user=user, text="x")
+    return Update(update_id, message=message)
+
+
+def test_same_user_in_order_other_users_in_parallel():
+    async def main():
+        request = FakeTelegramRequest(latency=0)
+        app = (
+            ApplicationBuilder()
+            .token(FAKE_TOKEN)
+            .request(request)
+            .get_updates_request(request)
+            .application_class(UserOrderedApplication)
+            .concurrent_updates(4)
+            .build()
+        )
+        await app.initialize()
+        events = []
+
+        async def handler(update, context):
+            user_id = update.effective_user.id
+            events.append(("start", update.update_id))
+            # Update đầu của user 1 chậm nhất: update sau của user 1 vẫn phải chờ nó
+            await asyncio.sleep(0.1 if update.update_id == 1 else 0.01)
+            events.append(("end", update.update_id, user_id))
+
+        app.add_handler(TypeHandler(Update, handler))
+        try:
+            await asyncio.gather(
+                app.process_update(make_update(1, 1)),
+                app.process_update(make_update(2, 1)),
+                app.process_update(make_update(3, 2)),
+            )
+        finally:
+            await app.shutdown()
+        return events, app._user_locks
+
+    events, locks = asyncio.run(main())
+    ends = [event[1] for event in events if event[0] == "end"]
+    # User 2 không phải chờ user 1; user 1 giữ đúng thứ tự 1 rồi 2
+    assert ends == [3, 1, 2]
+    assert events.index(("start", 2)) > events.index(("end", 1, 1))
+    assert locks == {}
@@ -0,0 +1,332 @@
+"""Trace từng update: cây span (handler → lệnh Sheets / Telegram bên trong) kèm thời gian.
+
+Bật bằng biến môi trường (mặc định tắt, không tốn gì):
+
+    TRACE_SAMPLE_RATE=0.05   ghi trace cho 5% update (chọn ngẫu nhiên)
+    TRACE_SLOW_MS=3000       luôn ghi update chậm hơn 3 giây, dù không được chọn mẫu
+    TRACE_PROFILE_RATE=0.1   10% update được chọn mẫu chạy kèm cProfile
+    TRACE_DIR=traces         thư mục ghi file JSONL (traces-<ngày>-<pid>.jsonl)
+
+Mỗi dòng JSONL là một update:
+
+    {"trace_id": ..., "ts": ..., "name": "/order", "duration_ms": ..., "attrs": {...},
+     "spans": [{"name": "order_confirm_button", "kind": "handler", "start_ms": ...,
+                "duration_ms": ..., "attrs": {...}, "children": [...]}],
+     "profile": [{"func": "bot_v2.py:123(get_cart)", "calls": ..., "cum_ms": ...}]}
+
+Xem nhanh update chậm nhất và span tốn thời gian nhất:
+
+    python tracing.py summary traces/ --top 10 --trees 3
+
+cProfile đo cả luồng event loop trong lúc update chạy, nên có thể lẫn công việc
+của update khác đang xen kẽ; mỗi lúc chỉ profile một update.
+"""
+
+from contextlib import contextmanager
+import argparse
+import contextvars
+import cProfile
+import glob
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+
+# Số hàm giữ lại trong phần "profile" của một trace
+PROFILE_TOP = 25
+
+_current = contextvars.ContextVar("tracing_span", default=None)
+# Mỗi lúc chỉ một cProfile được chạy trong tiến trình (kể cả nhiều Tracer)
+_profile_lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("name", "kind", "attrs", "start", "end", "children", "root")
+
+    def __init__(self, name: str, kind: str, attrs: dict, root=None):
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+        self.root = root or self
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def to_dict(self, origin: float) -> dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            "attrs": self.attrs,
+            "children": [child.to_dict(origin) for child in self.children],
+        }
+
+
+class Tracer:
+    """Ghi trace theo mẫu. Khi không có trace nào đang chạy, span() gần như miễn phí."""
+
+    def __init__(
+        self,
+        directory: str = "traces",
+        sample_rate: float = 0.0,
+        profile_rate: float = 0.0,
+        slow_ms: int = 0,
+    ):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.profile_rate = profile_rate
+        self.slow_ms = slow_ms
+        self.written = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """Span gốc của một update; trace được ghi nếu được chọn mẫu hoặc chậm hơn slow_ms."""
+        current = _current.get()
+        if not self.enabled or (current is not None and current.root.end is None):
+            yield None
+            return
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_ms <= 0:
+            yield None
+            return
+
+        root = Span(name, "update", attrs)
+        token = _current.set(root)
+        profiler = None
+        if sampled and random.random() < self.profile_rate and _profile_lock.acquire(False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            yield root
+        except BaseException as e:
+            root.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _profile_lock.release()
+            root.end = time.perf_counter()
+            _current.reset(token)
+            if sampled or root.duration * 1000 >= self.slow_ms:
+                try:
+                    self._write(root, profiler)
+                except OSError as e:
+                    print(f"[TRACE_WRITE_ERROR] {e}")
+
+    @contextmanager
+    def span(self, name: str, kind: str = "", **attrs):
+        """Span con dưới span hiện tại; không có trace đang chạy thì không làm gì.
+
+        Span cha hoặc trace đã kết thúc (task nền lỡ thừa hưởng context) cũng bị
+        bỏ qua, để trace đã ghi không phình thêm.
+        """
+        parent = _current.get()
+        if parent is None or parent.end is not None or parent.root.end is not None:
+            yield None
+            return
+        span = Span(name, kind, attrs, parent.root)
+        parent.children.append(span)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _current.reset(token)
+
+    def _write(self, root: Span, profiler):
+        record = {
+            "trace_id": uuid.uuid4().hex[:16],
+            "ts": round(time.time() - root.duration, 3),
+            "name": root.name,
+            "duration_ms": round(root.duration * 1000, 3),
+            "attrs": root.attrs,
+            "spans": [child.to_dict(root.start) for child in root.children],
+        }
+        if profiler is not None:
+            record["profile"] = profile_top(profiler)
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(
+            self.directory, f"traces-{time.strftime('%Y%m%d')}-{os.getpid()}.jsonl"
+        )
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.written += 1
+
+
+async def untraced(coro):
+    """Chạy `coro` ngoài mọi trace; dùng cho task nền tạo từ trong một update:
+
+        asyncio.create_task(untraced(send_loop()))
+
+    create_task chép context của update, nên không có bước này task nền sẽ tiếp
+    tục gắn span vào trace của update đã tạo ra nó.
+    """
+    _current.set(None)
+    return await coro
+
+
+def profile_top(profiler: cProfile.Profile, limit: int = PROFILE_TOP) -> list:
+    """Các hàm tốn thời gian nhất (theo cumtime) của một lần profile."""
+    stats = pstats.Stats(profiler).stats
+    ranked = sorted(stats.items(), key=lambda kv: -kv[1][3])[:limit]
+    return [
+        {
+            "func": f"{os.path.basename(filename)}:{line}({func})",
+            "calls": calls,
+            "tot_ms": round(tottime * 1000, 3),
+            "cum_ms": round(cumtime * 1000, 3),
+        }
+        for (filename, line, func), (_, calls, tottime, cumtime, _) in ranked
+    ]
+
+
+# ================== TÓM TẮT (CLI) ==================
+
+
+def read_traces(paths: list) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl"))))
+        else:
+            files.append(path)
+    traces = []
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        traces.append(json.loads(line))
+                    except ValueError:
+                        pass
+    return traces
+
+
+def walk_spans(spans: list):
+    for span in spans:
+        yield span
+        yield from walk_spans(span["children"])
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def hot_spans(traces: list) -> list:
+    """[(kind, name, count, total_ms, self_ms, p50, p95, max)] tốn nhiều thời gian nhất trước."""
+    groups = {}
+    for trace in traces:
+        for span in walk_spans(trace["spans"]):
+            own = span["duration_ms"] - sum(c["duration_ms"] for c in span["children"])
+            entry = groups.setdefault((span["kind"], span["name"]), [[], 0.0])
+            entry[0].append(span["duration_ms"])
+            entry[1] += max(own, 0.0)
+    rows = []
+    for (kind, name), (durations, self_ms) in groups.items():
+        durations.sort()
+        rows.append(
+            (
+                kind,
+                name,
+                len(durations),
+                sum(durations),
+                self_ms,
+                percentile(durations, 50),
+                percentile(durations, 95),
+                durations[-1],
+            )
+        )
+    rows.sort(key=lambda row: -row[3])
+    return rows
+
+
+def format_tree(spans: list, depth: int = 1) -> list:
+    lines = []
+    for span in spans:
+        attrs = " ".join(f"{k}={v}" for k, v in span["attrs"].items())
+        lines.append(
+            f"{'  ' * depth}+{span['start_ms']:.0f}ms {span['duration_ms']:9.1f}ms "
+            f"[{span['kind']}] {span['name']} {attrs}".rstrip()
+        )
+        lines.extend(format_tree(span["children"], depth + 1))
+    return lines
+
+
+def summarize(traces: list, top: int = 10, trees: int = 3) -> str:
+    if not traces:
+        return "Không có trace nào."
+    slowest = sorted(traces, key=lambda trace: -trace["duration_ms"])
+    durations = sorted(trace["duration_ms"] for trace in traces)
+    lines = [
+        f"{len(traces)} trace | p50 {percentile(durations, 50):.1f}ms"
+        f" | p95 {percentile(durations, 95):.1f}ms | max {durations[-1]:.1f}ms",
+        "",
+        f"Update chậm nhất (top {top}):",
+    ]
+    for trace in slowest[:top]:
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(trace["ts"]))
+        attrs = " ".join(f"{k}={v}" for k, v in trace["attrs"].items())
+        lines.append(
+            f"  {trace['duration_ms']:9.1f}ms  {trace['name']:<24} {when}  {attrs}  ({trace['trace_id']})"
+        )
+
+    lines += [
+        "",
+        "Span tốn thời gian nhất:",
+        f"  {'kind':<9} {'name':<32} {'count':>6} {'total_ms':>10} {'self_ms':>10}"
+        f" {'p50':>8} {'p95':>8} {'max':>8}",
+    ]
+    for kind, name, count, total, self_ms, p50, p95, peak in hot_spans(traces)[:top]:
+        lines.append(
+            f"  {kind:<9} {name[:32]:<32} {count:>6} {total:>10.1f} {self_ms:>10.1f}"
+            f" {p50:>8.1f} {p95:>8.1f} {peak:>8.1f}"
+        )
+
+    for trace in slowest[:trees]:
+        lines += ["", f"Cây span của {trace['name']} ({trace['trace_id']}, {trace['duration_ms']:.1f}ms):"]
+        lines += format_tree(trace["spans"])
+        for entry in trace.get("profile", [])[:10]:
+            lines.append(
+                f"    profile {entry['cum_ms']:9.1f}ms cum {entry['tot_ms']:9.1f}ms tot"
+                f" {entry['calls']:>6}x {entry['func']}"
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tóm tắt file trace JSONL của bot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="update chậm nhất và span tốn thời gian nhất")
+    summary.add_argument("paths", nargs="*", default=["traces"], help="file .jsonl hoặc thư mục")
+    summary.add_argument("--top", type=int, default=10)
+    summary.add_argument("--trees", type=int, default=3, help="in cây span của N update chậm nhất")
+    summary.add_argument("--name", help="chỉ xét update có tên này (VD: /order)")
+    args = parser.parse_args(argv)
+
+    traces = read_traces(args.paths)
+    if args.name:
+        traces = [trace for trace in traces if trace["name"] == args.name]
+    print(summarize(traces, args.top, args.trees))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""Chạy bot ở chế độ polling hoặc webhook, dùng chung cho bot.py và bot_v2.py.
+
+Cấu hình qua biến môi trường:
+
+    BOT_MODE=polling | webhook     (mặc định polling)
+    WEBHOOK_LISTEN=0.0.0.0         địa chỉ lắng nghe
+    PORT=8080                      cổng (Railway tự cấp biến PORT)
+    WEBHOOK_PATH=/telegram         đường dẫn nhận update
+    WEBHOOK_SECRET=...             (bắt buộc ở chế độ webhook) so khớp header
+                                   X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_URL=https://<domain>   URL công khai; để trống thì không gọi setWebhook
+    HEALTH_PORT=8081               (polling) cổng cho các endpoint phụ như /healthz
+    SHARD_URLS=http://a:8080,...   (webhook) chia update giữa nhiều replica theo user_id
+    SHARD_INDEX=0                  replica này là phần tử thứ mấy trong SHARD_URLS
+
+Update đang chờ (VD: đơn khách gửi trong lúc bot khởi động lại) được giữ lại ở
+cả hai chế độ, trừ khi gọi với drop_pending_updates=True (chỉ áp cho polling).
+Test local: để trống WEBHOOK_URL rồi POST JSON của một Update vào endpoint:
+
+    curl -X POST http://127.0.0.1:8080/telegram \\
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+         -H "Content-Type: application/json" -d @update.json
+"""
+
+from telegram import Update
+
+from http import HTTPStatus
+import asyncio
+import hmac
+import json
+import os
+import signal
+import urllib.parse
+
+# Giới hạn kích thước body một request (byte)
+MAX_BODY_BYTES = 1024 * 1024
+# Thời gian tối đa đọc xong một request (giây)
+READ_TIMEOUT_SECONDS = 10
+
+
+class WebhookConfig:
+    """Cấu hình webhook đọc từ biến môi trường."""
+
+    def __init__(
+        self, listen: str, port: int, path: str, secret: str, url: str, health_port: int = 0
+    ):
+        self.listen = listen
+        self.port = port
+        self.path = path if path.startswith("/") else f"/{path}"
+        self.secret = secret
+        self.url = url.rstrip("/")
+        self.health_port = health_port
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            listen=os.environ.get("WEBHOOK_LISTEN", "0.0.0.0").strip(),
+            port=int(os.environ.get("PORT", "8080").strip() or 8080),
+            path=os.environ.get("WEBHOOK_PATH", "/telegram").strip(),
+            secret=os.environ.get("WEBHOOK_SECRET", "").strip(),
+            url=os.environ.get("WEBHOOK_URL", "").strip(),
+            health_port=int(os.environ.get("HEALTH_PORT", "0").strip() or 0),
+        )
+
+
+class HttpServer:
+    """HTTP server tối giản trên asyncio (không cần tornado/aiohttp).
+
+    Mỗi route là `async def handler(headers, body) -> (status, content_type, body)`.
+    Mỗi kết nối xử lý một request rồi đóng.
+    """
+
+    def __init__(self, listen: str, port: int):
+        self.listen = listen
+        self.port = port
+        self._routes = {}
+        self._server = None
+
+    def route(self, method: str, path: str, handler):
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.listen, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        parts = request_line.decode("latin-1").split()
+        if len(parts) < 2:
+            return None
+        method, target = parts[0].upper(), parts[1]
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, target.split("?", 1)[0], headers, body
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                request = await asyncio.wait_for(
+                    self._read_request(reader), READ_TIMEOUT_SECONDS
+                )
+            except ValueError:
+                status, content_type, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "text/plain", b""
+            else:
+                if request is None:
+                    return
+                method, path, headers, body = request
+                handler = self._routes.get((method, path))
+                if handler is None:
+                    status, content_type, payload = HTTPStatus.NOT_FOUND, "text/plain", b""
+                else:
+                    try:
+                        status, content_type, payload = await handler(headers, body)
+                    except Exception as e:
+                        print(f"[HTTP_HANDLER_ERROR] {method} {path}: {e}")
+                        status, content_type, payload = (
+                            HTTPStatus.INTERNAL_SERVER_ERROR,
+                            "text/plain",
+                            b"",
+                        )
+
+            writer.write(
+                (
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: close\r\n\r\n"
+                ).encode("latin-1")
+                + payload
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class ShardRouter:
+    """Chia update giữa nhiều replica theo user_id (user_id % số replica).
+
+    Telegram chỉ gửi webhook tới một URL (thường qua load balancer), nên replica
+    nhận được update của người dùng thuộc replica khác sẽ chuyển tiếp nguyên body
+    tới replica đó. Mọi update của một người vì thế do cùng một replica xử lý
+    theo đúng thứ tự. Nếu không chuyển được (replica kia đang khởi động lại),
+    replica hiện tại tự xử lý; giỏ hàng và bước /order vẫn đúng khi các replica
+    dùng chung state backend (STATE_BACKEND_URL=redis://...).
+
+    Update của admin (người/chat trong `shard_pinned` của app) luôn về replica
+    chủ OWNER, nơi duy nhất đổi trạng thái đơn và báo khách. Nếu replica chủ
+    không nhận, update đó bị trả 503 để Telegram gửi lại, thay vì để một replica
+    khác ghi thay.
+
+    Chỉ dùng ở chế độ webhook: Telegram không cho nhiều tiến trình cùng polling.
+    """
+
+    FORWARDED_HEADER = "X-Shard-Forwarded"
+    OWNER = 0
+
+    def __init__(self, index: int, urls: list, timeout: float = 5):
+        if not 0 <= index < len(urls):
+            raise ValueError(f"SHARD_INDEX {index} out of range for {len(urls)} SHARD_URLS")
+        self.index = index
+        self.urls = [url.rstrip("/") for url in urls]
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls):
+        urls = [url.strip() for url in os.environ.get("SHARD_URLS", "").split(",") if url.strip()]
+        if len(urls) < 2:
+            return None
+        return cls(int(os.environ.get("SHARD_INDEX", "0").strip() or 0), urls)
+
+    @classmethod
+    def owner_here(cls) -> bool:
+        """True nếu tiến trình này là replica chủ (hoặc không chia replica)."""
+        router = cls.from_env()
+        return router is None or router.index == cls.OWNER
+
+    @staticmethod
+    def is_pinned(update: Update, pinned) -> bool:
+        """True nếu người gửi hoặc chat của update có id trong `pinned`."""
+        return any(
+            who is not None and who.id in pinned
+            for who in (update.effective_user, update.effective_chat)
+        )
+
+    def shard_of(self, update: Update, pinned=()):
+        """Replica phụ trách update, hoặc None nếu update không gắn người dùng/chat.
+
+        Update của người dùng hoặc chat có id trong `pinned` luôn về OWNER.
+        """
+        if self.is_pinned(update, pinned):
+            return self.OWNER
+        owner = update.effective_user or update.effective_chat
+        if owner is None:
+            return None
+        return owner.id % len(self.urls)
+
+    async def forward(self, shard: int, path: str, body: bytes, secret: str) -> bool:
+        """POST nguyên body tới replica `shard`; True nếu replica đó trả 200."""
+        target = urllib.parse.urlsplit(self.urls[shard] + path)
+        request = (
+            f"POST {target.path} HTTP/1.1\r\n"
+            f"Host: {target.netloc}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"{self.FORWARDED_HEADER}: {self.index}\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1") + body
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(target.hostname, target.port or 80), self.timeout
+            )
+            writer.write(request)
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+            parts = status_line.split()
+            return len(parts) >= 2 and parts[1] == b"200"
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"[SHARD_FORWARD_ERROR] shard {shard}: {e!r}")
+            return False
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+def telegram_update_handler(app, secret: str, path: str = "", router: ShardRouter = None):
+    """Route nhận Update JSON từ Telegram và đưa vào update_queue của app.
+
+    Request không mang đúng `secret` bị từ chối. Có `router` thì update thuộc
+    replica khác được chuyển tiếp tới replica đó (xem ShardRouter).
+    """
+    if not secret:
+        raise ValueError("webhook secret is required")
+
+    async def handle(headers, body):
+        if not hmac.compare_digest(
+            headers.get("x-telegram-bot-api-secret-token", "").encode("utf-8"),
+            secret.encode("utf-8"),
+        ):
+            return HTTPStatus.FORBIDDEN, "text/plain", b""
+        try:
+            data = json.loads(body.decode("utf-8"))
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, "text/plain", b""
+
+        update = Update.de_json(data, app.bot)
+        if update is None:
+            return HTTPStatus.BAD_REQUEST, "text/plain", b""
+        if router is not None and ShardRouter.FORWARDED_HEADER.lower() not in headers:
+            pinned = getattr(app, "shard_pinned", ())
+            shard = router.shard_of(update, pinned)
+            if shard is not None and shard != router.index:
+                if await router.forward(shard, path, body, secret):
+                    return HTTPStatus.OK, "text/plain", b""
+                if router.is_pinned(update, pinned):
+                    # Update admin chỉ được xử lý ở replica chủ; Telegram sẽ gửi lại
+                    return HTTPStatus.SERVICE_UNAVAILABLE, "text/plain", b""
+        await app.update_queue.put(update)
+        return HTTPStatus.OK, "text/plain", b""
+
+    return handle
+
+
+async def serve(
+    app, mode: str, config: WebhookConfig, drop_pending_updates: bool = False, routes=()
+):
+    """Chạy app (polling hoặc webhook) cho tới khi nhận SIGINT/SIGTERM.
+
+    `routes` là các (method, path, handler) phụ, VD: endpoint health/readiness.
+    Ở chế độ webhook chúng dùng chung server với endpoint Telegram; ở chế độ
+    polling chỉ được phục vụ khi có HEALTH_PORT.
+    """
+    await serve_all(
+        [(app, config.path, config.secret)], mode, config, drop_pending_updates, routes
+    )
+
+
+async def serve_all(
+    apps: list, mode: str, config: WebhookConfig, drop_pending_updates: bool = False, routes=()
+):
+    """Như serve(), cho nhiều app trong cùng tiến trình (VD: nhiều cửa hàng).
+
+    `apps` là các (app, webhook_path, secret); ở chế độ webhook mỗi app có một
+    đường dẫn riêng trên cùng một server. Có SHARD_URLS thì update được chia
+    giữa các replica (xem ShardRouter).
+
+    Ở chế độ webhook, app nào không có secret thì không khởi động: không có nó
+    ai biết đường dẫn cũng gửi được update giả (kể cả lệnh admin).
+    """
+    server = None
+    if mode == "webhook":
+        missing = [path for _, path, secret in apps if not secret]
+        if missing:
+            raise RuntimeError(
+                f"WEBHOOK_SECRET is required in webhook mode (missing for {', '.join(missing)})"
+            )
+        server = HttpServer(config.listen, config.port)
+        router = ShardRouter.from_env()
+        if router is not None:
+            print(f"[SHARD] replica {router.index} of {len(router.urls)}")
+        for app, path, secret in apps:
+            server.route("POST", path, telegram_update_handler(app, secret, path, router))
+    elif config.health_port:
+        server = HttpServer(config.listen, config.health_port)
+    if server is not None:
+        for method, path, handler in routes:
+            server.route(method, path, handler)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    started = []
+    try:
+        if server is not None:
+            await server.start()
+            print(f"[HTTP] listening on {server.listen}:{server.port}")
+        for app, path, secret in apps:
+            started.append(app)
+            await app.initialize()
+            if app.post_init:
+                await app.post_init(app)
+            if mode == "webhook":
+                if config.url:
+                    await app.bot.set_webhook(
+                        url=config.url + path,
+                        secret_token=secret,
+                        allowed_updates=Update.ALL_TYPES,
+                        drop_pending_updates=False,
+                    )
+            else:
+                await app.updater.start_polling(drop_pending_updates=drop_pending_updates)
+            await app.start()
+        await stop.wait()
+    finally:
+        if server is not None:
+            await server.stop()
+        for app in reversed(started):
+            if app.updater and app.updater.running:
+                await app.updater.stop()
+            if app.running:
+                await app.stop()
+            await app.shutdown()
+            if app.post_shutdown:
+                await app.post_shutdown(app)
+
+
+def run_app(app, drop_pending_updates: bool = False, routes=()):
+    """Chạy app theo BOT_MODE: polling (mặc định) hoặc webhook.
+
+    Ở chế độ webhook, update đang chờ luôn được giữ lại.
+    """
+    mode = os.environ.get("BOT_MODE", "polling").strip().lower()
+    config = WebhookConfig.from_env()
+    if mode == "webhook":
+        drop_pending_updates = False
+    elif not config.health_port:
+        app.run_polling(drop_pending_updates=drop_pending_updates)
+        return
+    asyncio.run(serve(app, mode, config, drop_pending_updates, routes))